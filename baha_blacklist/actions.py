@@ -69,8 +69,21 @@ if __name__ == "__main__":
         logger.error("登入失敗，程式終止")
         sys.exit(0)
 
+    # CI 不保留 data_dir, 以 repo 中上次提交的匯出檔案作為比較的基準
+    if os.path.exists(config.blacklist_dest):
+        with open(config.blacklist_dest, encoding="utf-8") as f:
+            api.snapshots.seed(line.strip() for line in f if line.strip())
+
     logger.info("開始匯出黑名單...")
-    existing_users = api.export_users()
-    logger.info(f"黑名單匯出成功, 總共匯出 {len(existing_users)} 個名單")
-    write_users(config.blacklist_dest, existing_users)
+    if (synced := api.sync_snapshot()) is None:
+        logger.error("黑名單匯出失敗，保留原本的檔案")
+        sys.exit(1)
+    existing_users, delta = synced
+    if delta or not os.path.exists(config.blacklist_dest):
+        write_users(config.blacklist_dest, existing_users)
+        logger.info(f"黑名單匯出成功, 總共匯出 {len(existing_users)} 個名單, {delta}")
+    else:
+        logger.info("黑名單沒有變更，不重新寫入檔案")
+    api.save_session()
+    api.write_metrics()
     logger.info("黑名單匯出結束\n")
@@ -0,0 +1,402 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any, TypeVar
+
+from curl_cffi.requests import Response
+
+from .gamer_api import GamerAPIExtended, UserInfo
+from .models import logger_time_fmt
+from .results import BatchResult, Outcome, Status
+from .retry import CircuitOpenError
+from .scoring import parse_policy
+from .session import AsyncGamerSession
+from .tokens import is_token_error
+
+logger = logging.getLogger("baha_blacklist")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class AsyncScheduler:
+    """限制同時處理的用戶數量, 請求速率則由 session 共用的速率限制器控制"""
+
+    def __init__(self, concurrency: int) -> None:
+        """
+        Args:
+            concurrency: 同時處理的用戶數量上限
+        """
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def map(self, func: Callable[[T], Awaitable[R]], items: Iterable[T]) -> list[R]:
+        """在併發上限內對每個項目執行 func, 任一項目拋出例外時取消其餘工作"""
+
+        async def worker(item: T) -> R:
+            async with self._semaphore:
+                return await func(item)
+
+        tasks = [asyncio.ensure_future(worker(item)) for item in items]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def pipeline(
+        self,
+        fetch: Callable[[T], Awaitable[R]],
+        consume: Callable[[T, R], Awaitable[None]],
+        items: Iterable[T],
+        depth: int,
+    ) -> None:
+        """兩段式管線: fetch 的結果放入容量為 depth 的佇列, 由另一組 worker 以 consume 處理
+
+        佇列已滿時 fetch 暫停, 兩段各自最多 concurrency 個工作同時進行。
+        """
+        queue: asyncio.Queue[tuple[T, R] | None] = asyncio.Queue(depth)
+
+        async def produce(item: T) -> None:
+            await queue.put((item, await fetch(item)))
+
+        async def producer() -> None:
+            await self.map(produce, items)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def consumer() -> None:
+            while (entry := await queue.get()) is not None:
+                await consume(*entry)
+
+        tasks = [asyncio.ensure_future(producer())]
+        tasks += [asyncio.ensure_future(consumer()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+class AsyncGamerAPI:
+    """GamerAPIExtended 的非同步版本, 以 AsyncSession 併發處理新增、移除和讀取用戶資訊
+
+    沿用已登入的 GamerAPIExtended 的 cookies 和 headers, 需要以 async with 建立 session:
+
+        async with AsyncGamerAPI(api) as async_api:
+            await async_api.add_users(uids, existing_users)
+    """
+
+    def __init__(self, api: GamerAPIExtended) -> None:
+        self.api = api
+        self.config = api.config
+        self.logger = logger
+        self.scheduler = AsyncScheduler(self.config.concurrency)
+        self.session: AsyncGamerSession | None = None
+
+    async def __aenter__(self) -> "AsyncGamerAPI":
+        self.session = AsyncGamerSession(
+            headers=self.api.headers,
+            cookies=self.api.session.cookies,
+            impersonate=self.config.browser,
+            rate_limiter=self.api.rate_limiter,
+            retry_policy=self.api.retry_policy,
+            circuit_breaker=self.api.circuit_breaker,
+            metrics=self.api.metrics,
+            cassette=self.api.cassette,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> Response:
+        if self.session is None:
+            raise RuntimeError("AsyncGamerAPI 必須在 async with 區塊中使用")
+        response = await self.session.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def _ensure_global_csrf(self) -> None:
+        csrf_token = await asyncio.to_thread(self.api.global_csrf.get)
+        if self.session is not None:
+            self.session.headers.update({"x-bahamut-csrf-token": csrf_token})
+            self.session.cookies.set("ckBahamutCsrfToken", csrf_token)
+
+    async def add_user(
+        self,
+        uid: str,
+        category: str = "bad",
+        category_mapping: dict[str, str] = {"bad": "加入黑名單"},
+    ) -> Outcome:
+        self.logger.debug("正在將 %s %s", uid, category_mapping[category])
+        if self.session is None:
+            raise RuntimeError("AsyncGamerAPI 必須在 async with 區塊中使用")
+        data = {"uid": uid, "category": category}
+        csrf_token = self.api.csrf_token
+        response = await self.session.post(self.api.friend_add_url, data=data)
+        if self.api.add_success_msg not in response.text and is_token_error(
+            response.status_code, response.text
+        ):
+            self.api.global_csrf.invalidate(csrf_token)
+            await self._ensure_global_csrf()
+            response = await self.session.post(self.api.friend_add_url, data=data)
+        response.raise_for_status()
+        result = str(response.json().get("data"))
+        if self.api.add_success_msg in result:
+            self.logger.debug("用戶 %s %s 操作成功: %s", uid, category_mapping[category], result)
+            return Outcome(Status.ADDED)
+        self.logger.info(f"用戶 {uid} {category_mapping[category]} 操作失敗: {result}")
+        return Outcome(Status.REJECTED, result)
+
+    async def add_users(
+        self,
+        uids: list[str],
+        skipped_users: Iterable[str] = (),
+        category: str = "bad",
+        category_mapping: dict[str, str] = {"bad": "加入黑名單"},
+    ) -> BatchResult:
+        """併發新增用戶, 跳過已經在用戶列表中的用戶, 連續失敗三次時中止所有工作"""
+        results = BatchResult()
+        skipped = set(skipped_users)
+        pending = []
+        for uid in uids:
+            if uid in skipped:
+                results.add(uid, Status.PRESENT)
+            else:
+                pending.append(uid)
+
+        total_users = len(uids)
+        done = 0
+        consecutive_errors = 0
+        self.logger.info(
+            f"開始進行用戶 {category_mapping[category]} 操作，共 {total_users} 個用戶，"
+            f"其中 {len(results)} 個已存在清單中"
+        )
+        if pending:
+            await self._ensure_global_csrf()
+        journal = self.api.journal
+        batch_id = journal.begin("add", pending, category=category)
+
+        async def worker(uid: str) -> None:
+            nonlocal done, consecutive_errors
+            if consecutive_errors >= 3:
+                raise Exception("連續操作失敗三次，系統中止")
+            try:
+                results.add_outcome(uid, await self.add_user(uid, category, category_mapping))
+                journal.record(batch_id, uid)
+                consecutive_errors = 0
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                consecutive_errors += 1
+                results.add(uid, Status.ERROR, str(e))
+                journal.record(batch_id, uid, ok=False)
+                self.logger.error(f"用戶 {uid} 處理失敗: {e}")
+            done += 1
+            self.logger.info("處理進度: %s/%s", done, len(pending))
+
+        try:
+            await self.scheduler.map(worker, pending)
+        except Exception as e:
+            self.logger.error(f"{e} ({done}/{len(pending)})")
+            raise
+        journal.end(batch_id)
+
+        self.logger.info(f"用戶新增完成，{results}")
+        self.api.metrics.record_results("add", results)
+        self.api.log_request_stats()
+        return results
+
+    async def get_user_info(self, uid: str) -> UserInfo:
+        user_info = await self.api.user_infos.aget(uid, self._fetch_user_info)
+        return user_info or self.api.default_user_info(uid)
+
+    async def _fetch_user_info(self, uid: str) -> UserInfo | None:
+        self.logger.debug("開始讀取用戶 %s 資訊", uid)
+        try:
+            response = await self._request("GET", self.api.user_info_url(uid))
+            return self.api.parse_user_info(uid, response.json())
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self.logger.error(f"取得用戶 {uid} 資訊時讀取失敗: {e}")
+        return None
+
+    async def _get_temp_csrf(self) -> str:
+        self.logger.debug("開始取得 friendList CSRF Token")
+        response = await self._request(
+            "GET", self.api.temp_csrf_url, headers=self.api._temp_csrf_headers()
+        )
+        csrf_token = response.text.strip()
+        if not csrf_token:
+            raise Exception("CSRF Token 取得失敗，請更新 cookies 文件")
+        return csrf_token
+
+    async def remove_user(self, uid: str) -> Outcome:
+        self.logger.debug("開始移除用戶 %s", uid)
+        temp_csrf = self.api.temp_csrf
+        csrf_token = await temp_csrf.aget(self._get_temp_csrf)
+        response = await self._post_remove(uid, csrf_token)
+        if self.api.remove_success_msg not in response.text and is_token_error(
+            response.status_code, response.text
+        ):
+            temp_csrf.invalidate(csrf_token)
+            csrf_token = await temp_csrf.aget(self._get_temp_csrf)
+            response = await self._post_remove(uid, csrf_token)
+        response.raise_for_status()
+        result = response.text
+        if self.api.remove_success_msg in result:
+            self.logger.debug("用戶 %s 移除成功: %s", uid, result)
+            return Outcome(Status.REMOVED)
+        self.logger.info(f"用戶 {uid} 移除失敗: {result}")
+        return Outcome(Status.REJECTED, result)
+
+    async def _post_remove(self, uid: str, csrf_token: str) -> Response:
+        if self.session is None:
+            raise RuntimeError("AsyncGamerAPI 必須在 async with 區塊中使用")
+        data = {"fid": uid, "token": csrf_token}
+        return await self.session.post(self.api.friend_del_url, data=data)
+
+    async def remove_users(self, uids: list[str]) -> BatchResult:
+        return await self._run_removal("remove", uids, self.remove_user)
+
+    async def smart_remove_user(
+        self, uid: str, min_visits: int = 50, min_days: int = 60
+    ) -> Outcome:
+        return await self.remove_if_inactive(await self.get_user_info(uid), min_visits, min_days)
+
+    async def remove_if_inactive(
+        self, user_info: UserInfo, min_visits: int, min_days: int
+    ) -> Outcome:
+        reasons, _ = self.api.removal_reasons(user_info, min_visits, min_days)
+        return await self.apply_removal(user_info, ", ".join(reasons) or None)
+
+    async def apply_removal(self, user_info: UserInfo, reason: str | None) -> Outcome:
+        uid = user_info.uid
+        self.logger.debug("用戶資訊: %s", user_info)
+        if reason is not None:
+            outcome = await self.remove_user(uid)
+            self.logger.debug("用戶 %s 已移除: %s, 處理結果: %s", uid, reason, outcome.status.label)
+            return outcome
+        self.logger.debug(
+            "用戶 %s 已保留 (上站次數: %s, 上站日期: %s)",
+            uid,
+            user_info.visit_count,
+            user_info.last_login.strftime(logger_time_fmt),
+        )
+        return Outcome(Status.KEPT)
+
+    async def smart_remove_users(
+        self,
+        uids: list[str],
+        min_visits: int = 50,
+        min_days: int = 60,
+        policy: str = "threshold",
+        victims: list[str] | None = None,
+    ) -> BatchResult:
+        """讀取用戶資訊和移除用戶分成兩段管線, 讀取後面用戶的同時移除前面不符合條件的用戶
+
+        快取中的用戶先一次評估, 不會再送出請求, 流程同 GamerAPIExtended.smart_remove_users。
+        """
+        results = BatchResult()
+        total_users = len(uids)
+        done = 0
+        removal = parse_policy(policy, min_visits, min_days)
+        self.logger.info(f"開始移除用戶，共 {total_users} 個用戶，移除規則為：「{removal}」")
+        known = self.api.cached_user_infos(uids)
+        if victims is not None:
+            chosen = self.api.replay_removals(victims)
+        else:
+            if missing := self.api.missing_for_policy(uids, known, removal):
+                infos = await self.scheduler.map(self.get_user_info, missing)
+                known.update(zip(missing, infos, strict=True))
+            chosen = self.api.evaluate_removals(known, removal)
+        journal = self.api.journal
+        batch_id = journal.begin(
+            "smart_remove",
+            uids,
+            **self.api.removal_params(
+                uids, removal, chosen, min_visits=min_visits, min_days=min_days, policy=policy
+            ),
+        )
+
+        async def fetch(uid: str) -> UserInfo:
+            return known[uid] if uid in known else await self.get_user_info(uid)
+
+        async def consume(uid: str, user_info: UserInfo) -> None:
+            nonlocal done
+            try:
+                if uid in known or not removal.per_user:
+                    remove = uid in chosen
+                else:
+                    remove = removal.removes(user_info)
+                reason = str(removal) if remove else None
+                results.add_outcome(uid, await self.apply_removal(user_info, reason))
+                journal.record(batch_id, uid)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                results.add(uid, Status.ERROR, str(e))
+                journal.record(batch_id, uid, ok=False)
+                self.logger.error(f"用戶 {uid} 移除失敗: {e}")
+            done += 1
+            self.logger.info("移除進度: %s/%s", done, total_users)
+
+        await self.scheduler.pipeline(fetch, consume, uids, self.config.prefetch_size)
+        journal.end(batch_id)
+        self.logger.info(f"用戶移除完成，{results}")
+        self.api.metrics.record_results("smart_remove", results)
+        self.api.log_request_stats()
+        return results
+
+    async def _run_removal(
+        self,
+        op: str,
+        uids: list[str],
+        remove: Callable[[str], Awaitable[Outcome]],
+        **params: Any,
+    ) -> BatchResult:
+        results = BatchResult()
+        total_users = len(uids)
+        done = 0
+        self.logger.info(f"開始移除用戶，共 {total_users} 個用戶")
+        journal = self.api.journal
+        batch_id = journal.begin(op, uids, **params)
+
+        async def worker(uid: str) -> None:
+            nonlocal done
+            try:
+                results.add_outcome(uid, await remove(uid))
+                journal.record(batch_id, uid)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                results.add(uid, Status.ERROR, str(e))
+                journal.record(batch_id, uid, ok=False)
+                self.logger.error(f"用戶 {uid} 移除失敗: {e}")
+            done += 1
+            self.logger.info("移除進度: %s/%s", done, total_users)
+
+        await self.scheduler.map(worker, uids)
+        journal.end(batch_id)
+        self.logger.info(f"用戶移除完成，{results}")
+        self.api.metrics.record_results(op, results)
+        self.api.log_request_stats()
+        return results
+
+
+def run_async(api: GamerAPIExtended, job: Callable[[AsyncGamerAPI], Awaitable[T]]) -> T:
+    """在新的事件迴圈中以 AsyncGamerAPI 執行 job, 供同步程式碼呼叫"""
+
+    async def runner() -> T:
+        async with AsyncGamerAPI(api) as async_api:
+            return await job(async_api)
+
+    return asyncio.run(runner())
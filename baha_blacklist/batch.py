@@ -0,0 +1,158 @@
+import json
+import logging
+import multiprocessing
+import os
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+from typing import Any
+
+from .config import Config, ConfigLoader
+from .gamer_api import GamerAPIExtended
+from .logger import setup_logging, stop_logging
+from .main import handle_errors, real_main
+from .ratelimit import AdaptiveRateLimiter
+from .retry import CircuitBreaker, RetryPolicy
+from .session import GamerSession
+from .sources import SourceAggregator, SourceFetcher, SourceIndex, SourceResult
+
+logger = logging.getLogger("baha_blacklist")
+
+
+def load_accounts(path: str) -> list[dict[str, Any]]:
+    """讀取帳號清單, 內容為 JSON 陣列, 每個項目是帳號名稱或是覆寫設定值的物件
+
+    [
+        "account_a",
+        {"account": "account_b", "password": "...", "min_day": 180}
+    ]
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} 必須是非空的 JSON 陣列")
+
+    accounts = [{"account": entry} if isinstance(entry, str) else entry for entry in entries]
+    if not all(isinstance(entry, dict) and entry.get("account") for entry in accounts):
+        raise ValueError(f"{path} 中的每個項目都必須指定 account")
+    names = [entry["account"] for entry in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path} 中有重複的帳號")
+    return accounts
+
+
+def account_configs(
+    accounts: list[dict[str, Any]],
+    json_config: dict[str, Any],
+    cli_config: dict[str, Any],
+) -> list[Config]:
+    """為每個帳號建立 Config, 優先順序為帳號設定 > CLI 參數 > config.json
+
+    data_dir 和匯出檔案以 CLI 參數和 config.json 合併後的值為基準, 一律加上帳號名稱, 避免多個
+    程序寫入同一個檔案, 只有帳號設定中指定的路徑會原樣使用。
+    """
+    loader = ConfigLoader(Config())
+    base = loader.merge_configs(("json_config", json_config), ("cli_config", cli_config))
+    dest_root, dest_ext = os.path.splitext(base.blacklist_dest)
+
+    configs = []
+    for entry in accounts:
+        account = entry["account"]
+        defaults = {
+            "data_dir": os.path.join(base.data_dir, account),
+            "blacklist_dest": f"{dest_root}_{account}{dest_ext}",
+        }
+        config = loader.merge_configs(
+            ("json_config", json_config),
+            ("cli_config", cli_config),
+            ("batch_defaults", defaults),
+            ("account_config", entry),
+        )
+        config.validate()
+        configs.append(config)
+    return configs
+
+
+def prefetch_sources(config: Config) -> tuple[SourceAggregator, list[SourceResult]]:
+    """在主程序讀取一次共用的黑名單來源, 來源快取和索引放在共用的 data_dir"""
+    session = GamerSession(
+        impersonate=config.browser,
+        rate_limiter=AdaptiveRateLimiter.from_config(config),
+        retry_policy=RetryPolicy.from_config(config),
+        circuit_breaker=CircuitBreaker.from_config(config),
+    )
+    fetcher = SourceFetcher(session, os.path.join(config.data_dir, "sources"))
+    index = SourceIndex(os.path.join(config.data_dir, "sources.sqlite3"))
+    aggregator = SourceAggregator(fetcher, index, config.concurrency)
+    return aggregator, aggregator.fetch_all([config.blacklist_src, *config.blacklist_srcs])
+
+
+def run_account(
+    args: Namespace, config: Config, sources: list[SourceResult] | None, loglevel: int
+) -> int:
+    """在子程序中執行單一帳號的完整流程, 每個帳號有各自的登入狀態和速率限制器"""
+    json_path = None
+    if args.log_json:
+        root, ext = os.path.splitext(args.log_json)
+        json_path = f"{root}_{config.account}{ext}"
+    setup_logging(loglevel, json_path=json_path)
+    logger.info(f"帳號 {config.account} 開始執行")
+
+    def job() -> int:
+        try:
+            return real_main(args, config, GamerAPIExtended(config), sources)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+
+    code = handle_errors(job)
+    logger.info(f"帳號 {config.account} 執行結束，結束代碼 {code}")
+    # 子程序結束時不會執行 atexit, 需要自行寫完佇列中的 log
+    stop_logging()
+    return code
+
+
+def run_batch(args: Namespace, config_name: str = "config.json") -> int:
+    """以程序池同時處理多個帳號, 總執行時間取決於最慢的帳號而不是所有帳號的總和"""
+    loglevel = logging.INFO
+    if args.verbose:
+        loglevel = logging.DEBUG
+    if args.quiet:
+        loglevel = logging.WARNING
+    setup_logging(loglevel, json_path=args.log_json)
+
+    loader = ConfigLoader(Config())
+    json_config = loader.load_from_json(str(Path(__file__).parents[1] / config_name))
+    cli_config = {k: v for k, v in vars(args).items() if k not in ("account", "password")}
+    configs = account_configs(load_accounts(args.accounts), json_config, cli_config)
+    base = loader.merge_configs(("json_config", json_config), ("cli_config", cli_config))
+
+    aggregator: SourceAggregator | None = None
+    results: list[SourceResult] = []
+    sources: list[SourceResult] | None = None
+    if "update" in args.mode and not args.resume:
+        aggregator, results = prefetch_sources(base)
+        # 子程序不需要原始內容, 只傳送解析後的用戶ID
+        sources = [replace(result, body="") for result in results]
+
+    logger.info(f"開始批次處理 {len(configs)} 個帳號")
+    # 使用 spawn 避免子程序繼承主程序已建立的 curl 連線
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(configs), mp_context=context) as executor:
+        futures = {
+            config.account: executor.submit(run_account, args, config, sources, loglevel)
+            for config in configs
+        }
+        codes = {account: future.result() for account, future in futures.items()}
+
+    failed = [account for account, code in codes.items() if code != 0]
+    if aggregator is not None:
+        # --plan 不會執行更新, 來源索引維持上次的狀態
+        if not failed and not args.plan:
+            aggregator.commit(results)
+        aggregator.index.close()
+    if failed:
+        logger.error(f"批次處理完成，失敗的帳號: {', '.join(failed)}")
+        return 1
+    logger.info(f"批次處理完成，共 {len(configs)} 個帳號")
+    return 0
@@ -0,0 +1,132 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterable
+from datetime import datetime
+
+from .models import UserInfo
+from .utils import chunked
+
+logger = logging.getLogger("baha_blacklist")
+
+
+class UserInfoCache:
+    """以 uid 為 key 的 UserInfo SQLite 快取
+
+    每筆資料有各自的過期時間, 過期的資料視為不存在; 寫入後資料筆數超過 max_entries 時,
+    會從最早讀取的資料開始移除, 長時間執行時快取也不會無限制地成長。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float,
+        max_entries: int,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        Args:
+            path: SQLite 檔案路徑
+            ttl: 預設的資料有效秒數
+            max_entries: 保留的資料筆數上限
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_info ("
+            "uid TEXT PRIMARY KEY, visit_count INTEGER NOT NULL, last_login TEXT NOT NULL, "
+            "fetched_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS user_info_fetched_at ON user_info (fetched_at)"
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM user_info").fetchone()[0]
+
+    def get(self, uid: str) -> UserInfo | None:
+        """回傳未過期的用戶資訊, 沒有資料或已過期時回傳 None"""
+        return self.get_many([uid]).get(uid)
+
+    def get_many(self, uids: Iterable[str]) -> dict[str, UserInfo]:
+        uids = list(uids)
+        now = self.clock()
+        found: dict[str, UserInfo] = {}
+        with self._lock:
+            for chunk in chunked(uids):
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT uid, visit_count, last_login FROM user_info "
+                    f"WHERE expires_at > ? AND uid IN ({placeholders})",
+                    (now, *chunk),
+                )
+                for uid, visit_count, last_login in rows:
+                    found[uid] = UserInfo(
+                        uid=uid,
+                        visit_count=visit_count,
+                        last_login=datetime.fromisoformat(last_login),
+                    )
+        self.hits += len(found)
+        self.misses += len(uids) - len(found)
+        return found
+
+    def put(self, user_info: UserInfo, ttl: float | None = None) -> None:
+        self.put_many([user_info], ttl)
+
+    def put_many(self, user_infos: Iterable[UserInfo], ttl: float | None = None) -> None:
+        now = self.clock()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        rows = [
+            (info.uid, info.visit_count, info.last_login.isoformat(), now, expires_at)
+            for info in user_infos
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO user_info VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            removed = self._trim()
+            self._conn.commit()
+        if removed:
+            logger.debug(f"用戶資訊快取移除 {removed} 筆超出容量的資料")
+
+    def evict(self) -> int:
+        """移除過期資料以及超過容量上限的最舊資料, 回傳移除的筆數"""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM user_info WHERE expires_at <= ?", (self.clock(),)
+            ).rowcount
+            removed += self._trim()
+            self._conn.commit()
+        if removed:
+            logger.debug(f"用戶資訊快取移除 {removed} 筆過期或超出容量的資料")
+        return removed
+
+    def _trim(self) -> int:
+        """移除超過容量上限的最舊資料, 呼叫時必須持有 _lock"""
+        count = self._conn.execute("SELECT COUNT(*) FROM user_info").fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        return self._conn.execute(
+            "DELETE FROM user_info WHERE uid IN ("
+            "SELECT uid FROM user_info ORDER BY fetched_at LIMIT ?)",
+            (count - self.max_entries,),
+        ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,204 @@
+import base64
+import gzip
+import json
+import logging
+import re
+import threading
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+from urllib.parse import urlencode
+
+from curl_cffi.requests import Response
+
+from .config import Config
+from .utils import atomic_write
+
+logger = logging.getLogger("baha_blacklist")
+
+# 表單中屬於憑證的欄位, 錄製時遮蔽內容, 比對請求時忽略
+SECRET_FIELDS = frozenset({"password", "token"})
+# 保留的回應標頭, 其餘標頭 (包含 set-cookie) 不寫入錄製檔
+KEPT_HEADERS = ("content-type", "content-length", "location", "retry-after")
+REDACTED = "<redacted>"
+# 長度小於此值的字串不視為憑證, 避免遮蔽到一般內容
+MIN_SECRET_LENGTH = 6
+STREAM_CHUNK_SIZE = 16384
+
+
+class CassetteMissError(RuntimeError):
+    """重播時找不到對應的錄製請求"""
+
+
+class CassetteResponse(Response):
+    """從錄製檔重建的回應, stream 模式下以固定大小的區塊回傳內容"""
+
+    def iter_content(
+        self, chunk_size: int | None = None, decode_unicode: bool = False
+    ) -> Iterator[bytes]:  # type: ignore[override]
+        for start in range(0, len(self.content), STREAM_CHUNK_SIZE):
+            yield self.content[start : start + STREAM_CHUNK_SIZE]
+
+    def close(self) -> None:
+        pass
+
+
+class Cassette:
+    """錄製和重播經過 GamerSession 的所有請求, 讓完整執行流程可以離線重現
+
+    錄製檔是 gzip 壓縮的 JSON lines, 每行一個請求。寫入時遮蔽密碼、CSRF Token 和 cookies 的值,
+    出現在網址和回應內容中的相同字串也會被遮蔽。重播時依 method、網址和表單內容 (不含憑證欄位)
+    比對, 同一個請求依錄製順序回傳, 次數超過錄製次數時重複回傳最後一筆。
+    """
+
+    def __init__(self, path: str, replaying: bool, realtime: bool = False) -> None:
+        """
+        Args:
+            path: 錄製檔路徑
+            replaying: True 為重播模式, False 為錄製模式
+            realtime: 重播時是否依錄製時的延遲等待
+        """
+        self.path = path
+        self.replaying = replaying
+        self.realtime = realtime
+        self.entries: list[dict[str, Any]] = []
+        self._secrets: set[str] = set()
+        self._queues: defaultdict[str, deque[dict[str, Any]]] = defaultdict(deque)
+        self._last: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if replaying:
+            self._load()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "Cassette | None":
+        if config.replay_path:
+            return cls(config.replay_path, replaying=True, realtime=config.replay_realtime)
+        if config.record_path:
+            cassette = cls(config.record_path, replaying=False)
+            cassette.add_secrets([config.password])
+            return cassette
+        return None
+
+    def add_secrets(self, values: Iterable[str | None]) -> None:
+        with self._lock:
+            self._secrets.update(v for v in values if v and len(v) >= MIN_SECRET_LENGTH)
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        kwargs: dict[str, Any],
+        response: Response,
+        elapsed: float,
+        secrets: Iterable[str | None] = (),
+    ) -> Response:
+        """記錄一次請求, stream 模式的回應會先讀完內容, 回傳可以照常使用的回應
+
+        Args:
+            secrets: session 中的 cookie 和 CSRF Token 等憑證, 寫入時一律遮蔽
+        """
+        stream = bool(kwargs.get("stream"))
+        if stream:
+            content = b"".join(response.iter_content())
+            response.close()
+        else:
+            content = response.content
+        headers = {k: v for k in KEPT_HEADERS if (v := response.headers.get(k)) is not None}
+        entry: dict[str, Any] = {
+            "key": request_key(method, url, kwargs),
+            "status": response.status_code,
+            "reason": response.reason,
+            "url": str(response.url),
+            "redirect_count": response.redirect_count,
+            "headers": headers,
+            "cookies": dict(response.cookies.items()),
+            "elapsed": elapsed,
+            **_encode_body(content),
+        }
+        form = kwargs.get("data")
+        values = [*secrets, *entry["cookies"].values()]
+        values.append((kwargs.get("headers") or {}).get("x-bahamut-csrf-token"))
+        if isinstance(form, dict):
+            values += [v for k, v in form.items() if k in SECRET_FIELDS and isinstance(v, str)]
+        self.add_secrets(values)
+        with self._lock:
+            self.entries.append(entry)
+        return build_response(entry) if stream else response
+
+    def replay(self, method: str, url: str, kwargs: dict[str, Any]) -> tuple[Response, float]:
+        """回傳錄製的回應以及重播時應該等待的秒數"""
+        key = request_key(method, url, kwargs)
+        with self._lock:
+            if queue := self._queues.get(key):
+                entry = self._last[key] = queue.popleft()
+            elif key in self._last:
+                entry = self._last[key]
+            else:
+                raise CassetteMissError(f"錄製檔 {self.path} 中沒有此請求: {key}")
+        return build_response(entry), entry["elapsed"] if self.realtime else 0.0
+
+    def save(self) -> None:
+        """遮蔽憑證後寫入錄製檔, 先寫入暫存檔再替換"""
+        if self.replaying:
+            return
+        with self._lock:
+            entries, secrets = list(self.entries), sorted(self._secrets, key=len, reverse=True)
+        redact = _redactor(secrets)
+        with atomic_write(self.path, lambda path: gzip.open(path, "wt", encoding="utf-8")) as f:
+            for entry in entries:
+                f.write(redact(json.dumps(entry, ensure_ascii=False)) + "\n")
+        logger.info(f"已錄製 {len(entries)} 個請求: {self.path}")
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.append(entry)
+                self._queues[entry["key"]].append(entry)
+        logger.info(f"已載入 {len(self.entries)} 個錄製的請求: {self.path}")
+
+
+def request_key(method: str, url: str, kwargs: dict[str, Any]) -> str:
+    """以 method、網址和表單內容組成比對用的 key, 忽略憑證欄位和網址前後的空白"""
+    key = f"{method.upper()} {url.strip()}"
+    form = kwargs.get("data")
+    if isinstance(form, dict):
+        fields = sorted((k, str(v)) for k, v in form.items() if k not in SECRET_FIELDS)
+        key += f" {urlencode(fields)}"
+    elif isinstance(form, str | bytes):
+        key += f" {form if isinstance(form, str) else form.decode(errors='replace')}"
+    if (payload := kwargs.get("json")) is not None:
+        key += f" {json.dumps(payload, sort_keys=True, ensure_ascii=False)}"
+    return key
+
+
+def build_response(entry: dict[str, Any]) -> Response:
+    response = CassetteResponse()
+    response.status_code = entry["status"]
+    response.reason = entry["reason"]
+    response.ok = 200 <= entry["status"] < 400
+    response.url = entry["url"]
+    response.redirect_count = entry["redirect_count"]
+    response.headers.update(entry["headers"])
+    response.cookies.update(entry["cookies"])
+    if "body_b64" in entry:
+        response.content = base64.b64decode(entry["body_b64"])
+    else:
+        response.content = entry["body"].encode("utf-8")
+    return response
+
+
+def _encode_body(content: bytes) -> dict[str, str]:
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_b64": base64.b64encode(content).decode("ascii")}
+
+
+def _redactor(secrets: list[str]) -> Callable[[str], str]:
+    if not secrets:
+        return lambda text: text
+    pattern = re.compile(
+        "|".join(re.escape(json.dumps(s, ensure_ascii=False)[1:-1]) for s in secrets)
+    )
+    return lambda text: pattern.sub(REDACTED, text)
@@ -2,10 +2,13 @@ import json
 import logging
 import os
 from argparse import Namespace
-from dataclasses import asdict, dataclass
-from typing import Any
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any
 
-from curl_cffi.requests.impersonate import BrowserTypeLiteral
+from .scoring import parse_policy
+
+if TYPE_CHECKING:
+    from curl_cffi.requests.impersonate import BrowserTypeLiteral
 
 logger = logging.getLogger()
 
@@ -20,13 +23,36 @@ class Config:
     blacklist_src: str = (
         "https://github.com/ZhenShuo2021/baha-blacklist/raw/refs/heads/main/blacklist.txt"
     )
+    blacklist_srcs: list[str] = field(default_factory=list)
     min_sleep: int | float = 1.0
     max_sleep: int | float = 10.0
     min_visit: int = 5
     min_day: int = 1
     friend_num: int = 100
+    clean_policy: str = "threshold"
+    blacklist_cap: int = 1500
     user_agent: str = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-    browser: BrowserTypeLiteral = "chrome131"
+    browser: "BrowserTypeLiteral" = "chrome131"
+    use_async: bool = False
+    concurrency: int = 4
+    rate_limit: float = 0.5
+    backoff_cooldown: float = 5.0
+    prefetch_size: int = 32
+    retry_attempts: int = 3
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 60.0
+    breaker_threshold: int = 5
+    breaker_timeout: float = 60.0
+    data_dir: str = "./.baha_cache"
+    user_info_ttl: int = 7
+    user_info_cache_size: int = 20000
+    session_cache: bool = True
+    snapshot_max_age: int = 0
+    watch_interval: float = 600.0
+    metrics_file: str = "metrics.json"
+    record_path: str = ""
+    replay_path: str = ""
+    replay_realtime: bool = False
 
     def validate(self) -> None:
         # 別忘了修改 actions.py
@@ -36,9 +62,31 @@ class Config:
             )
         if self.min_sleep > self.max_sleep:
             raise ValueError("min_sleep 必須大於 max_sleep.")
+        if self.concurrency < 1:
+            raise ValueError("concurrency 必須大於等於 1")
+        if self.rate_limit <= 0:
+            raise ValueError("rate_limit 必須大於 0")
+        if self.backoff_cooldown < 0:
+            raise ValueError("backoff_cooldown 必須大於等於 0")
+        if self.prefetch_size < 1:
+            raise ValueError("prefetch_size 必須大於等於 1")
+        if self.retry_attempts < 1:
+            raise ValueError("retry_attempts 必須大於等於 1")
+        parse_policy(self.clean_policy, self.min_visit, self.min_day)
+        if self.snapshot_max_age < 0:
+            raise ValueError("snapshot_max_age 必須大於等於 0")
+        if self.watch_interval <= 0:
+            raise ValueError("watch_interval 必須大於 0")
+        if self.record_path and self.replay_path:
+            raise ValueError("record_path 和 replay_path 不能同時設定")
+        if self.breaker_threshold < 1:
+            raise ValueError("breaker_threshold 必須大於等於 1")
 
 
 class ConfigLoader:
+    # 這些清單設定會和前面來源的值合併並去除重複, 例如 --extra-source 是加入 config.json 的來源
+    additive_keys = frozenset({"blacklist_srcs"})
+
     def __init__(self, defaults: Config):
         self.defaults = defaults
 
@@ -106,6 +154,8 @@ class ConfigLoader:
                 # 在合法的 key 中
                 if value is None:
                     continue
+                elif key in self.additive_keys and isinstance(value, list):
+                    valid_keys[key] = list(dict.fromkeys([*valid_keys[key], *value]))
                 elif isinstance(value, type(valid_keys[key])):
                     valid_keys[key] = value
                 else:
@@ -1,32 +1,39 @@
+import contextlib
 import http.cookiejar as cookiejar
 import json
 import logging
-import random
+import os
+import queue
 import re
-import time
-from dataclasses import dataclass
+import threading
+from collections.abc import Iterable, Iterator
 from datetime import datetime
-from typing import Any
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urljoin
 
-from curl_cffi import requests
 from curl_cffi.requests.exceptions import RequestException
-from lxml import html
 
+from .cache import UserInfoCache
+from .cassette import Cassette
 from .config import Config
-from .utils import count_success, decode_response_dict, get_default_user_info
+from .journal import Journal
+from .lookup import UserInfoLookup
+from .metrics import Metrics
+from .models import UserInfo, logger_time_fmt
+from .planner import rank_for_eviction
+from .ratelimit import AdaptiveRateLimiter
+from .results import BatchResult, Outcome, Status
+from .retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from .scoring import RemovalPolicy, parse_policy
+from .session import GamerSession, SessionStore
+from .snapshot import SnapshotDelta, SnapshotStore
+from .tokens import TokenManager, is_token_error
+from .utils import decode_response_dict, get_default_user_info
+
+if TYPE_CHECKING:
+    from lxml import etree
 
 logger = logging.getLogger("baha_blacklist")
-logger_time_fmt = "%Y-%m-%d"
-
-
-@dataclass
-class UserInfo:
-    uid: str
-    visit_count: int
-    last_login: datetime
-
-    def __str__(self) -> str:
-        return f"UserInfo(uid={self.uid}, visit_count={self.visit_count}, last_login={self.last_login.strftime(logger_time_fmt)})"
 
 
 class GamerLogin:
@@ -37,23 +44,97 @@ class GamerLogin:
     def __init__(self, config: Config) -> None:
         self.logger = logger
         self.config = config
+        self.rate_limiter = AdaptiveRateLimiter.from_config(config)
+        self.retry_policy = RetryPolicy.from_config(config)
+        self.circuit_breaker = CircuitBreaker.from_config(config)
+        self.metrics = Metrics()
+        self.cassette = Cassette.from_config(config)
         self.session = self.new_session()
-        self.csrf_token = None
+        self.csrf_token: str | None = None
         self.login_methods = [self.login_password, self.login_cookies]
         if config.cookies_first:
             self.login_methods.reverse()
+        self.session_store = (
+            SessionStore(os.path.join(config.data_dir, f"session_{config.account}.json"))
+            if config.session_cache
+            else None
+        )
 
     def login(self) -> bool:
+        with self.metrics.timer("login"):
+            return self._login()
+
+    def _login(self) -> bool:
         self.logger.debug("開始登入...")
+        if self.login_saved_session():
+            self.logger.debug("沿用保存的登入狀態")
+            return True
+
         for method in self.login_methods:
             if method():
                 self.logger.debug(f"{method.__name__} 登入成功")
+                self.save_session()
                 return True
             self.logger.debug(f"{method.__name__} 登入失敗")
 
         self.logger.error("所有登入方式皆失敗，程式終止")
         return False
 
+    def ensure_login(self) -> bool:
+        """長時間執行時確認登入狀態仍有效, 失效時才捨棄 session 和 CSRF Token 重新登入"""
+        if self.login_success():
+            return True
+        self.logger.info("登入狀態已失效，重新登入")
+        self.reset_session()
+        return self.login()
+
+    def reset_session(self) -> None:
+        self.csrf_token = None
+        self.session = self.new_session()
+
+    def login_saved_session(self) -> bool:
+        """載入上次保存的 cookies 和 CSRF Token, 只用一次請求確認是否仍然有效"""
+        if not self.session_store:
+            return False
+        try:
+            csrf_token = self.session_store.load(self.session)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"保存的登入狀態無法讀取，改用完整登入流程: {e}")
+            self.session_store.clear()
+            self.session = self.new_session()
+            return False
+
+        if self.login_success():
+            if csrf_token:
+                self.csrf_token = csrf_token
+                self.session.headers.update({"x-bahamut-csrf-token": csrf_token})
+                self.headers["x-bahamut-csrf-token"] = csrf_token
+            return True
+
+        self.logger.debug("保存的登入狀態已失效，改用完整登入流程")
+        self.session_store.clear()
+        self.session = self.new_session()
+        return False
+
+    def log_request_stats(self) -> None:
+        self.logger.info(f"速率限制器狀態: {self.rate_limiter}")
+        self.logger.info(f"重試統計: {self.retry_policy}；{self.circuit_breaker}")
+
+    def write_metrics(self) -> None:
+        """把本次執行的指標寫入 data_dir/metrics_file, metrics_file 為空時不寫入"""
+        if self.config.metrics_file:
+            self.metrics.write(os.path.join(self.config.data_dir, self.config.metrics_file))
+
+    def save_cassette(self) -> None:
+        if self.cassette is not None:
+            self.cassette.save()
+
+    def save_session(self) -> None:
+        if self.session_store:
+            self.session_store.save(self.session, self.csrf_token)
+
     def login_cookies(self) -> bool:
         cookie_jar = cookiejar.MozillaCookieJar(self.config.cookie_path)
         cookie_jar.load()
@@ -85,14 +166,22 @@ class GamerLogin:
         self.logger.debug(f"登入狀態檢查結果: {'成功' if login_status else '失敗'}")
         return login_status
 
-    def new_session(self, headers: dict[str, str] = {}) -> requests.Session:
+    def new_session(self, headers: dict[str, str] = {}) -> GamerSession:
         default_headers = {
             "user-agent": self.config.user_agent,
             "accept-encoding": "gzip, deflate, br, zstd",
             "accept-language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
         }
         self.headers = headers or default_headers
-        return requests.Session(headers=self.headers, impersonate=self.config.browser)
+        return GamerSession(
+            headers=self.headers,
+            impersonate=self.config.browser,
+            rate_limiter=self.rate_limiter,
+            retry_policy=self.retry_policy,
+            circuit_breaker=self.circuit_breaker,
+            metrics=self.metrics,
+            cassette=self.cassette,
+        )
 
     def __login_password_phase1(self, fake_cookie: dict[str, str]) -> str | None:
         """登入前置步驟"""
@@ -122,61 +211,108 @@ class GamerAPI(GamerLogin):
     """基本API類別, 用於添加用戶(添加黑名單、好友等)以及匯出用戶列表"""
 
     friend_add_url = "https://api.gamer.com.tw/user/v1/friend_add.php"  # 新版api
+    add_success_msg = "成功"
+    temp_csrf_url = "https://home.gamer.com.tw/ajax/getCSRFToken.php"
 
     def __init__(self, config: Config) -> None:
+        # 必須在 GamerLogin.__init__ 設定 csrf_token 之前建立
+        self.global_csrf = TokenManager("全域 CSRF Token", self._update_global_csrf)
+        self.temp_csrf = TokenManager("friendList CSRF Token", self._get_temp_csrf)
         super().__init__(config)
+        self.user_info_cache = self.new_user_info_cache()
+        self.user_infos = UserInfoLookup(
+            self.fetch_user_info,
+            self.user_info_cache,
+            max_entries=config.user_info_cache_size,
+            max_workers=config.concurrency,
+        )
+        self.journal = Journal(os.path.join(config.data_dir, f"journal_{config.account}.jsonl"))
+        self.snapshots = SnapshotStore(
+            os.path.join(config.data_dir, f"snapshot_{config.account}.jsonl")
+        )
+
+    @property  # type: ignore[override]
+    def csrf_token(self) -> str | None:
+        return self.global_csrf.token
+
+    @csrf_token.setter
+    def csrf_token(self, token: str | None) -> None:
+        self.global_csrf.token = token
+
+    def reset_session(self) -> None:
+        self.temp_csrf.invalidate()
+        super().reset_session()
+
+    def log_request_stats(self) -> None:
+        super().log_request_stats()
+        self.logger.info(str(self.user_infos))
+
+    def new_user_info_cache(self) -> UserInfoCache | None:
+        """建立用戶資訊快取, user_info_ttl 設為 0 時停用"""
+        if self.config.user_info_ttl <= 0:
+            return None
+        path = os.path.join(self.config.data_dir, "user_info.sqlite3")
+        cache = UserInfoCache(
+            path,
+            ttl=self.config.user_info_ttl * 86400,
+            max_entries=self.config.user_info_cache_size,
+        )
+        cache.evict()
+        return cache
 
     def add_user(
         self,
         uid: str,
         category: str = "bad",
         category_mapping: dict[str, str] = {"bad": "加入黑名單"},
-    ) -> str:
+    ) -> Outcome:
         """
         Args:
             uid: 將要處理的用戶ID
             category: 發送給api的分類，預設加入黑名單 (bad)
         """
-        self.logger.debug(f"正在將 {uid} {category_mapping[category]}")
-        add_success_msg = "成功"
-
-        if not self.csrf_token:
-            self._update_global_csrf()
+        self.logger.debug("正在將 %s %s", uid, category_mapping[category])
         data = {"uid": uid, "category": category}
 
+        token = self.global_csrf.get()
         response = self.session.post(self.friend_add_url, data=data)
+        if self.add_success_msg not in response.text and is_token_error(
+            response.status_code, response.text
+        ):
+            self.global_csrf.invalidate(token)
+            self.global_csrf.get()
+            response = self.session.post(self.friend_add_url, data=data)
         response.raise_for_status()
         result = str(response.json().get("data"))  # {"data": {"ok": "加入黑名單成功"}}
-        if add_success_msg in result:
-            self.logger.debug(f"用戶 {uid} {category_mapping[category]} 操作成功: {result}")
-        else:
-            self.logger.info(f"用戶 {uid} {category_mapping[category]} 操作失敗: {result}")
-        return result
+        if self.add_success_msg in result:
+            self.logger.debug("用戶 %s %s 操作成功: %s", uid, category_mapping[category], result)
+            return Outcome(Status.ADDED)
+        self.logger.info(f"用戶 {uid} {category_mapping[category]} 操作失敗: {result}")
+        return Outcome(Status.REJECTED, result)
 
     def add_users(
         self,
         uids: list[str],
-        skipped_users: list[str],
+        skipped_users: Iterable[str] = (),
         category: str = "bad",
         category_mapping: dict[str, str] = {"bad": "加入黑名單"},
-    ) -> dict[str, str]:
+    ) -> BatchResult:
         """
         從列表新增用戶, 跳過已經在用戶列表(黑名單)中的用戶
 
         Args:
-            uids: 用戶ID列表
-            skipped_users: 清單內的用戶會被跳過避免重複發送請求，預設為既有用戶清單
+            uids: 用戶ID列表, 通常是 planner.plan_update 算出的差異
+            skipped_users: 清單內的用戶會被跳過避免重複發送請求
             category: 操作類型, 預設為 "bad" (加入黑名單)
             category_mapping: 將操作類型映射到 logger 輸出的字典
 
         Returns:
-            Dict[str, str]: 每個用戶ID對應的操作結果
+            BatchResult: 每個用戶ID對應的處理結果
         """
 
-        def should_skip(results: dict[str, str]) -> bool:
-            if uid in skipped_users:
-                self.logger.debug(f"用戶 {uid} 已存在清單中 ({index}/{total_users})")
-                results[uid] = "已存在清單中"
+        def should_skip(results: BatchResult) -> bool:
+            if uid in skipped:
+                results.add(uid, Status.PRESENT)
                 return True
 
             if consecutive_errors >= 3:
@@ -185,32 +321,41 @@ class GamerAPI(GamerLogin):
                 raise Exception(error_msg)
             return False
 
-        results: dict[str, str] = {}
+        results = BatchResult()
         consecutive_errors = 0
         total_users = len(uids)
+        skipped = set(skipped_users)
 
         self.logger.info(f"開始進行用戶 {category_mapping[category]} 操作，共 {total_users} 個用戶")
+        batch_id = self.journal.begin(
+            "add", [uid for uid in uids if uid not in skipped], category=category
+        )
 
         for index, uid in enumerate(uids, 1):
             if should_skip(results):
                 continue
 
             try:
-                result = self.add_user(uid, category)
-                results[uid] = result
-                self.logger.info(f"處理進度: {index}/{total_users}")
+                results.add_outcome(uid, self.add_user(uid, category))
+                self.journal.record(batch_id, uid)
+                self.logger.info("處理進度: %s/%s", index, total_users)
                 consecutive_errors = 0
+            except CircuitOpenError:
+                raise
             except Exception as e:
                 consecutive_errors += 1
-                msg = f"用戶 {uid} 處理失敗: {e} ({index}/{total_users})"
-                results[uid] = msg
-                self.logger.error(msg)
-
-            time.sleep(random.uniform(self.config.min_sleep, self.config.max_sleep))
-
-        self.logger.info(f"用戶新增完成，成功: {count_success(results)}/{total_users}")
+                results.add(uid, Status.ERROR, str(e))
+                self.journal.record(batch_id, uid, ok=False)
+                self.logger.error(f"用戶 {uid} 處理失敗: {e} ({index}/{total_users})")
+
+        self.journal.end(batch_id)
+        self.logger.info(f"用戶新增完成，{results}")
+        self.metrics.record_results("add", results)
+        self.log_request_stats()
         return results
 
+    page_mapping: dict[int, str] = {1: "好友", 2: "待確認", 3: "追蹤", 4: "追蹤者", 5: "黑名單"}
+
     def export_users(self, type_id: int = 5) -> list[str]:
         """
         讀取黑名單列表
@@ -219,98 +364,191 @@ class GamerAPI(GamerLogin):
         Returns:
             list[str]: 黑名單用戶ID列表
         """
-        page_mapping: dict[int, str] = {1: "好友", 2: "待確認", 3: "追蹤", 4: "追蹤者", 5: "黑名單"}
-        acc, list_name = self.config.account, page_mapping[type_id]
-        self.logger.info(f"開始讀取用戶 {acc} 的{list_name}清單")
-        url = f"https://home.gamer.com.tw/friendList.php?user={self.config.account}&t={type_id} "
-
+        acc, list_name = self.config.account, self.page_mapping[type_id]
         try:
-            response = self.session.get(url)
-            response.raise_for_status()
-            tree = html.fromstring(response.text)
-            user_ids = tree.xpath("//div[@class='user_id']/@data-origin")
-            if not user_ids:
-                self.logger.info(f"用戶 {acc} 的{list_name}清單沒有資料")
-                return []
-
-            self.logger.info(f"成功讀取清單，共 {len(user_ids)} 筆資料")
-            return user_ids
+            with self.metrics.timer("export"):
+                user_ids = list(self.iter_users(type_id))
         except Exception as e:
             self.logger.error(f"用戶 {acc} {list_name}清單讀取失敗: {e}")
             return []
 
-    def get_user_info(self, uid: str) -> UserInfo:
-        """取得用戶資訊, 用於判斷是否刪除用戶
+        if not user_ids:
+            self.logger.info(f"用戶 {acc} 的{list_name}清單沒有資料")
+        else:
+            self.logger.info(f"成功讀取清單，共 {len(user_ids)} 筆資料")
+        return user_ids
 
-        Returns:
-            UserInfo 物件
+    def sync_snapshot(self) -> tuple[list[str], SnapshotDelta] | None:
+        """重新讀取黑名單並記錄到本地快照, 回傳用戶列表和與上次快照的差異
+
+        讀取失敗時回傳 None, 快照維持原狀。
         """
-        self.logger.debug(f"開始讀取用戶 {uid} 資訊")
-        url = f"https://api.gamer.com.tw/home/v1/block_list.php?userid={uid}"
-        default_visit_count, default_login_date = get_default_user_info(self.config.min_visit)
+        try:
+            with self.metrics.timer("export"):
+                user_ids = list(self.iter_users())
+        except Exception as e:
+            self.logger.error(f"用戶 {self.config.account} 黑名單清單讀取失敗: {e}")
+            return None
 
-        def extract_response(data: dict[str, Any]) -> UserInfo | None:
-            try:
-                for block in data["data"]["blocks"]:
-                    if block.get("type") == "user_info":
-                        info = {item["name"]: item["value"] for item in block["data"]["items"]}
-                        vc = info.get("上站次數", default_visit_count)
-                        ll = info.get("上站日期", default_login_date)
-
-                        visit_count = int(vc)
-                        last_login = datetime.strptime(ll, "%Y-%m-%d")
-                        return UserInfo(uid=uid, visit_count=visit_count, last_login=last_login)
-                return None
-            except (json.JSONDecodeError, KeyError) as e:
-                self.logger.error(f"JSON response 解碼失敗: {e}")
-                return None
+        delta = self.snapshots.record(user_ids)
+        self.logger.info(f"成功讀取黑名單，共 {len(user_ids)} 筆資料，和上次快照相比{delta}")
+        if delta:
+            self.logger.debug("新增的用戶: %s；移除的用戶: %s", delta.added, delta.removed)
+        return user_ids, delta
+
+    def iter_users(self, type_id: int = 5) -> Iterator[str]:
+        """串流讀取好友頁面的用戶ID, 邊下載邊解析並跟隨分頁, 讀取失敗時拋出例外
 
+        Args:
+            type_id: 頁面類型id, 預設 5 是黑名單頁面
+        """
+        acc, list_name = self.config.account, self.page_mapping[type_id]
+        self.logger.info(f"開始讀取用戶 {acc} 的{list_name}清單")
+        url: str | None = f"https://home.gamer.com.tw/friendList.php?user={acc}&t={type_id} "
+        visited: set[str] = set()
+        while url and url not in visited:
+            visited.add(url)
+            next_url = None
+            for kind, value in self._stream_friend_page(url):
+                if kind == "uid":
+                    yield value
+                else:
+                    next_url = urljoin(url.strip(), value)
+            url = next_url
+
+    def _stream_friend_page(self, url: str) -> Iterator[tuple[str, str]]:
+        """以 HTML pull parser 增量解析單一頁面, 產生 ("uid", 用戶ID) 和 ("next", 下一頁網址)
+
+        處理過的元素會立即從樹中移除, 記憶體用量不隨清單長度增加。
+        """
+        from lxml import etree
+
+        parser = etree.HTMLPullParser(events=("end",), tag=("div", "a"), encoding="utf-8")
+        response = self.session.get(url, stream=True)
         try:
-            response = self.session.get(url)
             response.raise_for_status()
-            data = decode_response_dict(response.json())
+            for chunk in response.iter_content():
+                parser.feed(chunk)
+                yield from self._drain_friend_events(parser)
+            parser.close()
+            yield from self._drain_friend_events(parser)
+        finally:
+            response.close()
+
+    @staticmethod
+    def _drain_friend_events(parser: "etree.HTMLPullParser") -> Iterator[tuple[str, str]]:
+        for _, element in parser.read_events():
+            if element.tag == "div" and element.get("class") == "user_id":
+                if uid := element.get("data-origin"):
+                    yield "uid", uid
+            elif element.tag == "a" and element.get("rel") == "next":
+                if href := element.get("href"):
+                    yield "next", href
+            else:
+                continue
+            element.clear()
+            parent = element.getparent()
+            while parent is not None and element.getprevious() is not None:
+                del parent[0]
+
+    def get_user_info(self, uid: str) -> UserInfo:
+        """取得用戶資訊, 用於判斷是否刪除用戶, 優先使用本次執行讀取過的資訊和未過期的快取
 
-            user_info = extract_response(data)
-            if user_info:
-                return user_info
+        Returns:
+            UserInfo 物件, 讀取失敗時為不會觸發移除的預設值
+        """
+        return self.user_infos.get(uid) or self.default_user_info(uid)
+
+    def get_user_infos(self, uids: Iterable[str]) -> dict[str, UserInfo]:
+        """併發取得多個用戶的資訊, 請求速率由 session 的速率限制器控制"""
+        return {
+            uid: user_info or self.default_user_info(uid)
+            for uid, user_info in self.user_infos.get_many(uids).items()
+        }
 
+    def fetch_user_info(self, uid: str) -> UserInfo | None:
+        """從網路讀取用戶資訊, 讀取或解析失敗時回傳 None, 請透過 self.user_infos 呼叫"""
+        self.logger.debug("開始讀取用戶 %s 資訊", uid)
+        try:
+            response = self.session.get(self.user_info_url(uid))
+            response.raise_for_status()
+            return self.parse_user_info(uid, response.json())
         except RequestException as e:
             self.logger.error(f"取得用戶 {uid} 資訊時網路請求失敗: {e}")
         except (ValueError, TypeError) as e:
             self.logger.error(f"取得用戶 {uid} 資訊時解析失敗: {e}")
+        except CircuitOpenError:
+            raise
         except Exception as e:
             self.logger.error(f"取得用戶 {uid} 資訊時讀取失敗: {e}")
+        return None
 
-        return UserInfo(uid=uid, visit_count=default_visit_count, last_login=default_login_date)
+    def user_info_url(self, uid: str) -> str:
+        return f"https://api.gamer.com.tw/home/v1/block_list.php?userid={uid}"
 
-    def _update_global_csrf(self) -> None:
+    def default_user_info(self, uid: str) -> UserInfo:
+        """讀取失敗時使用的預設用戶資訊, 預設值不會觸發移除"""
+        visit_count, login_date = get_default_user_info(self.config.min_visit)
+        return UserInfo(uid=uid, visit_count=visit_count, last_login=login_date)
+
+    def parse_user_info(self, uid: str, payload: dict[str, Any]) -> UserInfo | None:
+        """從 block_list.php 的回應中解析用戶資訊, 找不到用戶資訊區塊時回傳 None"""
+        default_visit_count, default_login_date = get_default_user_info(self.config.min_visit)
+        try:
+            data = decode_response_dict(payload)
+            for block in data["data"]["blocks"]:
+                if block.get("type") == "user_info":
+                    info = {item["name"]: item["value"] for item in block["data"]["items"]}
+                    vc = info.get("上站次數", default_visit_count)
+                    ll = info.get("上站日期", default_login_date)
+
+                    visit_count = int(vc)
+                    last_login = datetime.strptime(ll, "%Y-%m-%d")
+                    return UserInfo(uid=uid, visit_count=visit_count, last_login=last_login)
+            return None
+        except (json.JSONDecodeError, KeyError) as e:
+            self.logger.error(f"JSON response 解碼失敗: {e}")
+            return None
+
+    def _update_global_csrf(self) -> str:
+        """取得全域 CSRF Token 並套用到 session, 請透過 self.global_csrf 呼叫以重複使用 Token"""
         self.logger.debug("開始更新全域 CSRF Token")
         url = "https://www.gamer.com.tw/ajax/get_csrf_token.php "
         response = self.session.get(url)
         response.raise_for_status()
 
-        self.csrf_token = self.session.cookies.get("ckBahamutCsrfToken") or response.text[:16]
-        if not self.csrf_token:
+        csrf_token = self.session.cookies.get("ckBahamutCsrfToken") or response.text[:16]
+        if not csrf_token:
             error_msg = "無法取得 CSRF Token，請更新登入資料或改為 Cookies 登入"
             self.logger.error(error_msg)
             raise Exception(error_msg)
 
-        self.session.headers.update({"x-bahamut-csrf-token": self.csrf_token})  # type: ignore[unreachable]
-        self.session.cookies.update({"ckBahamutCsrfToken": self.csrf_token})
-        self.headers["x-bahamut-csrf-token"] = self.csrf_token
+        self.session.headers.update({"x-bahamut-csrf-token": csrf_token})
+        self.session.cookies.update({"ckBahamutCsrfToken": csrf_token})
+        self.headers["x-bahamut-csrf-token"] = csrf_token
         self.logger.debug("CSRF Token 更新成功")
+        return csrf_token
 
     def _get_temp_csrf(self) -> str:
-        """取得暫時的 CSRF Token
+        """取得暫時的 CSRF Token, 請透過 self.temp_csrf 呼叫以在整批移除中重複使用
 
         see: https://home.gamer.com.tw/friendList.php?user=[你的帳號]&t=5
         """
         self.logger.debug("開始取得 friendList CSRF Token")
-        url = "https://home.gamer.com.tw/ajax/getCSRFToken.php"
+        csrf_response = self.session.get(self.temp_csrf_url, headers=self._temp_csrf_headers())
+        csrf_response.raise_for_status()
+        csrf_token = csrf_response.text.strip()
+
+        if not csrf_token:
+            raise Exception("CSRF Token 取得失敗，請更新 cookies 文件")
+
+        return csrf_token
+
+    def _temp_csrf_headers(self) -> dict[str, str]:
         headers = self.headers.copy()
         headers.pop("accept", None)
         headers.pop("origin", None)
-        headers = {
+        return {
             **headers,
             "accept": "*/*",
             "referer": f"https://home.gamer.com.tw/friendList.php?user={self.config.account}&t=5",
@@ -318,63 +556,65 @@ class GamerAPI(GamerLogin):
             "x-requested-with": "XMLHttpRequest",
         }
 
-        csrf_response = self.session.get(url, headers=headers)
-        csrf_response.raise_for_status()
-        csrf_token = csrf_response.text.strip()
-
-        if not csrf_token:
-            raise Exception("CSRF Token 取得失敗，請更新 cookies 文件")
-
-        return csrf_token
-
 
 class GamerAPIExtended(GamerAPI):
     """專責處理 https://home.gamer.com.tw/friendList.php?user=用戶名稱&t=5 的 API"""
 
+    friend_del_url = "https://home.gamer.com.tw/ajax/friend_del.php"
+    remove_success_msg = "D-ONE"
+    # 快取不足以排序時, 讀取需要移出人數幾倍的用戶資訊作為排序樣本
+    eviction_sample_factor = 3
+
     def __init__(self, config: Config) -> None:
         super().__init__(config)
 
-    def remove_user(self, uid: str) -> str:
+    def remove_user(self, uid: str) -> Outcome:
         """see https://home.gamer.com.tw/friendList.php"""
-        url = "https://home.gamer.com.tw/ajax/friend_del.php"
-        remove_success_msg = "D-ONE"
-        self.logger.debug(f"開始移除用戶 {uid}")
-        csrf_token = self._get_temp_csrf()
-        data = {"fid": uid, "token": csrf_token}
-
-        response = self.session.post(url, data=data)
+        self.logger.debug("開始移除用戶 %s", uid)
+        csrf_token = self.temp_csrf.get()
+        response = self.session.post(self.friend_del_url, data={"fid": uid, "token": csrf_token})
+        if self.remove_success_msg not in response.text and is_token_error(
+            response.status_code, response.text
+        ):
+            self.temp_csrf.invalidate(csrf_token)
+            csrf_token = self.temp_csrf.get()
+            response = self.session.post(
+                self.friend_del_url, data={"fid": uid, "token": csrf_token}
+            )
         response.raise_for_status()
         result = response.text
 
-        if remove_success_msg in result:
-            self.logger.debug(f"用戶 {uid} 移除成功: {result}")
-        else:
-            self.logger.info(f"用戶 {uid} 移除失敗: {result}")
-        return result
+        if self.remove_success_msg in result:
+            self.logger.debug("用戶 %s 移除成功: %s", uid, result)
+            return Outcome(Status.REMOVED)
+        self.logger.info(f"用戶 {uid} 移除失敗: {result}")
+        return Outcome(Status.REJECTED, result)
 
-    def remove_users(self, uids: list[str]) -> dict[str, str]:
-        results: dict[str, str] = {}
-        consecutive_errors = 0
+    def remove_users(self, uids: list[str]) -> BatchResult:
+        results = BatchResult()
         total_users = len(uids)
         self.logger.info(f"開始移除用戶，共 {total_users} 個用戶")
 
+        batch_id = self.journal.begin("remove", uids)
         for index, uid in enumerate(uids, 1):
             try:
-                results[uid] = self.remove_user(uid)
-                self.logger.info(f"移除進度: {index}/{total_users}")
-                consecutive_errors = 0
+                results.add_outcome(uid, self.remove_user(uid))
+                self.journal.record(batch_id, uid)
+                self.logger.info("移除進度: %s/%s", index, total_users)
+            except CircuitOpenError:
+                raise
             except Exception as e:
-                consecutive_errors += 1
-                error_msg = f"移除失敗: {e}"
-                results[uid] = error_msg
-                self.logger.error(f"用戶 {uid} {error_msg} ({index}/{total_users})")
-
-            time.sleep(random.uniform(self.config.min_sleep, self.config.max_sleep))
-
-        self.logger.info(f"用戶移除完成，成功: {count_success(results)}/{total_users}")
+                results.add(uid, Status.ERROR, str(e))
+                self.journal.record(batch_id, uid, ok=False)
+                self.logger.error(f"用戶 {uid} 移除失敗: {e} ({index}/{total_users})")
+
+        self.journal.end(batch_id)
+        self.logger.info(f"用戶移除完成，{results}")
+        self.metrics.record_results("remove", results)
+        self.log_request_stats()
         return results
 
-    def smart_remove_user(self, uid: str, min_visits: int = 50, min_days: int = 60) -> str:
+    def smart_remove_user(self, uid: str, min_visits: int = 50, min_days: int = 60) -> Outcome:
         """檢查並移除不符合條件的用戶
 
         Args:
@@ -382,50 +622,294 @@ class GamerAPIExtended(GamerAPI):
             min_visits: 最小上站次數
             min_days: 最近登入天數最小容許值
         """
-        self.logger.debug(f"開始移除用戶 {uid}")
-        user_info = self.get_user_info(uid)
-        self.logger.debug(f"用戶資訊: {user_info}")
-        last_login = (datetime.now() - user_info.last_login).days
+        self.logger.debug("開始移除用戶 %s", uid)
+        return self.remove_if_inactive(self.get_user_info(uid), min_visits, min_days)
+
+    def remove_if_inactive(self, user_info: UserInfo, min_visits: int, min_days: int) -> Outcome:
+        """依已取得的用戶資訊判斷是否移除用戶"""
+        reasons, _ = self.removal_reasons(user_info, min_visits, min_days)
+        return self.apply_removal(user_info, ", ".join(reasons) or None)
+
+    def apply_removal(self, user_info: UserInfo, reason: str | None) -> Outcome:
+        """reason 不為 None 時移除用戶, 否則保留"""
+        uid = user_info.uid
+        self.logger.debug("用戶資訊: %s", user_info)
+        if reason is not None:
+            outcome = self.remove_user(uid)
+            self.logger.debug("用戶 %s 已移除: %s, 處理結果: %s", uid, reason, outcome.status.label)
+            return outcome
+        self.logger.debug(
+            "用戶 %s 已保留 (上站次數: %s, 上站日期: %s)",
+            uid,
+            user_info.visit_count,
+            user_info.last_login.strftime(logger_time_fmt),
+        )
+        return Outcome(Status.KEPT)
+
+    def triage_removals(
+        self, uids: list[str], removal: RemovalPolicy
+    ) -> tuple[dict[str, UserInfo], set[str]]:
+        """以快取中的用戶資訊一次評估整個黑名單, 回傳已評估的用戶資訊和其中需要移除的用戶
+
+        需要所有用戶資訊的規則 (percentile、keep_top) 會先讀取快取中沒有的用戶, 其餘規則只評估
+        快取中的用戶, 沒有快取的用戶在讀取資訊後才逐一判斷。
+        """
+        known = self.cached_user_infos(uids)
+        if missing := self.missing_for_policy(uids, known, removal):
+            known.update(self.get_user_infos(missing))
+        return known, self.evaluate_removals(known, removal)
+
+    def missing_for_policy(
+        self, uids: list[str], known: dict[str, UserInfo], removal: RemovalPolicy
+    ) -> list[str]:
+        """回傳評估前必須先讀取資訊的用戶, 只有需要所有用戶資訊的規則才需要"""
+        if removal.per_user:
+            return []
+        missing = [uid for uid in uids if uid not in known]
+        if missing:
+            self.logger.info(f"清理規則需要所有用戶的資訊，先讀取 {len(missing)} 個用戶的資訊")
+        return missing
+
+    def evaluate_removals(self, known: dict[str, UserInfo], removal: RemovalPolicy) -> set[str]:
+        victims = set(removal.evaluate(known.values()))
+        self.logger.info(f"已評估 {len(known)} 個用戶，其中 {len(victims)} 個符合移除條件")
+        return victims
+
+    def removal_params(
+        self, uids: list[str], removal: RemovalPolicy, victims: set[str], **params: Any
+    ) -> dict[str, Any]:
+        """回傳 smart_remove 批次寫入操作日誌的參數
+
+        移除人數和整體人數有關的規則 (percentile、keep_top) 只能對完整的黑名單評估一次,
+        因此把選出的移除對象一併寫入日誌, 接續時以剩餘用戶重新評估會移除過多的用戶。
+        """
+        if not removal.per_user:
+            params["victims"] = [uid for uid in uids if uid in victims]
+        return params
+
+    def replay_removals(self, victims: list[str]) -> set[str]:
+        self.logger.info(f"沿用批次開始時選出的 {len(victims)} 個移除對象")
+        return set(victims)
+
+    def cached_user_infos(self, uids: Iterable[str]) -> dict[str, UserInfo]:
+        uids = list(uids)
+        known = self.user_infos.known(uids)
+        self.logger.info(
+            f"用戶資訊快取命中 {len(known)} 筆，需要重新讀取 {len(uids) - len(known)} 筆"
+        )
+        return known
+
+    def update_snapshot(self, results: BatchResult) -> None:
+        """把批次操作的結果套用到本地快照, 只計入成功新增或移除的用戶"""
+        self.snapshots.apply(
+            added=results.with_status(Status.ADDED),
+            removed=results.with_status(Status.REMOVED),
+        )
 
+    def plan_eviction(
+        self,
+        existing_users: list[str],
+        incoming: int,
+        candidates: Iterable[str] | None = None,
+    ) -> list[str]:
+        """計算新增 incoming 個用戶前需要移出黑名單的用戶, 只挑出剛好足夠的最不活躍用戶
+
+        只從 candidates 中挑選, 更新模式傳入不在任何來源中的用戶, 避免移出的用戶在來源下次變更
+        時又被加回。移出人數不超過新增後實際用得到的空間, 候選用戶不足時, 超過上限的新增由呼叫端
+        略過。候選用戶全部都要移出時不讀取用戶資訊; 快取中的用戶足夠時只使用快取排序, 不足時從
+        候選用戶中平均取樣補讀, 樣本加上快取共 eviction_sample_factor 倍的需要人數, 再從中挑出
+        最不活躍的用戶, 不會掃描整個黑名單。
+
+        Args:
+            candidates: 可以移出的用戶, None 代表整個黑名單
+        """
+        needed, chosen, known, unknown = self._eviction_pool(existing_users, incoming, candidates)
+        if needed <= 0:
+            return []
+
+        self.logger.info(
+            f"黑名單上限為 {self.config.blacklist_cap} 人，新增 {incoming} 人前移除 {needed} 人，"
+            f"快取中有 {len(known)} 人的用戶資訊"
+        )
+        if unknown:
+            self.logger.info(f"讀取 {len(unknown)} 個用戶的資訊作為排序樣本")
+            known.update(self.get_user_infos(unknown))
+
+        victims = rank_for_eviction(
+            known.values(), needed - len(chosen), self.config.min_visit, self.config.min_day
+        )
+        return chosen + [user_info.uid for user_info in victims]
+
+    def preview_eviction(
+        self,
+        existing_users: list[str],
+        incoming: int,
+        candidates: Iterable[str] | None = None,
+    ) -> tuple[list[str], list[str]]:
+        """不送出請求地預覽 plan_eviction 的結果, 回傳會被移出的用戶和需要讀取資訊的樣本用戶
+
+        移出人數和讀取次數和實際執行相同; 快取不足時實際移出哪些用戶取決於樣本的資訊, 預覽以
+        快取中最不活躍的用戶加上樣本中的用戶代替。
+        """
+        needed, chosen, known, unknown = self._eviction_pool(existing_users, incoming, candidates)
+        if needed <= 0:
+            return [], []
+        ranked = rank_for_eviction(
+            known.values(), needed - len(chosen), self.config.min_visit, self.config.min_day
+        )
+        evicted = chosen + [user_info.uid for user_info in ranked]
+        return evicted + unknown[: needed - len(evicted)], unknown
+
+    def _eviction_pool(
+        self, existing_users: list[str], incoming: int, candidates: Iterable[str] | None
+    ) -> tuple[int, list[str], dict[str, UserInfo], list[str]]:
+        """回傳需要移出的人數、不需排序直接移出的用戶、快取中的候選用戶資訊以及需要補讀的樣本"""
+        overflow = len(existing_users) + incoming - self.config.blacklist_cap
+        if overflow <= 0:
+            return 0, [], {}, []
+
+        if candidates is None:
+            pool = existing_users
+        else:
+            existing = set(existing_users)
+            pool = [uid for uid in dict.fromkeys(candidates) if uid in existing]
+        needed = min(overflow, len(pool))
+        if len(existing_users) - needed >= self.config.blacklist_cap:
+            # 移出所有候選用戶仍然沒有空間, 移出也無法新增任何用戶
+            needed = 0
+        if needed < overflow:
+            self.logger.warning(
+                f"黑名單上限為 {self.config.blacklist_cap} 人，可以移出的用戶只有 {len(pool)} 人，"
+                f"只移除 {needed} 人，其餘 {overflow - needed} 個新增會被略過"
+            )
+        if needed <= 0:
+            return 0, [], {}, []
+        if needed == len(pool):
+            return needed, list(pool), {}, []
+        return needed, [], *self._eviction_sample(pool, needed)
+
+    def _eviction_sample(
+        self, candidates: list[str], count: int
+    ) -> tuple[dict[str, UserInfo], list[str]]:
+        """回傳候選用戶中快取的用戶資訊, 以及排序出 count 個用戶所需補讀資訊的樣本用戶"""
+        if count <= 0:
+            return {}, []
+        known = self.user_infos.known(candidates)
+        if len(known) >= count:
+            return known, []
+        # 匯出順序和加入時間有關, 平均取樣避免只讀取清單開頭的用戶
+        rest = [uid for uid in candidates if uid not in known]
+        if not rest:
+            return known, []
+        size = min(len(rest), count * self.eviction_sample_factor - len(known))
+        step = len(rest) / size
+        return known, [rest[int(i * step)] for i in range(size)]
+
+    def removal_reasons(
+        self, user_info: UserInfo, min_visits: int, min_days: int
+    ) -> tuple[list[str], int]:
+        """回傳用戶不符合保留條件的原因以及上站日期距離現在的天數"""
+        last_login = (datetime.now() - user_info.last_login).days
         reasons = []
         if user_info.visit_count < min_visits:
             reasons.append(f"上站次數({user_info.visit_count})低於{min_visits}")
         if last_login > min_days:
             reasons.append(f"上站日期距離現在天數({last_login})大於{min_days}")
-
-        if reasons:
-            msg = self.remove_user(uid)
-            self.logger.debug(f"用戶 {uid} 已移除: {', '.join(reasons)}, 處理結果: {msg}")
-        else:
-            msg = f"用戶 {uid} 已保留 (上站次數: {user_info.visit_count}, 上站日期距離現在天數: {last_login})"
-            self.logger.debug(msg)
-        return msg
+        return reasons, last_login
 
     def smart_remove_users(
         self,
         uids: list[str],
         min_visits: int = 50,
         min_days: int = 60,
-    ) -> dict[str, str]:
-        results: dict[str, str] = {}
-        consecutive_errors = 0
-        total_users = len(uids)
-        self.logger.info(
-            f"開始移除用戶，共 {total_users} 個用戶，移除門檻為：「最小上站次數: {min_visits}, 最小天數: {min_days}」"
-        )
+        policy: str = "threshold",
+        victims: list[str] | None = None,
+    ) -> BatchResult:
+        """以兩段式管線移除不符合條件的用戶
 
-        for index, uid in enumerate(uids, 1):
-            try:
-                results[uid] = self.smart_remove_user(uid)
-                self.logger.info(f"移除進度: {index}/{total_users}")
-                consecutive_errors = 0
-            except Exception as e:
-                consecutive_errors += 1
-                error_msg = f"移除失敗: {e}"
-                results[uid] = error_msg
-                self.logger.error(f"用戶 {uid} {error_msg} ({index}/{total_users})")
+        先以 triage_removals 一次評估快取中的用戶, 再由背景執行緒依序取得用戶資訊並放入容量為
+        prefetch_size 的佇列, 已評估的用戶不會再送出請求。主執行緒從佇列取出並移除不符合條件的
+        用戶, 讀取後面用戶的同時前面的移除請求仍在進行。兩段共用 session 的速率限制器。
 
-            time.sleep(random.uniform(self.config.min_sleep, self.config.max_sleep))
-
-        self.logger.info(f"用戶移除完成，成功: {count_success(results)}/{total_users}")
+        Args:
+            policy: 清理規則, 格式見 scoring.parse_policy
+            victims: 接續批次時沿用的移除對象, 由 removal_params 寫入操作日誌
+        """
+        results = BatchResult()
+        total_users = len(uids)
+        removal = parse_policy(policy, min_visits, min_days)
+        self.logger.info(f"開始移除用戶，共 {total_users} 個用戶，移除規則為：「{removal}」")
+        if victims is None:
+            known, chosen = self.triage_removals(uids, removal)
+        else:
+            known, chosen = self.cached_user_infos(uids), self.replay_removals(victims)
+
+        batch_id = self.journal.begin(
+            "smart_remove",
+            uids,
+            **self.removal_params(
+                uids, removal, chosen, min_visits=min_visits, min_days=min_days, policy=policy
+            ),
+        )
+        lookups: queue.Queue[tuple[str, UserInfo | Exception] | None] = queue.Queue(
+            self.config.prefetch_size
+        )
+        stop = threading.Event()
+
+        def prefetch() -> None:
+            # 每次併發查詢 concurrency 個尚未評估的用戶
+            step = self.config.concurrency
+            for start in range(0, len(uids), step):
+                chunk = uids[start : start + step]
+                fetched: dict[str, UserInfo] | Exception
+                try:
+                    fetched = self.get_user_infos(uid for uid in chunk if uid not in known)
+                except Exception as e:
+                    fetched = e
+                for uid in chunk:
+                    if stop.is_set():
+                        return
+                    item: UserInfo | Exception
+                    if uid in known:
+                        item = known[uid]
+                    else:
+                        item = fetched if isinstance(fetched, Exception) else fetched[uid]
+                    lookups.put((uid, item))
+            lookups.put(None)
+
+        producer = threading.Thread(target=prefetch, name="user-info-prefetch", daemon=True)
+        producer.start()
+        try:
+            index = 0
+            while (entry := lookups.get()) is not None:
+                uid, user_info = entry
+                index += 1
+                try:
+                    if isinstance(user_info, Exception):
+                        raise user_info
+                    if uid in known or not removal.per_user:
+                        remove = uid in chosen
+                    else:
+                        remove = removal.removes(user_info)
+                    reason = str(removal) if remove else None
+                    results.add_outcome(uid, self.apply_removal(user_info, reason))
+                    self.journal.record(batch_id, uid)
+                    self.logger.info("移除進度: %s/%s", index, total_users)
+                except CircuitOpenError:
+                    raise
+                except Exception as e:
+                    results.add(uid, Status.ERROR, str(e))
+                    self.journal.record(batch_id, uid, ok=False)
+                    self.logger.error(f"用戶 {uid} 移除失敗: {e} ({index}/{total_users})")
+        finally:
+            # 中途中斷時清空佇列, 讓被阻塞的讀取執行緒可以結束
+            stop.set()
+            while producer.is_alive():
+                with contextlib.suppress(queue.Empty):
+                    lookups.get(timeout=0.1)
+
+        self.journal.end(batch_id)
+        self.logger.info(f"用戶移除完成，{results}")
+        self.metrics.record_results("smart_remove", results)
+        self.log_request_stats()
         return results
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger("baha_blacklist")
+
+
+@dataclass
+class PendingBatch:
+    """日誌中尚未完成的批次
+
+    Attributes:
+        batch_id: 批次ID
+        op: 操作類型, 例如 add, remove, smart_remove
+        uids: 批次開始時的完整用戶列表
+        params: 重新執行批次所需的參數
+        done: 已完成的用戶ID
+    """
+
+    batch_id: str
+    op: str
+    uids: list[str]
+    params: dict[str, Any] = field(default_factory=dict)
+    done: set[str] = field(default_factory=set)
+
+    @property
+    def remaining(self) -> list[str]:
+        return [uid for uid in self.uids if uid not in self.done]
+
+
+class Journal:
+    """新增和移除批次的 append-only 操作日誌 (JSON lines)
+
+    每個批次寫入 begin、每個用戶處理完寫入 done、結束時寫入 end。程式中斷後, 沒有 end 的批次
+    可以用 pending 取得剩下的用戶並從中斷處繼續。所有批次都結束時日誌會被清空。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._superseded: str | None = None
+        self._pending = self._load()
+        self._open = set(self._pending)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def pending(self) -> list[PendingBatch]:
+        """回傳上次執行時沒有完成的批次, 依開始時間排序"""
+        return list(self._pending.values())
+
+    def resume(self, batch: PendingBatch) -> None:
+        """標記下一個 begin 的批次是用來接續 batch, 新批次開始時 batch 會被結束"""
+        self._superseded = batch.batch_id
+
+    def begin(self, op: str, uids: list[str], **params: Any) -> str:
+        batch_id = uuid.uuid4().hex[:12]
+        self._write({"type": "begin", "batch": batch_id, "op": op, "uids": uids, "params": params})
+        self._open.add(batch_id)
+        if self._superseded:
+            self.end(self._superseded)
+            self._superseded = None
+        return batch_id
+
+    def record(self, batch_id: str, uid: str, ok: bool = True) -> None:
+        """記錄用戶已處理完畢, ok 為 False 代表發生例外, 接續執行時會重試"""
+        self._write({"type": "done", "batch": batch_id, "uid": uid, "ok": ok})
+
+    def end(self, batch_id: str) -> None:
+        self._write({"type": "end", "batch": batch_id})
+        self._open.discard(batch_id)
+        self._pending.pop(batch_id, None)
+        if not self._open:
+            self._truncate()
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        entry["ts"] = time.time()
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def _truncate(self) -> None:
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _load(self) -> dict[str, PendingBatch]:
+        batches: dict[str, PendingBatch] = {}
+        if not os.path.exists(self.path):
+            return batches
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中斷時可能留下寫到一半的最後一行
+                    logger.debug(f"略過損毀的日誌內容: {line!r}")
+                    continue
+                batch_id = entry.get("batch")
+                if entry["type"] == "begin":
+                    batches[batch_id] = PendingBatch(
+                        batch_id, entry["op"], entry["uids"], entry.get("params", {})
+                    )
+                elif entry["type"] == "done" and batch_id in batches:
+                    if entry.get("ok", True):
+                        batches[batch_id].done.add(entry["uid"])
+                elif entry["type"] == "end":
+                    batches.pop(batch_id, None)
+        return batches
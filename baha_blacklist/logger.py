@@ -1,5 +1,9 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 from typing import ClassVar
 
 from colorama import Fore, Style, init
@@ -20,16 +24,75 @@ class CustomFormatter(logging.Formatter):
         super().__init__()
         init()
         self.use_color = use_color
+        self._level_tags: dict[int, str] = {}
+        self._time_second = -1
+        self._time_text = ""
 
     def format(self, record: logging.LogRecord) -> str:
-        if self.use_color:
-            color = self.COLORS.get(record.levelno, self.RESET)
-            levelname = record.levelname.lower()
-            return f"[{self.GREEN}{self.formatTime(record, '%H:%M:%S')}{self.RESET}][{color}{levelname}{self.RESET}] - {record.getMessage()}"
-        else:
-            # Convert levelname to lowercase for file logs
+        return f"[{self._time(record)}][{self._level_tag(record)}] - {record.getMessage()}"
+
+    def _level_tag(self, record: logging.LogRecord) -> str:
+        """每個等級的標籤 (含顏色) 只組合一次"""
+        tag = self._level_tags.get(record.levelno)
+        if tag is None:
             levelname = record.levelname.lower()
-            return f"[{self.formatTime(record, '%H:%M:%S')}][{levelname}] - {record.getMessage()}"
+            if self.use_color:
+                color = self.COLORS.get(record.levelno, self.RESET)
+                tag = f"{color}{levelname}{self.RESET}"
+            else:
+                # Convert levelname to lowercase for file logs
+                tag = levelname
+            self._level_tags[record.levelno] = tag
+        return tag
+
+    def _time(self, record: logging.LogRecord) -> str:
+        """同一秒內的記錄重複使用已格式化的時間"""
+        second = int(record.created)
+        if second != self._time_second:
+            text = self.formatTime(record, "%H:%M:%S")
+            self._time_text = f"{self.GREEN}{text}{self.RESET}" if self.use_color else text
+            self._time_second = second
+        return self._time_text
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每筆記錄輸出為一行 JSON, 方便之後以程式分析大量執行紀錄"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """只把記錄放進佇列, 訊息的 % 格式化延後到背景執行緒處理
+
+    預設的 QueueHandler 會在呼叫端先格式化訊息, 這裡保留 msg 和 args, 由 QueueListener 的
+    handler 格式化。例外資訊在同一個程序中直接傳遞, 不需要先轉成文字。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class MergingQueueListener(logging.handlers.QueueListener):
+    """在背景執行緒把 msg 和 args 合併成訊息, 多個 handler 共用同一次格式化的結果"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: logging.handlers.QueueListener | None = None
+_atexit_registered = False
 
 
 def setup_logging(
@@ -37,6 +100,8 @@ def setup_logging(
     log_path: str | None = None,
     logger_name: str | None = None,
     archive: bool = True,
+    json_path: str | None = None,
+    use_queue: bool = True,
 ) -> logging.Logger:
     """Configure logging with console and optional file handlers.
 
@@ -44,31 +109,40 @@ def setup_logging(
         level (int): Logging level (e.g., logging.DEBUG).
         log_path (str): Path to the log file.
         archive (bool): If True, enables file logging.
+        json_path (str): Path to the JSON lines log file.
+        use_queue (bool): If True, handlers run on a background thread behind a queue.
     """
+    stop_logging()
     logger = logging.getLogger(logger_name)
 
     # Clear existing handlers
     logging.root.handlers.clear()
     logger.handlers.clear()
 
-    # Create formatters
-    color_formatter = CustomFormatter(use_color=True)
-    if archive:
-        plain_formatter = CustomFormatter(use_color=False)
-
     # Console handler
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(color_formatter)
-    logging.root.addHandler(console_handler)
+    console_handler.setFormatter(CustomFormatter(use_color=True))
+    handlers: list[logging.Handler] = [console_handler]
 
     # File handler
     if archive and log_path:
-        log_dir = os.path.dirname(log_path)
-        if log_dir:
-            os.makedirs(log_dir, exist_ok=True)
-        file_handler = logging.FileHandler(log_path, encoding="utf-8")
-        file_handler.setFormatter(plain_formatter)
-        logging.root.addHandler(file_handler)
+        handlers.append(_file_handler(log_path, CustomFormatter(use_color=False)))
+    if json_path:
+        handlers.append(_file_handler(json_path, JsonLinesFormatter()))
+
+    if use_queue:
+        global _listener, _atexit_registered
+        log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        _listener = MergingQueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # 重複呼叫 setup_logging 時只註冊一次
+        if not _atexit_registered:
+            atexit.register(stop_logging)
+            _atexit_registered = True
+        logging.root.addHandler(LazyQueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            logging.root.addHandler(handler)
 
     # Set log level
     logging.root.setLevel(level)
@@ -80,6 +154,23 @@ def setup_logging(
     return logger
 
 
+def stop_logging() -> None:
+    """停止背景寫入執行緒, 佇列中剩下的記錄會先寫完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _file_handler(path: str, formatter: logging.Formatter) -> logging.Handler:
+    log_dir = os.path.dirname(path)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(formatter)
+    return handler
+
+
 def suppress_log(level: int) -> None:
     level = logging.DEBUG if level == logging.DEBUG else logging.WARNING
     logging.getLogger("httpx").setLevel(level)
@@ -0,0 +1,169 @@
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from .cache import UserInfoCache
+from .models import UserInfo
+
+if TYPE_CHECKING:
+    import asyncio
+
+logger = logging.getLogger("baha_blacklist")
+
+
+class UserInfoLookup:
+    """合併重複查詢的用戶資訊服務
+
+    查詢順序為記憶體中的 LRU、SQLite 快取、網路。同一個用戶同時只會有一個請求在進行, 其他查詢
+    等待同一個結果; 成功取得的資訊放入 LRU, 同一次執行中不會重複讀取。讀取失敗 (fetch 回傳
+    None) 不會被記住, 下次查詢時重試。
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], UserInfo | None],
+        cache: UserInfoCache | None = None,
+        max_entries: int = 20000,
+        max_workers: int = 4,
+    ) -> None:
+        """
+        Args:
+            fetch: 從網路讀取用戶資訊的函式, 失敗時回傳 None
+            cache: 跨執行保存的 SQLite 快取, None 時只使用記憶體
+            max_entries: 記憶體中保留的用戶數量上限
+            max_workers: get_many 同時進行的查詢數量, 請求速率仍由 session 的速率限制器控制
+        """
+        self.cache = cache
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self.memo_hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self._fetch = fetch
+        self._memo: OrderedDict[str, UserInfo] = OrderedDict()
+        self._in_flight: dict[str, Future[UserInfo | None]] = {}
+        self._async_in_flight: dict[str, asyncio.Future[UserInfo | None]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._memo)
+
+    def __str__(self) -> str:
+        return (
+            f"用戶資訊查詢: 記憶體命中 {self.memo_hits} 次，網路讀取 {self.fetches} 次，"
+            f"合併重複查詢 {self.coalesced} 次"
+        )
+
+    def peek(self, uid: str) -> UserInfo | None:
+        """只從記憶體和 SQLite 快取查詢, 不送出請求"""
+        return self.known([uid]).get(uid)
+
+    def known(self, uids: Iterable[str]) -> dict[str, UserInfo]:
+        """回傳記憶體或 SQLite 快取中已有資訊的用戶, 不送出請求"""
+        found: dict[str, UserInfo] = {}
+        rest: list[str] = []
+        with self._lock:
+            for uid in uids:
+                if (user_info := self._memo.get(uid)) is not None:
+                    self._memo.move_to_end(uid)
+                    found[uid] = user_info
+                else:
+                    rest.append(uid)
+            self.memo_hits += len(found)
+        if rest and self.cache is not None:
+            cached = self.cache.get_many(rest)
+            self._remember(cached.values())
+            found.update(cached)
+        return found
+
+    def get(self, uid: str) -> UserInfo | None:
+        """查詢單一用戶, 同一個用戶正在讀取時等待該請求的結果"""
+        if (user_info := self.peek(uid)) is not None:
+            return user_info
+
+        with self._lock:
+            if (user_info := self._memo.get(uid)) is not None:
+                return user_info
+            future = self._in_flight.get(uid)
+            owner = future is None
+            if future is None:
+                future = self._in_flight[uid] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            user_info = self._fetch(uid)
+            self._store(user_info)
+            future.set_result(user_info)
+            return user_info
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[uid]
+
+    def get_many(self, uids: Iterable[str]) -> dict[str, UserInfo | None]:
+        """併發查詢多個用戶, 重複的用戶只查詢一次, 讀取失敗的用戶對應 None"""
+        uids = list(dict.fromkeys(uids))
+        found: dict[str, UserInfo | None] = dict(self.known(uids))
+        if missing := [uid for uid in uids if uid not in found]:
+            workers = max(1, min(self.max_workers, len(missing)))
+            with ThreadPoolExecutor(workers, thread_name_prefix="user-info-lookup") as executor:
+                found.update(zip(missing, executor.map(self.get, missing), strict=True))
+        return found
+
+    async def aget(
+        self, uid: str, fetch: Callable[[str], Awaitable[UserInfo | None]]
+    ) -> UserInfo | None:
+        """非同步版本的 get, 同一個事件迴圈中相同用戶的查詢共用同一個請求"""
+        import asyncio
+
+        if (user_info := self.peek(uid)) is not None:
+            return user_info
+
+        task = self._async_in_flight.get(uid)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._afetch(uid, fetch))
+            self._async_in_flight[uid] = task
+            task.add_done_callback(self._async_done(uid))
+        else:
+            self.coalesced += 1
+        # 等待中的查詢被取消時不影響其他等待同一個請求的查詢
+        return await asyncio.shield(task)
+
+    def _async_done(self, uid: str) -> Callable[["asyncio.Future[UserInfo | None]"], None]:
+        def done(task: "asyncio.Future[UserInfo | None]") -> None:
+            if self._async_in_flight.get(uid) is task:
+                del self._async_in_flight[uid]
+
+        return done
+
+    async def _afetch(
+        self, uid: str, fetch: Callable[[str], Awaitable[UserInfo | None]]
+    ) -> UserInfo | None:
+        user_info = await fetch(uid)
+        self._store(user_info)
+        return user_info
+
+    def _store(self, user_info: UserInfo | None) -> None:
+        with self._lock:
+            self.fetches += 1
+        if user_info is None:
+            return
+        if self.cache is not None:
+            self.cache.put(user_info)
+        self._remember([user_info])
+
+    def _remember(self, user_infos: Iterable[UserInfo]) -> None:
+        with self._lock:
+            for user_info in user_infos:
+                self._memo[user_info.uid] = user_info
+                self._memo.move_to_end(user_info.uid)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
@@ -1,82 +1,445 @@
 import logging
-import sys
-import time
+import os
+import signal
+import threading
 from argparse import Namespace
+from collections.abc import Callable
 from pathlib import Path
-
-from curl_cffi.requests.exceptions import RequestException
+from typing import TYPE_CHECKING
 
 from .config import Config, ConfigLoader
-from .gamer_api import GamerAPIExtended
 from .logger import setup_logging
-from .utils import load_users, write_users
+from .metrics import load_latency
+from .planner import PhaseEstimate, RuntimeEstimator, UpdatePlan, format_seconds, plan_update
+from .results import Status
+from .scoring import parse_policy
+from .utils import write_users
+
+# curl_cffi 和 lxml 載入時間較長, 實際需要連線時才載入, 讓 -h 和設定錯誤可以立即回應
+if TYPE_CHECKING:
+    from .gamer_api import GamerAPIExtended
+    from .sources import SourceAggregator, SourceResult
 
 logger = logging.getLogger("baha_blacklist")
 
 
-def init_app(args: Namespace, config_name: str = "config.json") -> tuple[Config, GamerAPIExtended]:
+def init_app(
+    args: Namespace, config_name: str = "config.json"
+) -> tuple[Config, "GamerAPIExtended"]:
     loglevel = logging.INFO
     if args.verbose:
         loglevel = logging.DEBUG
     if args.quiet:
         loglevel = logging.WARNING
 
-    setup_logging(loglevel)
+    setup_logging(loglevel, json_path=args.log_json)
     json_path = str(Path(__file__).parents[1] / config_name)
     config_loader = ConfigLoader(Config())
     config = config_loader.load_config(json_path, args)
 
+    from .gamer_api import GamerAPIExtended
+
     api = GamerAPIExtended(config)
     return config, api
 
 
-def real_main(args: Namespace, config: Config, api: GamerAPIExtended) -> int:
+BATCH_METHODS = {"add": "add_users", "remove": "remove_users", "smart_remove": "smart_remove_users"}
+# 同步模式下也會併發查詢的端點
+LOOKUP_ENDPOINTS = frozenset({"block_list"})
+
+
+def resume_batches(config: Config, api: "GamerAPIExtended") -> int:
+    """從操作日誌接續上次中斷的批次, 只處理尚未完成的用戶"""
+    from .async_api import run_async
+
+    pending = api.journal.pending()
+    if not pending:
+        logger.info("操作日誌中沒有未完成的批次")
+        return 0
+
+    for batch in pending:
+        uids, params = batch.remaining, batch.params
+        logger.info(
+            f"接續 {batch.op} 批次 {batch.batch_id}，剩餘 {len(uids)}/{len(batch.uids)} 個用戶"
+        )
+        if not uids:
+            api.journal.end(batch.batch_id)
+            continue
+
+        api.journal.resume(batch)
+        method = BATCH_METHODS[batch.op]
+        if config.use_async:
+            results = run_async(api, lambda async_api: getattr(async_api, method)(uids, **params))
+        else:
+            results = getattr(api, method)(uids, **params)
+        api.update_snapshot(results)
+
+    api.save_session()
+    return 0
+
+
+def export_to_file(args: Namespace, config: Config, api: "GamerAPIExtended") -> list[str]:
+    """讀取黑名單並更新本地快照, 和上次快照相比沒有變更且檔案已存在時不重新寫入檔案"""
+    had_snapshot = api.snapshots.verified_at is not None
+    if (synced := api.sync_snapshot()) is None:
+        return []
+
+    existing_users, delta = synced
+    if had_snapshot and not delta and os.path.exists(config.blacklist_dest):
+        logger.info(f"黑名單和上次匯出時相同，不重新寫入 {config.blacklist_dest}")
+        return existing_users
+    count = write_users(config.blacklist_dest, existing_users)
+    logger.info(f"成功匯出黑名單，共 {count} 筆資料")
+    return existing_users
+
+
+def load_existing_users(config: Config, api: "GamerAPIExtended") -> list[str]:
+    """取得目前的黑名單, 本地快照在 snapshot_max_age 秒內和網站同步過時直接使用快照"""
+    if (users := api.snapshots.recent(config.snapshot_max_age)) is not None:
+        logger.info(f"使用 {api.snapshots.age():.0f} 秒前同步的本地快照，共 {len(users)} 筆資料")
+        return users
+    synced = api.sync_snapshot()
+    return synced[0] if synced is not None else []
+
+
+def update_blacklist(
+    args: Namespace,
+    config: Config,
+    api: "GamerAPIExtended",
+    existing_users: list[str],
+    sources: "list[SourceResult] | None" = None,
+) -> tuple[list[str], bool]:
+    """合併所有黑名單來源並新增缺少的用戶
+
+    有用戶因為例外而新增失敗時不 commit 來源, 下次執行時來源仍視為有變更並重試這些用戶。
+
+    Args:
+        sources: 已經讀取好的來源, 由呼叫端負責 commit; None 時自行讀取並在完成後 commit
+
+    Returns:
+        移出超過上限的用戶後的既有黑名單, 以及來源是否可以 commit (沒有用戶新增失敗)
+    """
+    from .async_api import run_async
+
+    aggregator = new_aggregator(config, api)
+    try:
+        results = load_sources(args, config, aggregator, sources)
+        if results is None:
+            return existing_users, True
+
+        plan = plan_update(existing_users, *(r.uids for r in results))
+        if evicted := api.plan_eviction(existing_users, len(plan.to_add), plan.remove_candidates):
+            if config.use_async:
+                removed = run_async(api, lambda async_api: async_api.remove_users(evicted))
+            else:
+                removed = api.remove_users(evicted)
+            api.update_snapshot(removed)
+            removed_set = set(removed.with_status(Status.REMOVED))
+            existing_users = [uid for uid in existing_users if uid not in removed_set]
+        fit_to_cap(plan, config, existing_users)
+        if not plan.to_add:
+            logger.info("沒有需要新增的用戶")
+        else:
+            if config.use_async:
+                added = run_async(api, lambda async_api: async_api.add_users(plan.to_add))
+            else:
+                added = api.add_users(plan.to_add, category="bad")
+            api.update_snapshot(added)
+            if failed := added.count(Status.ERROR):
+                logger.warning(f"{failed} 個用戶新增失敗，保留黑名單來源的變更狀態，下次更新時重試")
+                return existing_users, False
+        if sources is None:
+            aggregator.commit(results)
+        return existing_users, True
+    finally:
+        aggregator.index.close()
+
+
+def fit_to_cap(plan: UpdatePlan, config: Config, existing_users: list[str]) -> None:
+    """略過超過黑名單上限的新增用戶, 之後有空間時需要 --force-update 才會重新新增"""
+    if dropped := plan.fit(config.blacklist_cap - len(existing_users)):
+        logger.warning(
+            f"黑名單上限為 {config.blacklist_cap} 人，略過 {len(dropped)} 個超過上限的新增用戶"
+        )
+        logger.debug("略過的用戶: %s", dropped)
+
+
+def new_aggregator(config: Config, api: "GamerAPIExtended") -> "SourceAggregator":
+    from .sources import SourceAggregator, SourceFetcher, SourceIndex
+
+    fetcher = SourceFetcher(api.session, os.path.join(config.data_dir, "sources"))
+    index = SourceIndex(os.path.join(config.data_dir, "sources.sqlite3"))
+    return SourceAggregator(fetcher, index, config.concurrency)
+
+
+def load_sources(
+    args: Namespace,
+    config: Config,
+    aggregator: "SourceAggregator",
+    sources: "list[SourceResult] | None",
+) -> "list[SourceResult] | None":
+    """讀取所有黑名單來源, 來源沒有變更或全部讀取失敗時回傳 None 代表不需要更新"""
+    if sources is None:
+        results = aggregator.fetch_all([config.blacklist_src, *config.blacklist_srcs])
+    else:
+        results = sources
+    if results and not any(r.changed for r in results) and not args.force_update:
+        logger.info("黑名單來源自上次更新後沒有變更，跳過更新")
+        return None
+    if not any(r.uids for r in results):
+        logger.info("沒有更新黑名單，因為載入失敗或來源黑名單為空")
+        return None
+    return results
+
+
+def watch_sources(
+    args: Namespace,
+    config: Config,
+    api: "GamerAPIExtended",
+    stop: threading.Event | None = None,
+    max_cycles: int | None = None,
+) -> int:
+    """常駐監看黑名單來源, 沿用同一個已登入的 session, 來源變更時只新增差異
+
+    每 watch_interval 秒以條件式請求檢查一次來源, 沒有變更時不會送出其他請求。來源變更時才確認
+    登入狀態, CSRF Token 沿用到被判定失效為止。單次檢查失敗只記錄錯誤, 下次檢查時重試; 斷路器
+    在每次檢查開始時重置, 上次檢查時網站故障不會讓之後的檢查全部失敗。
+
+    Args:
+        stop: 設定後在目前的檢查結束時停止, 收到 SIGTERM 時也會設定
+        max_cycles: 最多檢查的次數, None 代表持續到被停止
+    """
+    stop = stop or threading.Event()
+    previous_handler = None
+    if threading.current_thread() is threading.main_thread():
+        previous_handler = signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    sources = [config.blacklist_src, *config.blacklist_srcs]
+    aggregator = new_aggregator(config, api)
+    logger.info(f"開始監看 {len(sources)} 個黑名單來源，每 {config.watch_interval:g} 秒檢查一次")
+    cycles = 0
+    try:
+        while max_cycles is None or cycles < max_cycles:
+            if stop.wait(config.watch_interval):
+                break
+            cycles += 1
+            api.circuit_breaker.reset()
+            try:
+                results = aggregator.fetch_all(sources)
+                if not any(r.changed for r in results):
+                    logger.debug("黑名單來源沒有變更")
+                    continue
+                if not api.ensure_login():
+                    logger.error("重新登入失敗，停止監看")
+                    return 1
+                logger.info("黑名單來源已變更，開始更新黑名單...")
+                existing_users = load_existing_users(config, api)
+                with api.metrics.timer("update"):
+                    _, synced = update_blacklist(args, config, api, existing_users, results)
+                if synced:
+                    aggregator.commit(results)
+                api.save_session()
+                api.write_metrics()
+            except Exception as e:
+                logger.error(f"檢查黑名單來源失敗，{config.watch_interval:g} 秒後重試: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.index.close()
+        if previous_handler is not None:
+            signal.signal(signal.SIGTERM, previous_handler)
+    logger.info(f"停止監看黑名單來源，共檢查 {cycles} 次")
+    return 0
+
+
+def plan_run(
+    args: Namespace,
+    config: Config,
+    api: "GamerAPIExtended",
+    sources: "list[SourceResult] | None" = None,
+) -> list[PhaseEstimate]:
+    """只送出讀取請求, 計算各模式會送出的請求數並推估執行時間
+
+    匯出黑名單和讀取來源照常執行, 用戶資訊只使用快取, 不會新增、移除用戶或寫入任何檔案。
+    """
+    metrics = api.metrics
+    phases = []
+
+    before = metrics.request_counts()
+    recent = api.snapshots.recent(config.snapshot_max_age)
+    if "export" not in args.mode and recent is not None:
+        existing_users = recent
+    else:
+        existing_users = api.export_users()
+    phases.append(PhaseEstimate("export", metrics.request_counts() - before))
+
+    has_temp_token = api.temp_csrf.token is not None
+    # 更新時讀取過資訊的樣本用戶, 實際執行時會保留在記憶體中, 清理時不會再讀取
+    sampled: set[str] = set()
+    if "update" in args.mode:
+        phase = PhaseEstimate("update")
+        aggregator = new_aggregator(config, api)
+        try:
+            before = metrics.request_counts()
+            results = load_sources(args, config, aggregator, sources)
+            phase.requests.update(metrics.request_counts() - before)
+        finally:
+            aggregator.index.close()
+
+        if results is not None:
+            plan = plan_update(existing_users, *(r.uids for r in results))
+            evicted, sample = api.preview_eviction(
+                existing_users, len(plan.to_add), plan.remove_candidates
+            )
+            if evicted:
+                phase.requests["block_list"] += len(sample)
+                sampled.update(sample)
+                phase.requests["csrf_temp"] += not has_temp_token
+                phase.requests["friend_del"] += len(evicted)
+                has_temp_token = True
+                evicted_set = set(evicted)
+                existing_users = [uid for uid in existing_users if uid not in evicted_set]
+            fit_to_cap(plan, config, existing_users)
+            if plan.to_add:
+                phase.requests["csrf_global"] += api.csrf_token is None
+                phase.requests["friend_add"] += len(plan.to_add)
+        phases.append(phase)
+
+    if "clean" in args.mode and (args.force_clean or len(existing_users) > config.friend_num):
+        phase = PhaseEstimate("clean")
+        cached = api.user_infos.known(existing_users)
+        uncached = len(existing_users) - len(cached)
+        removal = parse_policy(config.clean_policy, config.min_visit, config.min_day)
+        phase.requests["block_list"] += sum(
+            uid not in cached and uid not in sampled for uid in existing_users
+        )
+        if (removals := removal.removal_count(len(existing_users))) is None:
+            removals = len(removal.evaluate(cached.values()))
+            phase.possible["friend_del"] += uncached
+        phase.requests["friend_del"] += removals
+        if not has_temp_token:
+            (phase.requests if removals else phase.possible)["csrf_temp"] += 1
+        phases.append(phase)
+
+    history = (
+        load_latency(os.path.join(config.data_dir, config.metrics_file))
+        if config.metrics_file
+        else {}
+    )
+    estimator = RuntimeEstimator.from_config(config, {**history, **metrics.mean_latency()})
+    # 用戶資訊在兩種模式下都會併發查詢, 新增和移除用戶只有非同步模式會併發送出
+    concurrent = None if config.use_async else LOOKUP_ENDPOINTS
+    for phase in phases:
+        estimator.apply(phase, 1 if phase.name == "export" else config.concurrency, concurrent)
+        logger.info(f"執行計畫 {phase}")
+
+    total = sum(phase.seconds for phase in phases)
+    max_total = sum(phase.max_seconds for phase in phases)
+    logger.info(
+        f"執行計畫合計請求 {sum(p.requests.total() for p in phases)} 次，"
+        f"預估 {format_seconds(total)}，最長 {format_seconds(max_total)}"
+    )
+    return phases
+
+
+def real_main(
+    args: Namespace,
+    config: Config,
+    api: "GamerAPIExtended",
+    sources: "list[SourceResult] | None" = None,
+) -> int:
+    """執行所選的模式, 結束時不論成功與否都寫入錄製檔和本次執行的指標
+
+    --plan 只推估不執行, 不寫入指標以免覆蓋推估所用的歷史延遲。
+    """
+    try:
+        return run_modes(args, config, api, sources)
+    finally:
+        api.save_cassette()
+        if not args.plan:
+            api.write_metrics()
+
+
+def run_modes(
+    args: Namespace,
+    config: Config,
+    api: "GamerAPIExtended",
+    sources: "list[SourceResult] | None" = None,
+) -> int:
+    from .async_api import run_async
+
     if not api.login():
-        sys.exit(0)
+        return 1
+
+    if args.plan:
+        plan_run(args, config, api, sources)
+        return 0
+    if args.resume:
+        return resume_batches(config, api)
+    if pending := api.journal.pending():
+        logger.warning(f"操作日誌中有 {len(pending)} 個未完成的批次，可以使用 --resume 接續執行")
 
     if "export" in args.mode:
         logger.info("開始匯出黑名單...")
-        existing_users = api.export_users()
-        write_users(config.blacklist_dest, existing_users)
+        existing_users = export_to_file(args, config, api)
     else:
-        existing_users = api.export_users()
-
-    time.sleep(config.min_sleep)
+        existing_users = load_existing_users(config, api)
 
+    synced = True
     if "update" in args.mode:
         logger.info("開始更新黑名單...")
-        try:
-            uids = load_users(config.blacklist_src, api.session)
-        except RequestException as e:
-            logger.error(f"黑名單來源讀取失敗: {e}")
-            uids = []
-        if uids:
-            api.add_users(uids, existing_users, category="bad")
-        else:
-            logger.info("沒有更新黑名單，因為載入失敗或來源黑名單為空")
+        with api.metrics.timer("update"):
+            existing_users, synced = update_blacklist(args, config, api, existing_users, sources)
 
     if "clean" in args.mode:
         logger.info("開始清理黑名單...")
-        if args.force_clean or len(existing_users) > config.friend_num:
-            api.smart_remove_users(
-                existing_users, min_visits=config.min_visit, min_days=config.min_day
-            )
-        else:
+        if not (args.force_clean or len(existing_users) > config.friend_num):
             logger.info(f"黑名單數量未超過 {config.friend_num} 人, 跳過自動清理功能")
+        else:
+            with api.metrics.timer("clean"):
+                if config.use_async:
+                    removed = run_async(
+                        api,
+                        lambda async_api: async_api.smart_remove_users(
+                            existing_users,
+                            min_visits=config.min_visit,
+                            min_days=config.min_day,
+                            policy=config.clean_policy,
+                        ),
+                    )
+                else:
+                    removed = api.smart_remove_users(
+                        existing_users,
+                        min_visits=config.min_visit,
+                        min_days=config.min_day,
+                        policy=config.clean_policy,
+                    )
+            api.update_snapshot(removed)
 
-    return 0
+    api.save_session()
+    if args.watch:
+        return watch_sources(args, config, api)
+    # 批次執行時主程序依結束代碼決定是否 commit 共用的來源
+    return 0 if synced else 1
 
 
 def main(args: Namespace, config_name: str = "config.json") -> int:
+    return handle_errors(lambda: real_main(args, *init_app(args, config_name)))
+
+
+def handle_errors(job: Callable[[], int]) -> int:
+    """執行 job 並把例外轉換為錯誤訊息和結束代碼"""
     try:
-        config, api = init_app(args, config_name)
-        return real_main(args, config, api)
-    except RequestException as e:
-        logger.error(f"網路錯誤: {e}")
-    except ValueError as e:
-        logger.error(f"輸入錯誤: {e}")
-    except RuntimeError as e:
-        logger.error(f"執行階段錯誤: {e}")
+        return job()
     except Exception as e:
-        logger.exception(f"發生未預期的錯誤: {e}")
+        from curl_cffi.requests.exceptions import RequestException
+
+        if isinstance(e, RequestException):
+            logger.error(f"網路錯誤: {e}")
+        elif isinstance(e, ValueError):
+            logger.error(f"輸入錯誤: {e}")
+        elif isinstance(e, RuntimeError):
+            logger.error(f"執行階段錯誤: {e}")
+        else:
+            logger.exception(f"發生未預期的錯誤: {e}")
     return 1
@@ -0,0 +1,291 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from .results import BatchResult
+
+from .utils import atomic_write
+
+logger = logging.getLogger("baha_blacklist")
+
+# 請求延遲直方圖的上界 (秒), 與 Prometheus histogram 的 le 標籤相同
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# 網址檔名和指標名稱的對應, 沒有列出的端點使用去掉副檔名的檔名
+ENDPOINT_NAMES = {
+    "getCSRFToken.php": "csrf_temp",
+    "get_csrf_token.php": "csrf_global",
+    "friendList.php": "friend_list",
+}
+
+
+def endpoint_name(url: str) -> str:
+    """把請求網址轉換為指標使用的端點名稱, 例如 friend_add、block_list"""
+    filename = urlsplit(url.strip()).path.rstrip("/").rsplit("/", 1)[-1]
+    if filename in ENDPOINT_NAMES:
+        return ENDPOINT_NAMES[filename]
+    return filename.rsplit(".", 1)[0] or "root"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def to_dict(self) -> dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets, self.counts, strict=True):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        mean = self.sum / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": mean,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class Metrics:
+    """記錄每個端點的請求數、延遲、傳輸量和重試次數, 以及等待時間和各項操作的耗時
+
+    所有方法都是執行緒安全的, 同步和非同步 session 共用同一個實例。
+    """
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.counters: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        self.latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.sleep: defaultdict[str, float] = defaultdict(float)
+        self.operations: defaultdict[str, dict[str, float]] = defaultdict(
+            lambda: {"count": 0, "seconds": 0.0}
+        )
+        self.outcomes: defaultdict[str, Counter[str]] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record_request(
+        self,
+        url: str,
+        seconds: float,
+        status: int | None,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+    ) -> None:
+        """記錄一次實際送出的請求, status 為 None 代表連線錯誤"""
+        endpoint = endpoint_name(url)
+        with self._lock:
+            counter = self.counters[endpoint]
+            counter["requests"] += 1
+            counter[f"status_{status or 'error'}"] += 1
+            if status is None or status >= 400:
+                counter["errors"] += 1
+            counter["bytes_sent"] += bytes_sent
+            counter["bytes_received"] += bytes_received
+            self.latency[endpoint].observe(seconds)
+
+    def record_retry(self, url: str) -> None:
+        with self._lock:
+            self.counters[endpoint_name(url)]["retries"] += 1
+
+    def record_sleep(self, reason: str, seconds: float) -> None:
+        """記錄沒有在傳輸資料的等待時間, reason 例如 rate_limit、retry、circuit_breaker"""
+        if seconds > 0:
+            with self._lock:
+                self.sleep[reason] += seconds
+
+    def record_results(self, operation: str, results: "BatchResult") -> None:
+        """累計批次操作中每種處理結果的用戶數"""
+        with self._lock:
+            self.outcomes[operation].update(results.summary())
+
+    @contextmanager
+    def timer(self, operation: str) -> Iterator[None]:
+        """記錄 login、export、update、clean 等操作的次數和總耗時"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.operations[operation]["count"] += 1
+                self.operations[operation]["seconds"] += elapsed
+
+    def request_counts(self) -> Counter[str]:
+        """回傳每個端點目前為止的請求數"""
+        with self._lock:
+            return Counter({name: c["requests"] for name, c in self.counters.items()})
+
+    def mean_latency(self) -> dict[str, float]:
+        """回傳每個端點的平均延遲秒數"""
+        with self._lock:
+            return {name: h.sum / h.count for name, h in self.latency.items() if h.count}
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            endpoints = {
+                name: {**counter, "latency": self.latency[name].to_dict()}
+                for name, counter in sorted(self.counters.items())
+            }
+            wire = sum(h.sum for h in self.latency.values())
+            return {
+                "started_at": self.started_at,
+                "finished_at": time.time(),
+                "wire_seconds": wire,
+                "sleep_seconds": dict(self.sleep),
+                "endpoints": endpoints,
+                "operations": {name: dict(c) for name, c in self.operations.items()},
+                "outcomes": {name: dict(c) for name, c in self.outcomes.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """轉換為 Prometheus 文字格式, 可以交給 node_exporter 的 textfile collector 讀取"""
+        summary = self.summary()
+        endpoints = summary["endpoints"]
+        lines = []
+
+        def family(name: str, kind: str, samples: list[str]) -> None:
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        family(
+            "baha_requests_total",
+            "counter",
+            [
+                f'baha_requests_total{{endpoint="{n}"}} {d["requests"]}'
+                for n, d in endpoints.items()
+            ],
+        )
+        family(
+            "baha_request_errors_total",
+            "counter",
+            [
+                f'baha_request_errors_total{{endpoint="{n}"}} {d.get("errors", 0)}'
+                for n, d in endpoints.items()
+            ],
+        )
+        family(
+            "baha_retries_total",
+            "counter",
+            [
+                f'baha_retries_total{{endpoint="{n}"}} {d.get("retries", 0)}'
+                for n, d in endpoints.items()
+            ],
+        )
+        family(
+            "baha_bytes_total",
+            "counter",
+            [
+                f'baha_bytes_total{{endpoint="{n}",direction="{direction}"}} {d[f"bytes_{direction}"]}'
+                for n, d in endpoints.items()
+                for direction in ("sent", "received")
+            ],
+        )
+        histogram = []
+        for n, d in endpoints.items():
+            latency = d["latency"]
+            histogram += [
+                f'baha_request_duration_seconds_bucket{{endpoint="{n}",le="{le}"}} {count}'
+                for le, count in latency["buckets"].items()
+            ]
+            histogram.append(
+                f'baha_request_duration_seconds_sum{{endpoint="{n}"}} {latency["sum"]}'
+            )
+            histogram.append(
+                f'baha_request_duration_seconds_count{{endpoint="{n}"}} {latency["count"]}'
+            )
+        family("baha_request_duration_seconds", "histogram", histogram)
+        family(
+            "baha_sleep_seconds_total",
+            "counter",
+            [
+                f'baha_sleep_seconds_total{{reason="{reason}"}} {seconds}'
+                for reason, seconds in summary["sleep_seconds"].items()
+            ],
+        )
+        family(
+            "baha_operation_seconds_total",
+            "counter",
+            [
+                f'baha_operation_seconds_total{{operation="{op}"}} {d["seconds"]}'
+                for op, d in summary["operations"].items()
+            ],
+        )
+        family(
+            "baha_results_total",
+            "counter",
+            [
+                f'baha_results_total{{operation="{op}",status="{status}"}} {count}'
+                for op, counts in summary["outcomes"].items()
+                for status, count in counts.items()
+            ],
+        )
+        family(
+            "baha_wire_seconds_total",
+            "counter",
+            [f"baha_wire_seconds_total {summary['wire_seconds']}"],
+        )
+        family(
+            "baha_run_finished_timestamp_seconds",
+            "gauge",
+            [f"baha_run_finished_timestamp_seconds {summary['finished_at']}"],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """寫入本次執行的指標摘要, 副檔名為 .prom 時使用 Prometheus 文字格式, 否則為 JSON"""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.summary(), ensure_ascii=False, indent=2)
+        with atomic_write(path) as f:
+            f.write(content)
+        logger.info(f"已寫入執行指標: {path}")
+
+
+_PROM_LATENCY = re.compile(
+    r'^baha_request_duration_seconds_(sum|count)\{endpoint="([^"]+)"\} (\S+)$', re.MULTILINE
+)
+
+
+def load_latency(path: str) -> dict[str, float]:
+    """從先前寫入的指標檔讀取每個端點的平均延遲, 檔案不存在或無法解析時回傳空字典"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        if path.endswith(".prom"):
+            totals: defaultdict[str, dict[str, float]] = defaultdict(dict)
+            for kind, endpoint, value in _PROM_LATENCY.findall(content):
+                totals[endpoint][kind] = float(value)
+            return {name: t["sum"] / t["count"] for name, t in totals.items() if t.get("count")}
+        endpoints = json.loads(content)["endpoints"]
+        return {
+            name: float(data["latency"]["mean"])
+            for name, data in endpoints.items()
+            if data["latency"]["count"]
+        }
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"歷史指標 {path} 讀取失敗: {e}")
+        return {}
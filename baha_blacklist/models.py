@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+logger_time_fmt = "%Y-%m-%d"
+
+
+@dataclass
+class UserInfo:
+    uid: str
+    visit_count: int
+    last_login: datetime
+
+    def __str__(self) -> str:
+        return f"UserInfo(uid={self.uid}, visit_count={self.visit_count}, last_login={self.last_login.strftime(logger_time_fmt)})"
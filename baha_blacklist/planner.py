@@ -0,0 +1,200 @@
+import logging
+from collections import Counter
+from collections.abc import Collection, Iterable, Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from .config import Config
+from .models import UserInfo
+from .ratelimit import AdaptiveRateLimiter
+from .scoring import UserTable, least_active
+
+logger = logging.getLogger("baha_blacklist")
+
+
+@dataclass
+class UpdatePlan:
+    """更新模式的執行計畫
+
+    Attributes:
+        to_add: 需要新增的用戶, 依來源中第一次出現的順序排列並去除重複
+        remove_candidates: 已在黑名單中但不在任何來源中的用戶, 依匯出順序排列
+        already_present: 來源中已經在黑名單裡的用戶數量
+        duplicates: 來源之間或來源內重複出現的次數
+    """
+
+    to_add: list[str]
+    remove_candidates: list[str]
+    already_present: int
+    duplicates: int
+
+    def fit(self, room: int) -> list[str]:
+        """把 to_add 截到黑名單剩餘的空間, 回傳因為超過上限而略過的用戶"""
+        room = max(room, 0)
+        dropped = self.to_add[room:]
+        del self.to_add[room:]
+        return dropped
+
+    def __str__(self) -> str:
+        return (
+            f"需要新增 {len(self.to_add)} 個用戶，已存在 {self.already_present} 個，"
+            f"來源重複 {self.duplicates} 筆，不在來源中的既有用戶 {len(self.remove_candidates)} 個"
+        )
+
+
+def plan_update(existing_users: Iterable[str], *sources: Iterable[str]) -> UpdatePlan:
+    """以雜湊集合比較既有黑名單和來源清單, 只把真正的差異交給網路層
+
+    來源中的空白行和前後空白會被忽略, 每個來源只掃描一次。
+    """
+    existing = list(existing_users)
+    existing_set = set(existing)
+    seen: set[str] = set()
+    to_add: list[str] = []
+    already_present = duplicates = 0
+
+    for source in sources:
+        for line in source:
+            uid = line.strip()
+            if not uid:
+                continue
+            if uid in seen:
+                duplicates += 1
+                continue
+            seen.add(uid)
+            if uid in existing_set:
+                already_present += 1
+            else:
+                to_add.append(uid)
+
+    remove_candidates = [uid for uid in existing if uid not in seen]
+    plan = UpdatePlan(to_add, remove_candidates, already_present, duplicates)
+    logger.info(f"更新計畫: {plan}")
+    return plan
+
+
+def format_seconds(seconds: float) -> str:
+    return str(timedelta(seconds=round(seconds)))
+
+
+@dataclass
+class PhaseEstimate:
+    """單一模式的請求數和推估時間
+
+    Attributes:
+        name: 模式名稱
+        requests: 每個端點一定會送出的請求數
+        possible: 取決於尚未快取的用戶資訊, 最多還會額外送出的請求數
+        seconds: 只送出 requests 時的推估秒數
+        max_seconds: 加上 possible 時的推估秒數
+    """
+
+    name: str
+    requests: Counter[str] = field(default_factory=Counter)
+    possible: Counter[str] = field(default_factory=Counter)
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def __str__(self) -> str:
+        detail = ", ".join(f"{name} {count}" for name, count in sorted(self.requests.items()))
+        text = (
+            f"{self.name}: 請求 {self.requests.total()} 次 ({detail or '無'})，"
+            f"預估 {format_seconds(self.seconds)}"
+        )
+        if self.possible.total():
+            text += (
+                f"；視未快取的用戶資訊最多再請求 {self.possible.total()} 次，"
+                f"最長 {format_seconds(self.max_seconds)}"
+            )
+        return text
+
+
+class RuntimeEstimator:
+    """依速率限制器的加速規則和各端點的平均延遲推估請求所需的時間
+
+    速率從 rate_limit 開始每個請求增加固定值直到 1/min_sleep, 每個請求的間隔為請求間隔和
+    延遲 / concurrency 中較長者。推估假設伺服器不要求退避, 重試和退避會讓實際時間更長。
+    """
+
+    DEFAULT_LATENCY = 0.5
+
+    def __init__(
+        self,
+        rate: float,
+        max_rate: float,
+        increase: float,
+        latency: Mapping[str, float],
+        default_latency: float | None = None,
+    ) -> None:
+        """
+        Args:
+            rate: 初始每秒請求數
+            max_rate: 速率上限
+            increase: 每個成功請求增加的速率
+            latency: 各端點的平均延遲秒數
+            default_latency: 沒有歷史資料的端點使用的延遲, 預設為已知端點的平均值
+        """
+        self.rate = rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.latency = dict(latency)
+        if default_latency is None:
+            default_latency = (
+                sum(latency.values()) / len(latency) if latency else self.DEFAULT_LATENCY
+            )
+        self.default_latency = default_latency
+
+    @classmethod
+    def from_config(cls, config: Config, latency: Mapping[str, float]) -> "RuntimeEstimator":
+        limiter = AdaptiveRateLimiter.from_config(config)
+        return cls(limiter.rate, limiter.max_rate, limiter.increase, latency)
+
+    def estimate(
+        self,
+        requests: Mapping[str, int],
+        concurrency: int = 1,
+        advance: bool = True,
+        concurrent: Collection[str] | None = None,
+    ) -> float:
+        """推估依序送出 requests 所需的秒數, advance 為 True 時保留速率的爬升進度給下一次推估
+
+        concurrent 為併發送出的端點, 只有這些端點以 concurrency 分攤延遲, None 表示所有端點。
+        """
+        rate, seconds = self.rate, 0.0
+        for endpoint, count in requests.items():
+            latency = self.latency.get(endpoint, self.default_latency)
+            if concurrent is None or endpoint in concurrent:
+                latency /= concurrency
+            # 速率還在爬升時逐一計算, 到達上限後每個請求的間隔固定
+            while count > 0 and rate < self.max_rate and self.increase > 0:
+                seconds += max(1 / rate, latency)
+                rate = min(rate + self.increase, self.max_rate)
+                count -= 1
+            seconds += count * max(1 / rate, latency)
+        if advance:
+            self.rate = rate
+        return seconds
+
+    def apply(
+        self,
+        phase: PhaseEstimate,
+        concurrency: int = 1,
+        concurrent: Collection[str] | None = None,
+    ) -> PhaseEstimate:
+        phase.seconds = self.estimate(phase.requests, concurrency, concurrent=concurrent)
+        extra = self.estimate(phase.possible, concurrency, advance=False, concurrent=concurrent)
+        phase.max_seconds = phase.seconds + extra
+        return phase
+
+
+def rank_for_eviction(
+    user_infos: Iterable[UserInfo],
+    count: int,
+    min_visits: int,
+    min_days: int,
+    now: datetime | None = None,
+) -> list[UserInfo]:
+    """挑出活躍分數最低的 count 個用戶, 最不活躍的排在最前面, 排序和清理規則相同"""
+    user_infos = list(user_infos)
+    table = UserTable.from_infos(user_infos, now)
+    return [user_infos[i] for i in least_active(table, count, min_visits, min_days)]
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+
+from .config import Config
+
+logger = logging.getLogger("baha_blacklist")
+
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+FAILURE_KEYWORD = "失敗"
+# min_sleep 或 max_sleep 為 0 時的速率上限, 速率維持有限值, 加速和退避才能正常運作
+MAX_RATE = 1000.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket 搭配 AIMD 調整速率的限制器, 同步和非同步請求共用同一個實例
+
+    每個成功的回應讓速率加上固定值 (additive increase), 遇到 429/5xx 或「失敗」回應時速率乘上
+    decrease 並暫停 cooldown 秒 (multiplicative decrease), 連續退避時 cooldown 會加倍。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        burst: float = 1.0,
+        increase: float | None = None,
+        decrease: float = 0.5,
+        cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            rate: 初始每秒請求數
+            min_rate: 退避時的速率下限, 不超過 max_rate
+            max_rate: 加速時的速率上限, 不超過 MAX_RATE
+            burst: token bucket 容量, 閒置後最多可連續送出的請求數
+            increase: 每次成功回應增加的速率, 預設為速率範圍的 1/20
+            decrease: 退避時速率的乘數
+            cooldown: 第一次退避暫停的秒數
+            max_cooldown: 連續退避時暫停秒數的上限
+        """
+        self.max_rate = min(max_rate, MAX_RATE)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = burst
+        self.increase = increase if increase is not None else (self.max_rate - self.min_rate) / 20
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.backoff_level = 0
+        self.backoff_until = 0.0
+        self.clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "AdaptiveRateLimiter":
+        """以 rate_limit 為初始速率, min_sleep/max_sleep 分別對應最短和最長的請求間隔"""
+        max_rate = 1 / config.min_sleep if config.min_sleep > 0 else MAX_RATE
+        min_rate = 1 / config.max_sleep if config.max_sleep > 0 else MAX_RATE
+        return cls(
+            rate=config.rate_limit,
+            min_rate=min_rate,
+            max_rate=max_rate,
+            cooldown=config.backoff_cooldown,
+        )
+
+    def __str__(self) -> str:
+        remaining = max(self.backoff_until - self.clock(), 0)
+        return f"目前速率 {self.rate:.2f} 次/秒, 退避層級 {self.backoff_level}, 剩餘暫停 {remaining:.1f} 秒"
+
+    def reserve(self) -> float:
+        """預約一個 token, 回傳送出請求前需要等待的秒數"""
+        with self._lock:
+            now = self.clock()
+            elapsed = max(now - self._updated, 0)
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self) -> float:
+        import asyncio
+
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def observe(self, status_code: int, failed: bool = False) -> None:
+        """根據回應結果調整速率"""
+        if status_code in THROTTLE_STATUS:
+            self.on_throttle(f"HTTP {status_code}")
+        elif failed:
+            self.on_throttle(f"回應包含「{FAILURE_KEYWORD}」")
+        else:
+            self.on_success()
+
+    def on_success(self) -> None:
+        # log 在背景執行緒格式化, 需要在當下取得狀態的文字, 而不是傳入之後仍會變動的 self
+        state = None
+        with self._lock:
+            recovered = self.backoff_level > 0
+            self.backoff_level = 0
+            self.rate = min(self.rate + self.increase, self.max_rate)
+            if recovered or logger.isEnabledFor(logging.DEBUG):
+                state = str(self)
+        if recovered:
+            logger.info("速率限制器恢復加速: %s", state)
+        elif state is not None:
+            logger.debug("速率限制器: %s", state)
+
+    def on_throttle(self, reason: str) -> None:
+        with self._lock:
+            self.backoff_level += 1
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+            cooldown = min(self.cooldown * 2 ** (self.backoff_level - 1), self.max_cooldown)
+            now = self.clock()
+            self.backoff_until = now + cooldown
+            # 以預先扣除 token 的方式暫停, 排隊中的請求會在暫停結束後依新速率依序送出
+            self._tokens = min(self._tokens, 0) - cooldown * self.rate
+            state = str(self)
+        logger.warning("伺服器回應異常 (%s)，開始退避: %s", reason, state)
@@ -0,0 +1,120 @@
+from array import array
+from collections.abc import Iterator
+from enum import IntEnum
+from typing import NamedTuple
+
+
+class Status(IntEnum):
+    """單一用戶的處理結果"""
+
+    ADDED = 1
+    REMOVED = 2
+    KEPT = 3
+    PRESENT = 4
+    REJECTED = 5
+    ERROR = 6
+
+    @property
+    def label(self) -> str:
+        return STATUS_LABELS[self]
+
+    @property
+    def ok(self) -> bool:
+        """REJECTED 是伺服器回應操作失敗, ERROR 是請求或解析時發生例外, 其餘都算成功"""
+        return self not in (Status.REJECTED, Status.ERROR)
+
+
+STATUS_LABELS = {
+    Status.ADDED: "新增",
+    Status.REMOVED: "移除",
+    Status.KEPT: "保留",
+    Status.PRESENT: "已存在",
+    Status.REJECTED: "失敗",
+    Status.ERROR: "錯誤",
+}
+
+
+class Outcome(NamedTuple):
+    """單一用戶操作的回傳值, detail 只在失敗時保存伺服器回應或例外訊息"""
+
+    status: Status
+    detail: str | None = None
+
+
+class BatchResult:
+    """批次操作的結果, 以平行陣列保存用戶ID和狀態, 說明只保存失敗的用戶
+
+    加入結果時同時更新各狀態的計數, 統計不需要重新掃描所有結果。
+    """
+
+    __slots__ = ("_index", "counts", "details", "statuses", "uids")
+
+    def __init__(self) -> None:
+        self.uids: list[str] = []
+        self.statuses = array("B")
+        self.details: dict[int, str] = {}
+        self.counts = [0] * (max(Status) + 1)
+        self._index: dict[str, int] | None = None
+
+    def add(self, uid: str, status: Status, detail: str | None = None) -> Status:
+        if detail is not None:
+            self.details[len(self.uids)] = detail
+        self.uids.append(uid)
+        self.statuses.append(status)
+        self.counts[status] += 1
+        self._index = None
+        return status
+
+    def add_outcome(self, uid: str, outcome: Outcome) -> Status:
+        return self.add(uid, outcome.status, outcome.detail)
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.uids)
+
+    def __contains__(self, uid: object) -> bool:
+        return uid in self._uid_index()
+
+    def items(self) -> Iterator[tuple[str, Status]]:
+        for uid, status in zip(self.uids, self.statuses, strict=True):
+            yield uid, Status(status)
+
+    def get(self, uid: str) -> Status | None:
+        """回傳用戶的處理結果, 同一個用戶有多筆結果時回傳最後一筆"""
+        index = self._uid_index().get(uid)
+        return None if index is None else Status(self.statuses[index])
+
+    def detail(self, uid: str) -> str | None:
+        index = self._uid_index().get(uid)
+        return None if index is None else self.details.get(index)
+
+    def count(self, *statuses: Status) -> int:
+        return sum(self.counts[status] for status in statuses)
+
+    @property
+    def succeeded(self) -> int:
+        return len(self) - self.count(Status.REJECTED, Status.ERROR)
+
+    def with_status(self, *statuses: Status) -> list[str]:
+        codes = set(statuses)
+        return [
+            uid for uid, status in zip(self.uids, self.statuses, strict=True) if status in codes
+        ]
+
+    def summary(self) -> dict[str, int]:
+        return {
+            status.name.lower(): self.counts[status] for status in Status if self.counts[status]
+        }
+
+    def __str__(self) -> str:
+        detail = ", ".join(
+            f"{status.label} {self.counts[status]}" for status in Status if self.counts[status]
+        )
+        return f"成功: {self.succeeded}/{len(self)} ({detail or '無'})"
+
+    def _uid_index(self) -> dict[str, int]:
+        if self._index is None:
+            self._index = {uid: i for i, uid in enumerate(self.uids)}
+        return self._index
@@ -0,0 +1,180 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+
+from .config import Config
+from .ratelimit import THROTTLE_STATUS
+
+logger = logging.getLogger("baha_blacklist")
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路器連續開啟次數超過上限, 判定網站持續無法使用"""
+
+
+class RetryPolicy:
+    """指數退避加上隨機抖動 (full jitter) 的重試策略, 並統計重試次數"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retry_status: frozenset[int] = frozenset(THROTTLE_STATUS),
+        rng: random.Random | None = None,
+    ) -> None:
+        """
+        Args:
+            max_attempts: 每個請求最多嘗試的次數, 包含第一次
+            base_delay: 第一次重試前等待時間的上限
+            max_delay: 等待時間的上限
+            retry_status: 需要重試的 HTTP 狀態碼
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_status = retry_status
+        self.stats: Counter[str] = Counter()
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "RetryPolicy":
+        return cls(config.retry_attempts, config.retry_base_delay, config.retry_max_delay)
+
+    def __str__(self) -> str:
+        return (
+            f"請求 {self.stats['requests']} 次, 重試 {self.stats['retries']} 次, "
+            f"放棄 {self.stats['gave_up']} 次"
+        )
+
+    def should_retry(self, attempt: int, status_code: int | None) -> bool:
+        """attempt 從 1 開始, status_code 為 None 代表連線錯誤"""
+        retryable = status_code is None or status_code in self.retry_status
+        if retryable and attempt >= self.max_attempts:
+            self.count("gave_up")
+        return retryable and attempt < self.max_attempts
+
+    def backoff(self, attempt: int, retry_after: float = 0.0) -> float:
+        """回傳第 attempt 次失敗後的等待秒數, 伺服器指定 Retry-After 時不會短於該值"""
+        with self._lock:
+            ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay = self._rng.uniform(0, ceiling)
+        self.count("retries")
+        return min(max(delay, retry_after), self.max_delay)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+
+class CircuitBreaker:
+    """連續失敗達到門檻時開啟斷路器, 暫停所有請求直到冷卻結束後再以單一請求試探
+
+    狀態依序為 closed -> open -> half_open, 試探成功回到 closed, 失敗則再次開啟並加倍冷卻時間。
+    連續開啟 max_trips 次仍未恢復時拋出 CircuitOpenError, 避免在網站長時間故障時無限等待。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 60.0,
+        max_trips: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            failure_threshold: 開啟斷路器所需的連續失敗次數
+            recovery_timeout: 第一次開啟後暫停的秒數
+            max_trips: 連續開啟次數上限
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_trips = max_trips
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_until = 0.0
+        self.exhausted = False
+        self.transitions: Counter[str] = Counter()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "CircuitBreaker":
+        return cls(config.breaker_threshold, config.breaker_timeout)
+
+    def __str__(self) -> str:
+        remaining = max(self.opened_until - self.clock(), 0)
+        return (
+            f"斷路器狀態 {self.state}, 連續失敗 {self.failures} 次, "
+            f"開啟 {self.transitions[self.OPEN]} 次, 剩餘暫停 {remaining:.1f} 秒"
+        )
+
+    def wait_time(self) -> float:
+        """回傳送出請求前需要等待的秒數, 0 代表可以送出"""
+        with self._lock:
+            if self.exhausted:
+                raise CircuitOpenError(
+                    f"斷路器連續開啟 {self.max_trips} 次仍未恢復，網站可能暫時無法使用"
+                )
+            if self.state == self.CLOSED:
+                return 0.0
+            remaining = self.opened_until - self.clock()
+            if remaining > 0:
+                return remaining
+            if self.state == self.OPEN:
+                self._transition(self.HALF_OPEN)
+            if self._probing:
+                # 已經有請求在試探, 其他請求稍後再檢查
+                return min(self.recovery_timeout, 1.0)
+            self._probing = True
+            return 0.0
+
+    def reset(self) -> None:
+        """回到 closed 狀態並清除連續開啟次數, 包含已經判定網站無法使用的狀態"""
+        with self._lock:
+            self.exhausted = False
+            self.failures = 0
+            self.trips = 0
+            self.opened_until = 0.0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self.trips = 0
+                self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.trips += 1
+                if self.trips > self.max_trips:
+                    self.exhausted = True
+                    logger.error(f"斷路器連續開啟 {self.max_trips} 次仍未恢復，停止所有請求")
+                    return
+                timeout = self.recovery_timeout * 2 ** (self.trips - 1)
+                self.opened_until = self.clock() + timeout
+                self._transition(self.OPEN)
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"斷路器狀態 {self.state} -> {state}，連續失敗 {self.failures} 次")
+        self.state = state
+        self.transitions[state] += 1
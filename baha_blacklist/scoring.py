@@ -0,0 +1,185 @@
+import heapq
+import math
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Iterable
+from datetime import datetime
+
+from .models import UserInfo
+
+POLICY_NAMES = ("threshold", "score", "percentile", "keep_top")
+
+
+class UserTable:
+    """以欄位陣列保存的用戶資訊, 一次計算整個黑名單的上站次數和未上站天數
+
+    未上站天數以日期相減計算, 網站提供的上站日期本來就只到日。
+    """
+
+    __slots__ = ("idle_days", "uids", "visits")
+
+    def __init__(self, uids: list[str], visits: array, idle_days: array) -> None:
+        self.uids = uids
+        self.visits = visits
+        self.idle_days = idle_days
+
+    @classmethod
+    def from_infos(cls, user_infos: Iterable[UserInfo], now: datetime | None = None) -> "UserTable":
+        today = (now or datetime.now()).toordinal()
+        uids: list[str] = []
+        visits = array("q")
+        idle_days = array("l")
+        for user_info in user_infos:
+            uids.append(user_info.uid)
+            visits.append(user_info.visit_count)
+            idle_days.append(today - user_info.last_login.toordinal())
+        return cls(uids, visits, idle_days)
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+
+def activity_scores(table: UserTable, min_visits: int, min_days: int) -> array:
+    """計算活躍分數, 分數越高越活躍
+
+    上站次數取對數後除以 log(1 + min_visits), 未上站天數除以 min_days, 兩者相減。剛好在兩個門檻上的
+    用戶分數為 0, 上站次數多可以抵銷一部分未上站的天數。
+    """
+    visit_scale = math.log1p(max(min_visits, 1))
+    day_scale = max(min_days, 1)
+    log1p = math.log1p
+    return array(
+        "d",
+        [
+            log1p(max(visits, 0)) / visit_scale - idle / day_scale
+            for visits, idle in zip(table.visits, table.idle_days, strict=True)
+        ],
+    )
+
+
+def least_active(table: UserTable, count: int, min_visits: int, min_days: int) -> list[int]:
+    """回傳活躍分數最低的 count 個列號, 最不活躍的排在最前面, 分數相同時依表格順序
+
+    清理規則和黑名單超過上限時的移出都使用這個排序。
+    """
+    if count <= 0:
+        return []
+    scores = activity_scores(table, min_visits, min_days)
+    return heapq.nsmallest(count, range(len(table)), key=scores.__getitem__)
+
+
+class RemovalPolicy(ABC):
+    """清理黑名單時挑選移除對象的規則
+
+    Attributes:
+        per_user: 每個用戶可以單獨判斷, 不需要先取得所有用戶的資訊
+    """
+
+    per_user = True
+
+    def __init__(self, min_visits: int, min_days: int) -> None:
+        self.min_visits = min_visits
+        self.min_days = min_days
+
+    @abstractmethod
+    def select(self, table: UserTable) -> list[int]:
+        """回傳需要移除的列號, 依表格順序排列"""
+
+    def removal_count(self, total: int) -> int | None:
+        """只由人數決定移除數量的規則回傳移除人數, 其餘回傳 None"""
+        return None
+
+    def evaluate(self, user_infos: Iterable[UserInfo], now: datetime | None = None) -> list[str]:
+        table = UserTable.from_infos(user_infos, now)
+        return [table.uids[i] for i in self.select(table)]
+
+    def removes(self, user_info: UserInfo) -> bool:
+        return bool(self.evaluate([user_info]))
+
+    def _least_active(self, table: UserTable, count: int) -> list[int]:
+        return sorted(least_active(table, count, self.min_visits, self.min_days))
+
+
+class ThresholdPolicy(RemovalPolicy):
+    """上站次數低於 min_visits 或未上站天數大於 min_days 就移除"""
+
+    def select(self, table: UserTable) -> list[int]:
+        min_visits, min_days = self.min_visits, self.min_days
+        return [
+            i
+            for i, (visits, idle) in enumerate(zip(table.visits, table.idle_days, strict=True))
+            if visits < min_visits or idle > min_days
+        ]
+
+    def __str__(self) -> str:
+        return f"最小上站次數: {self.min_visits}, 最小天數: {self.min_days}"
+
+
+class ScorePolicy(RemovalPolicy):
+    """活躍分數低於 cutoff 就移除"""
+
+    def __init__(self, min_visits: int, min_days: int, cutoff: float = 0.0) -> None:
+        super().__init__(min_visits, min_days)
+        self.cutoff = cutoff
+
+    def select(self, table: UserTable) -> list[int]:
+        scores = activity_scores(table, self.min_visits, self.min_days)
+        return [i for i, score in enumerate(scores) if score < self.cutoff]
+
+    def __str__(self) -> str:
+        return f"活躍分數低於 {self.cutoff:g}"
+
+
+class PercentilePolicy(RemovalPolicy):
+    """移除活躍分數最低的 percent% 用戶"""
+
+    per_user = False
+
+    def __init__(self, min_visits: int, min_days: int, percent: float) -> None:
+        super().__init__(min_visits, min_days)
+        self.percent = percent
+
+    def removal_count(self, total: int) -> int:
+        return math.floor(total * self.percent / 100)
+
+    def select(self, table: UserTable) -> list[int]:
+        return self._least_active(table, self.removal_count(len(table)))
+
+    def __str__(self) -> str:
+        return f"活躍分數最低的 {self.percent:g}%"
+
+
+class KeepTopPolicy(RemovalPolicy):
+    """只保留活躍分數最高的 count 個用戶"""
+
+    per_user = False
+
+    def __init__(self, min_visits: int, min_days: int, count: int) -> None:
+        super().__init__(min_visits, min_days)
+        self.count = count
+
+    def removal_count(self, total: int) -> int:
+        return max(total - self.count, 0)
+
+    def select(self, table: UserTable) -> list[int]:
+        return self._least_active(table, self.removal_count(len(table)))
+
+    def __str__(self) -> str:
+        return f"只保留最活躍的 {self.count} 人"
+
+
+def parse_policy(spec: str, min_visits: int, min_days: int) -> RemovalPolicy:
+    """解析清理規則, 格式為 threshold、score[:門檻]、percentile:百分比 或 keep_top:人數"""
+    name, _, value = spec.strip().partition(":")
+    try:
+        if name == "threshold" and not value:
+            return ThresholdPolicy(min_visits, min_days)
+        if name == "score":
+            return ScorePolicy(min_visits, min_days, float(value or 0))
+        if name == "percentile" and 0 <= float(value) <= 100:
+            return PercentilePolicy(min_visits, min_days, float(value))
+        if name == "keep_top" and int(value) >= 0:
+            return KeepTopPolicy(min_visits, min_days, int(value))
+    except ValueError:
+        pass
+    raise ValueError(f"無效的清理規則 {spec!r}，可用的規則: {', '.join(POLICY_NAMES)}")
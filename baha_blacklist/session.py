@@ -0,0 +1,305 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from typing import IO, Any
+from urllib.parse import urlencode
+
+from curl_cffi.requests import AsyncSession, Cookies, Headers, Response, Session
+from curl_cffi.requests.exceptions import RequestException
+
+from .cassette import Cassette
+from .metrics import Metrics
+from .ratelimit import FAILURE_KEYWORD, THROTTLE_STATUS, AdaptiveRateLimiter
+from .retry import CircuitBreaker, RetryPolicy
+from .utils import atomic_write
+
+logger = logging.getLogger("baha_blacklist")
+
+# 只檢查 API 回應是否包含「失敗」, 避免掃描完整的 HTML 頁面
+FAILURE_CHECK_MAX_BYTES = 2048
+# JSON 回應中的「失敗」可能以 \uXXXX 跳脫
+FAILURE_KEYWORD_ESCAPED = json.dumps(FAILURE_KEYWORD)[1:-1]
+
+
+def is_failed_response(response: Response, stream: bool = False) -> bool:
+    if stream or len(response.content) > FAILURE_CHECK_MAX_BYTES:
+        return False
+    text = response.text
+    return FAILURE_KEYWORD in text or FAILURE_KEYWORD_ESCAPED in text.lower()
+
+
+class _GuardedSession:
+    """同步和非同步 session 共用的速率限制、重試和斷路器邏輯, 實際的等待由子類別處理"""
+
+    rate_limiter: AdaptiveRateLimiter
+    retry_policy: RetryPolicy | None
+    circuit_breaker: CircuitBreaker | None
+    metrics: Metrics | None
+    cassette: Cassette | None
+    cookies: Cookies
+    headers: Headers
+
+    def _breaker_wait(self) -> float:
+        wait = self.circuit_breaker.wait_time() if self.circuit_breaker else 0.0
+        if self.metrics:
+            self.metrics.record_sleep("circuit_breaker", wait)
+        return wait
+
+    def _record_wait(self, reason: str, seconds: float) -> None:
+        if self.metrics:
+            self.metrics.record_sleep(reason, seconds)
+
+    def _record_request(
+        self, url: str, start: float, response: Response | None, kwargs: dict[str, Any]
+    ) -> None:
+        if not self.metrics:
+            return
+        received = 0
+        if response is not None:
+            if kwargs.get("stream"):
+                received = int(response.headers.get("content-length") or 0)
+            else:
+                received = len(response.content)
+        self.metrics.record_request(
+            url,
+            time.perf_counter() - start,
+            response.status_code if response is not None else None,
+            _request_size(kwargs),
+            received,
+        )
+
+    def _record_retry(self, url: str, delay: float) -> None:
+        if self.metrics:
+            self.metrics.record_retry(url)
+            self.metrics.record_sleep("retry", delay)
+
+    def _delay_after_error(self, attempt: int) -> float | None:
+        """連線錯誤後回傳重試前的等待秒數, 不重試時回傳 None"""
+        self.rate_limiter.on_throttle("連線錯誤")
+        if self.circuit_breaker:
+            self.circuit_breaker.record_failure()
+        if self.retry_policy and self.retry_policy.should_retry(attempt, None):
+            return self.retry_policy.backoff(attempt)
+        return None
+
+    def _delay_after_response(self, response: Response, attempt: int, stream: bool) -> float | None:
+        """根據回應調整速率和斷路器, 回傳重試前的等待秒數, 不重試時回傳 None"""
+        status = response.status_code
+        self.rate_limiter.observe(status, is_failed_response(response, stream))
+        retryable = self.retry_policy is not None and status in self.retry_policy.retry_status
+        if self.circuit_breaker:
+            if retryable or status in THROTTLE_STATUS:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+        if self.retry_policy and retryable and self.retry_policy.should_retry(attempt, status):
+            logger.debug("HTTP %s，第 %s 次嘗試失敗，準備重試: %s", status, attempt, response.url)
+            return self.retry_policy.backoff(attempt, _retry_after(response))
+        return None
+
+    def _count_request(self) -> None:
+        if self.retry_policy:
+            self.retry_policy.count("requests")
+
+    def _replaying(self) -> bool:
+        return self.cassette is not None and self.cassette.replaying
+
+    def _replay(self, method: str, url: str, kwargs: dict[str, Any]) -> tuple[Response, float]:
+        """從錄製檔取得回應, 並把回應設定的 cookies 套用到 session"""
+        assert self.cassette is not None
+        response, delay = self.cassette.replay(method, url, kwargs)
+        for name, value in response.cookies.items():
+            self.cookies.set(name, value)
+        return response, delay
+
+    def _record(
+        self, method: str, url: str, kwargs: dict[str, Any], response: Response, start: float
+    ) -> Response:
+        if self.cassette is None:
+            return response
+        secrets = [*self.cookies.values(), self.headers.get("x-bahamut-csrf-token")]
+        elapsed = time.perf_counter() - start
+        return self.cassette.record(method, url, kwargs, response, elapsed, secrets)
+
+
+class GamerSession(_GuardedSession, Session):
+    """所有請求都經過共用速率限制器、重試策略和斷路器的 Session, 設定 cassette 時錄製或重播請求
+
+    重播時不經過速率限制器, 以完整速度或錄製時的延遲回傳。
+
+    curl_cffi 不同版本的 get/post 實作方式不同, 所以在這裡明確轉交給 request
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        rate_limiter: AdaptiveRateLimiter,
+        retry_policy: RetryPolicy | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        metrics: Metrics | None = None,
+        cassette: Cassette | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.cassette = cassette
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> Response:  # type: ignore[override]
+        stream = bool(kwargs.get("stream"))
+        for attempt in itertools.count(1):
+            while (wait := self._breaker_wait()) > 0:
+                time.sleep(wait)
+            if not self._replaying():
+                self._record_wait("rate_limit", self.rate_limiter.acquire())
+            self._count_request()
+            start = time.perf_counter()
+            try:
+                if self._replaying():
+                    response, latency = self._replay(method, url, kwargs)
+                    time.sleep(latency)
+                else:
+                    response = super().request(method, url, *args, **kwargs)  # type: ignore[arg-type]
+                    response = self._record(method, url, kwargs, response, start)
+            except RequestException:
+                self._record_request(url, start, None, kwargs)
+                if (delay := self._delay_after_error(attempt)) is None:
+                    raise
+            else:
+                self._record_request(url, start, response, kwargs)
+                if (delay := self._delay_after_response(response, attempt, stream)) is None:
+                    return response
+                if stream:
+                    response.close()
+            self._record_retry(url, delay)
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def get(self, url: str, **kwargs: Any) -> Response:  # type: ignore[override]
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> Response:  # type: ignore[override]
+        return self.request("POST", url, **kwargs)
+
+
+class AsyncGamerSession(_GuardedSession, AsyncSession):
+    """GamerSession 的非同步版本, 與同步 Session 共用同一個速率限制器、重試策略和斷路器"""
+
+    def __init__(
+        self,
+        *args: Any,
+        rate_limiter: AdaptiveRateLimiter,
+        retry_policy: RetryPolicy | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        metrics: Metrics | None = None,
+        cassette: Cassette | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.cassette = cassette
+
+    async def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> Response:  # type: ignore[override]
+        stream = bool(kwargs.get("stream"))
+        for attempt in itertools.count(1):
+            while (wait := self._breaker_wait()) > 0:
+                await asyncio.sleep(wait)
+            if not self._replaying():
+                self._record_wait("rate_limit", await self.rate_limiter.aacquire())
+            self._count_request()
+            start = time.perf_counter()
+            try:
+                if self._replaying():
+                    response, latency = self._replay(method, url, kwargs)
+                    await asyncio.sleep(latency)
+                else:
+                    response = await super().request(method, url, *args, **kwargs)  # type: ignore[arg-type]
+                    response = self._record(method, url, kwargs, response, start)
+            except RequestException:
+                self._record_request(url, start, None, kwargs)
+                if (delay := self._delay_after_error(attempt)) is None:
+                    raise
+            else:
+                self._record_request(url, start, response, kwargs)
+                if (delay := self._delay_after_response(response, attempt, stream)) is None:
+                    return response
+                if stream:
+                    await response.aclose()
+            self._record_retry(url, delay)
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def get(self, url: str, **kwargs: Any) -> Response:  # type: ignore[override]
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> Response:  # type: ignore[override]
+        return await self.request("POST", url, **kwargs)
+
+
+def _request_size(kwargs: dict[str, Any]) -> int:
+    """估計請求本文的大小, 表單以 URL 編碼後的長度計算"""
+    data = kwargs.get("data")
+    if isinstance(data, dict):
+        return len(urlencode(data))
+    if isinstance(data, str | bytes):
+        return len(data)
+    if (payload := kwargs.get("json")) is not None:
+        return len(json.dumps(payload))
+    return 0
+
+
+def _retry_after(response: Response) -> float:
+    """讀取以秒數表示的 Retry-After, 其他格式視為沒有指定"""
+    try:
+        return float(response.headers.get("retry-after") or 0)
+    except ValueError:
+        return 0.0
+
+
+class SessionStore:
+    """把登入後的 cookies 和 CSRF Token 存到硬碟, 之後執行時沿用以跳過完整登入流程
+
+    檔案包含登入憑證, 建立時權限設為只有擁有者可讀寫。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def save(self, session: Session, csrf_token: str | None) -> None:
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in session.cookies.jar
+            if c.value and not c.is_expired()
+        ]
+        state = {"saved_at": time.time(), "csrf_token": csrf_token, "cookies": cookies}
+        with atomic_write(self.path, _open_private) as f:
+            json.dump(state, f)
+        logger.debug(f"已保存登入狀態: {self.path}")
+
+    def load(self, session: Session) -> str | None:
+        """把保存的 cookies 套用到 session, 回傳 CSRF Token, 沒有保存的狀態時拋出 FileNotFoundError"""
+        with open(self.path, encoding="utf-8") as f:
+            state = json.load(f)
+        for cookie in state["cookies"]:
+            session.cookies.set(
+                cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"]
+            )
+        return state.get("csrf_token")
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _open_private(path: str) -> IO[str]:
+    """以只有擁有者可以讀寫的權限開啟檔案, 登入狀態包含憑證"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return os.fdopen(fd, "w", encoding="utf-8")
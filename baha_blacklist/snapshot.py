@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from .utils import atomic_write
+
+logger = logging.getLogger("baha_blacklist")
+
+# 差異累積的用戶數超過基準快照人數 (至少此數量) 時壓縮為新的基準快照, 空的差異以一人計算,
+# 只更新同步時間的匯出也不會讓快照檔案無限制地成長
+MIN_COMPACT_SIZE = 100
+
+
+@dataclass
+class SnapshotDelta:
+    """兩個黑名單狀態之間的差異, 依發生順序排列"""
+
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed)
+
+    def __str__(self) -> str:
+        return f"新增 {len(self.added)} 人，移除 {len(self.removed)} 人"
+
+
+class SnapshotStore:
+    """黑名單狀態的本地快照, 以 append-only 的 JSON lines 保存
+
+    第一行是完整的基準快照 (base), 之後每次匯出或新增、移除用戶只附加差異 (delta), 差異累積的
+    用戶數超過基準快照時壓縮為新的基準快照。匯出時寫入的差異會標記 verified, 代表當時的狀態
+    和網站上的黑名單一致, age 以最後一次 verified 的時間計算。
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.clock = clock
+        self.verified_at: float | None = None
+        self._users: dict[str, None] = {}
+        self._delta_size = 0
+        self._lock = threading.Lock()
+        self._load()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def users(self) -> list[str]:
+        return list(self._users)
+
+    def age(self) -> float | None:
+        """距離上次和網站同步的秒數, 沒有快照時回傳 None"""
+        if self.verified_at is None:
+            return None
+        return max(self.clock() - self.verified_at, 0.0)
+
+    def recent(self, max_age: float) -> list[str] | None:
+        """快照在 max_age 秒內和網站同步過時回傳快照中的用戶, 否則回傳 None"""
+        age = self.age()
+        if age is None or age > max_age:
+            return None
+        return self.users
+
+    def seed(self, users: Iterable[str]) -> None:
+        """沒有快照時以既有的匯出檔案內容建立基準快照, 同步時間設為未知, 不會被 recent 使用"""
+        with self._lock:
+            if self.verified_at is not None:
+                return
+            self._users = dict.fromkeys(users)
+            self.verified_at = 0.0
+            self._write_base()
+
+    def record(self, users: Iterable[str]) -> SnapshotDelta:
+        """記錄從網站讀取的完整黑名單, 回傳和上一個快照的差異
+
+        第一次記錄時差異為空, 沒有變更時也會寫入一筆空的差異以更新同步時間。
+        """
+        users = list(dict.fromkeys(users))
+        with self._lock:
+            if self.verified_at is None:
+                self._users = dict.fromkeys(users)
+                self.verified_at = self.clock()
+                self._write_base()
+                return SnapshotDelta()
+
+            current = set(users)
+            delta = SnapshotDelta(
+                added=[uid for uid in users if uid not in self._users],
+                removed=[uid for uid in self._users if uid not in current],
+            )
+            self._users = dict.fromkeys(users)
+            self.verified_at = self.clock()
+            self._append(delta, verified=True)
+            return delta
+
+    def apply(self, added: Iterable[str] = (), removed: Iterable[str] = ()) -> SnapshotDelta:
+        """套用本程式成功新增或移除的用戶, 不更新同步時間; 沒有快照時不做任何事"""
+        with self._lock:
+            if self.verified_at is None:
+                return SnapshotDelta()
+            delta = SnapshotDelta(
+                added=[uid for uid in dict.fromkeys(added) if uid not in self._users],
+                removed=[uid for uid in dict.fromkeys(removed) if uid in self._users],
+            )
+            if delta:
+                for uid in delta.removed:
+                    del self._users[uid]
+                self._users.update(dict.fromkeys(delta.added))
+                self._append(delta, verified=False)
+            return delta
+
+    def _append(self, delta: SnapshotDelta, verified: bool) -> None:
+        self._delta_size += max(len(delta), 1)
+        if self._delta_size > max(len(self._users), MIN_COMPACT_SIZE):
+            self._write_base()
+            return
+
+        entry = {
+            "type": "delta",
+            "ts": self.clock(),
+            "verified": verified,
+            "added": delta.added,
+            "removed": delta.removed,
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _write_base(self) -> None:
+        """以目前的狀態重寫快照檔案, 先寫入暫存檔再替換"""
+        entry = {
+            "type": "base",
+            "ts": self.clock(),
+            "verified_at": self.verified_at,
+            "users": list(self._users),
+        }
+        with atomic_write(self.path) as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._delta_size = 0
+        logger.debug(f"已寫入黑名單快照，共 {len(self._users)} 人: {self.path}")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry: dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中斷時可能留下寫到一半的最後一行
+                    logger.debug(f"略過損毀的快照內容: {line!r}")
+                    continue
+                if entry["type"] == "base":
+                    self._users = dict.fromkeys(entry["users"])
+                    self.verified_at = entry["verified_at"]
+                    self._delta_size = 0
+                elif entry["type"] == "delta" and self.verified_at is not None:
+                    for uid in entry["removed"]:
+                        self._users.pop(uid, None)
+                    self._users.update(dict.fromkeys(entry["added"]))
+                    self._delta_size += max(len(entry["added"]) + len(entry["removed"]), 1)
+                    if entry["verified"]:
+                        self.verified_at = entry["ts"]
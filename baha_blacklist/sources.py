@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from curl_cffi.requests import Session
+from curl_cffi.requests.exceptions import RequestException
+
+from .utils import atomic_write, chunked
+
+logger = logging.getLogger("baha_blacklist")
+
+
+@dataclass
+class SourceResult:
+    """黑名單來源的讀取結果
+
+    Attributes:
+        source: 來源網址或檔案路徑
+        uids: 來源中的用戶ID
+        changed: 內容是否和上次 commit 時不同
+        validators: 用於下次條件式請求的 ETag/Last-Modified, 本地檔案則是修改時間和大小
+    """
+
+    source: str
+    uids: list[str]
+    changed: bool
+    validators: dict[str, str] = field(default_factory=dict)
+    body: str = ""
+
+
+class SourceFetcher:
+    """讀取黑名單來源並在硬碟保存內容和驗證資訊
+
+    遠端來源會帶上 If-None-Match/If-Modified-Since 發送條件式請求, 伺服器回應 304 時直接使用
+    硬碟中的內容並回報未變更。驗證資訊要等到呼叫 commit 才會寫入, 更新中途失敗時下次執行仍會
+    視為有變更。
+    """
+
+    def __init__(self, session: Session, cache_dir: str) -> None:
+        self.session = session
+        self.cache_dir = cache_dir
+
+    def fetch(self, source: str) -> SourceResult:
+        if source.startswith(("http://", "https://")):
+            return self._fetch_remote(source)
+        return self._fetch_local(source)
+
+    def commit(self, result: SourceResult) -> None:
+        """保存來源內容和驗證資訊, 下次讀取時以此為比較基準"""
+        meta_path, body_path = self._paths(result.source)
+        with atomic_write(body_path) as f:
+            f.write(result.body)
+        with atomic_write(meta_path) as f:
+            json.dump({"source": result.source, **result.validators}, f)
+        logger.debug(f"已保存黑名單來源 {result.source} 的快取")
+
+    def _fetch_remote(self, source: str) -> SourceResult:
+        cached_body = self._load_body(source)
+        meta = self._load_meta(source) if cached_body is not None else {}
+        headers = {}
+        if etag := meta.get("etag"):
+            headers["if-none-match"] = etag
+        if last_modified := meta.get("last-modified"):
+            headers["if-modified-since"] = last_modified
+
+        response = self.session.get(source, headers=headers)
+        if response.status_code == 304 and cached_body is not None:
+            logger.info(f"黑名單來源未變更 (HTTP 304): {source}")
+            return SourceResult(source, split_users(cached_body), False, meta, cached_body)
+
+        response.raise_for_status()
+        validators = {
+            key: value for key in ("etag", "last-modified") if (value := response.headers.get(key))
+        }
+        body = response.text
+        changed = body != cached_body
+        return SourceResult(source, split_users(body), changed, validators, body)
+
+    def _fetch_local(self, source: str) -> SourceResult:
+        if not os.path.isfile(source):
+            return SourceResult(source, [], False)
+
+        stat = os.stat(source)
+        validators = {"mtime": str(stat.st_mtime_ns), "size": str(stat.st_size)}
+        with open(source, encoding="utf-8") as f:
+            body = f.read()
+        meta = self._load_meta(source)
+        changed = any(meta.get(key) != value for key, value in validators.items())
+        return SourceResult(source, split_users(body), changed, validators, body)
+
+    def _paths(self, source: str) -> tuple[str, str]:
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.json", f"{base}.txt"
+
+    def _load_meta(self, source: str) -> dict[str, str]:
+        meta_path, _ = self._paths(source)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return meta if meta.get("source") == source else {}
+
+    def _load_body(self, source: str) -> str | None:
+        _, body_path = self._paths(source)
+        try:
+            with open(body_path, encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+class SourceIndex:
+    """記錄每個用戶ID來自哪些黑名單來源的 SQLite 索引
+
+    來源內容變更並 commit 後才會更新, 之後執行時不需要重新讀取所有來源就能查詢用戶ID是否為新的。
+    """
+
+    def __init__(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS source_uid ("
+            "uid TEXT NOT NULL, source TEXT NOT NULL, PRIMARY KEY (uid, source)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS source ("
+            "source TEXT PRIMARY KEY, uid_count INTEGER NOT NULL, indexed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT uid) FROM source_uid").fetchone()[0]
+
+    def replace(self, source: str, uids: Iterable[str]) -> None:
+        """以來源目前的內容取代索引中該來源的所有用戶ID"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM source_uid WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO source_uid (uid, source) VALUES (?, ?)",
+                ((uid, source) for uid in _clean_uids(uids)),
+            )
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM source_uid WHERE source = ?", (source,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO source (source, uid_count, indexed_at) VALUES (?, ?, ?)",
+                (source, count, time.time()),
+            )
+
+    def indexed_sources(self) -> set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT source FROM source")}
+
+    def new_uids(self, uids: Iterable[str]) -> list[str]:
+        """回傳不在任何已索引來源中的用戶ID, 保留輸入順序"""
+        uids = list(uids)
+        known: set[str] = set()
+        with self._lock:
+            for chunk in chunked(uids):
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT uid FROM source_uid WHERE uid IN ({placeholders})", chunk
+                )
+                known.update(row[0] for row in rows)
+        return [uid for uid in uids if uid not in known]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SourceAggregator:
+    """併發讀取多個黑名單來源, 並在 commit 時更新來源快取和用戶來源索引"""
+
+    def __init__(self, fetcher: SourceFetcher, index: SourceIndex, max_workers: int = 4) -> None:
+        self.fetcher = fetcher
+        self.index = index
+        self.max_workers = max_workers
+
+    def fetch_all(self, sources: Iterable[str]) -> list[SourceResult]:
+        """讀取所有來源, 讀取失敗的來源會記錄錯誤後略過, 回傳順序和輸入相同"""
+        sources = list(dict.fromkeys(sources))
+        with ThreadPoolExecutor(max(1, min(self.max_workers, len(sources)))) as executor:
+            outcomes = list(executor.map(self._fetch, sources))
+        results = [result for result in outcomes if result is not None]
+
+        if results:
+            merged = {uid for result in results for uid in _clean_uids(result.uids)}
+            fresh = len(self.index.new_uids(merged))
+            logger.info(
+                f"讀取 {len(results)}/{len(sources)} 個黑名單來源，合併後共 {len(merged)} 個用戶，"
+                f"其中 {fresh} 個不在先前的來源索引中"
+            )
+        return results
+
+    def commit(self, results: Iterable[SourceResult]) -> None:
+        """保存來源快取, 內容變更或尚未索引的來源會重建索引"""
+        indexed = self.index.indexed_sources()
+        for result in results:
+            self.fetcher.commit(result)
+            if result.changed or result.source not in indexed:
+                self.index.replace(result.source, result.uids)
+
+    def _fetch(self, source: str) -> SourceResult | None:
+        try:
+            return self.fetcher.fetch(source)
+        except (RequestException, OSError) as e:
+            logger.error(f"黑名單來源讀取失敗 {source}: {e}")
+            return None
+
+
+def _clean_uids(uids: Iterable[str]) -> Iterable[str]:
+    return (uid for line in uids if (uid := line.strip()))
+
+
+def split_users(body: str) -> list[str]:
+    return [line.rstrip("\n") for line in body.splitlines()]
@@ -0,0 +1,76 @@
+import json
+import logging
+import threading
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncio
+
+logger = logging.getLogger("baha_blacklist")
+
+# 419 是 CSRF Token 過期專用的狀態碼, 其他回應 (包含 401/403) 必須同時提到 Token 和錯誤才算,
+# 避免把一般的權限不足當成 Token 過期而重新取得並重試
+TOKEN_EXPIRED_STATUS = 419
+TOKEN_KEYWORDS = ("csrf", "token")
+TOKEN_ERROR_KEYWORDS = ("error", "invalid", "expired", "mismatch", "錯誤", "過期", "失效", "無效")
+# JSON 回應中的中文可能以 \uXXXX 跳脫
+_ERROR_KEYWORDS = TOKEN_ERROR_KEYWORDS + tuple(
+    json.dumps(keyword)[1:-1].lower() for keyword in TOKEN_ERROR_KEYWORDS if not keyword.isascii()
+)
+
+
+def is_token_error(status_code: int, text: str) -> bool:
+    """判斷回應是否代表 CSRF Token 無效或過期"""
+    if status_code == TOKEN_EXPIRED_STATUS:
+        return True
+    lowered = text[:512].lower()
+    return any(keyword in lowered for keyword in TOKEN_KEYWORDS) and any(
+        keyword in lowered for keyword in _ERROR_KEYWORDS
+    )
+
+
+class TokenManager:
+    """快取 CSRF Token 供整批請求重複使用, 只在第一次使用或被判定失效後才重新取得"""
+
+    def __init__(self, name: str, fetch: Callable[[], str]) -> None:
+        """
+        Args:
+            name: 顯示在 log 中的 Token 名稱
+            fetch: 取得新 Token 的函式
+        """
+        self.name = name
+        self.token: str | None = None
+        self.fetch_count = 0
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._async_lock: asyncio.Lock | None = None
+        self._async_loop: asyncio.AbstractEventLoop | None = None
+
+    def get(self) -> str:
+        with self._lock:
+            if self.token is None:
+                self.token = self._fetch()
+                self.fetch_count += 1
+                logger.debug(f"{self.name} 已取得 (第 {self.fetch_count} 次)")
+            return self.token
+
+    async def aget(self, fetch: Callable[[], Awaitable[str]]) -> str:
+        """非同步版本的 get, 同一時間只會有一個請求在取得 Token"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self._async_lock is None or self._async_loop is not loop:
+            self._async_lock, self._async_loop = asyncio.Lock(), loop
+        async with self._async_lock:
+            if self.token is None:
+                self.token = await fetch()
+                self.fetch_count += 1
+                logger.debug(f"{self.name} 已取得 (第 {self.fetch_count} 次)")
+            return self.token
+
+    def invalidate(self, token: str | None = None) -> None:
+        """讓 Token 失效, 指定 token 時只有仍是同一個 Token 才會清除, 避免覆蓋其他請求剛取得的新 Token"""
+        if token is None or token == self.token:
+            logger.debug(f"{self.name} 已失效，下次使用時重新取得")
+            self.token = None
@@ -2,30 +2,58 @@ import argparse
 import base64
 import json
 import os
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any
+from typing import IO, Any
 
-from curl_cffi.requests import Session
+# SQLite 單一查詢的參數數量上限為 999, 保留一些給查詢中的其他參數
+SQLITE_CHUNK_SIZE = 900
 
 
-def load_users(source: str, session: Session) -> list[str]:
-    """從黑名單列表中讀取用戶，來源可以是網路或者文件檔案"""
-    if source.startswith(("http://", "https://")):
-        response = session.get(source)
-        response.raise_for_status()
-        return [line.rstrip("\n") for line in response.text.splitlines()]
-    else:
-        if os.path.isfile(source):
-            with open(source, encoding="utf-8") as f:
-                return [line.rstrip("\n") for line in f]
-        else:
-            return []
+def chunked(items: list[str], size: int = SQLITE_CHUNK_SIZE) -> Iterator[list[str]]:
+    """把 items 依序切成最多 size 個一段, 用於 SQL 的 IN 查詢"""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+@contextmanager
+def atomic_write(path: str, open_file: Callable[[str], IO[str]] | None = None) -> Iterator[IO[str]]:
+    """寫入暫存檔, 結束時才替換目標檔案, 寫入中途失敗時刪除暫存檔而不會留下不完整的檔案
+
+    Args:
+        path: 目標檔案路徑, 上層資料夾不存在時會自動建立
+        open_file: 以暫存檔路徑開啟檔案的函式, 預設以 UTF-8 文字模式開啟
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with (open_file or _open_text)(tmp_path) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
-def write_users(file_path: str, content: list[str]) -> None:
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(content))
-        f.write("\n")
+def _open_text(path: str) -> IO[str]:
+    return open(path, "w", encoding="utf-8")
+
+
+def write_users(file_path: str, content: Iterable[str]) -> int:
+    """逐行寫入用戶ID, 可以直接傳入產生器, 寫入中途失敗時不會留下不完整的檔案
+
+    Returns:
+        寫入的用戶數量
+    """
+    count = 0
+    with atomic_write(file_path) as f:
+        for uid in content:
+            f.write(f"{uid}\n")
+            count += 1
+    return count
 
 
 def to_unicode(string: str) -> str:
@@ -53,10 +81,6 @@ def decode_response_dict(response: dict[str, Any]) -> dict[str, Any]:
     return json.loads(json.dumps(response, ensure_ascii=False))
 
 
-def count_success(results: dict[Any, Any], keywords: list[str] = ["失敗"]) -> int:
-    return sum(1 for r in results.values() if not any(keyword in r for keyword in keywords))
-
-
 class CustomHelpFormatter(argparse.RawTextHelpFormatter):
     def __init__(self, prog: Any) -> None:
         super().__init__(prog, max_help_position=36)
@@ -94,6 +118,13 @@ def parse_arguments() -> argparse.Namespace:
         dest="cookies_first",
         help="先使用cookies登入，失敗才改用密碼登入",
     )
+    parser.add_argument(
+        "--no-session-cache",
+        action="store_false",
+        default=None,
+        dest="session_cache",
+        help="不沿用保存的登入狀態，每次都重新登入",
+    )
     parser.add_argument(
         "-s",
         "--source-path",
@@ -101,6 +132,12 @@ def parse_arguments() -> argparse.Namespace:
         type=str,
         help="黑名單來源檔案路徑",
     )
+    parser.add_argument(
+        "--extra-source",
+        action="append",
+        dest="blacklist_srcs",
+        help="額外的黑名單來源網址或檔案路徑，可以重複使用以合併多個來源",
+    )
     parser.add_argument(
         "-o",
         "--output-path",
@@ -122,6 +159,109 @@ def parse_arguments() -> argparse.Namespace:
         dest="force_clean",
         help="強制清理黑名單列表，預設黑名單數量超過 1000 人才會自動清理",
     )
+    parser.add_argument(
+        "--clean-policy",
+        dest="clean_policy",
+        type=str,
+        help="清理規則，預設 threshold\n"
+        "'threshold' 上站次數或上站日期不符合門檻就移除\n"
+        "'score[:門檻]' 活躍分數低於門檻 (預設 0) 就移除\n"
+        "'percentile:百分比' 移除活躍分數最低的百分比\n"
+        "'keep_top:人數' 只保留活躍分數最高的人數",
+    )
+    parser.add_argument(
+        "--async",
+        action="store_true",
+        default=None,
+        dest="use_async",
+        help="使用非同步引擎併發處理新增和清理，速率由 rate_limit 控制",
+    )
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        help="非同步引擎同時處理的用戶數量上限",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        dest="rate_limit",
+        type=float,
+        help="初始每秒請求數，之後會依伺服器回應在 1/max_sleep 到 1/min_sleep 之間自動調整",
+    )
+    parser.add_argument(
+        "--force-update",
+        action="store_true",
+        dest="force_update",
+        help="即使黑名單來源自上次更新後沒有變更也執行更新",
+    )
+    parser.add_argument(
+        "--accounts",
+        dest="accounts",
+        type=str,
+        help="帳號清單 JSON 檔案路徑，每個帳號在各自的子程序中執行，共用的黑名單來源只讀取一次",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        type=str,
+        help="執行指標的檔名，寫入 data_dir 中，副檔名 .prom 使用 Prometheus 格式，否則為 JSON",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help="從操作日誌接續上次中斷的新增或移除批次，不執行其他模式",
+    )
+    parser.add_argument(
+        "--snapshot-max-age",
+        dest="snapshot_max_age",
+        type=int,
+        help="沒有選擇 export 模式時，本地快照在此秒數內和網站同步過就直接使用，不重新讀取黑名單",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        dest="watch",
+        help="執行完所選模式後持續監看黑名單來源，沿用同一個登入狀態，來源變更時只新增差異",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        dest="watch_interval",
+        type=float,
+        help="監看模式檢查黑名單來源的間隔秒數",
+    )
+    parser.add_argument(
+        "--record",
+        dest="record_path",
+        type=str,
+        help="把所有請求和回應錄製到此檔案 (gzip JSON lines)，密碼、Token 和 cookies 會被遮蔽",
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay_path",
+        type=str,
+        help="不連線，改從錄製檔重播回應，用於離線分析效能",
+    )
+    parser.add_argument(
+        "--replay-realtime",
+        action="store_true",
+        default=None,
+        dest="replay_realtime",
+        help="重播時依錄製時的延遲等待，預設立即回傳",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        dest="plan",
+        help="只讀取黑名單和來源，列出各模式會送出的請求數和預估執行時間，不新增或移除用戶",
+    )
+
+    parser.add_argument(
+        "--log-json",
+        dest="log_json",
+        type=str,
+        help="另外把 log 以 JSON lines 格式寫入此檔案",
+    )
 
     log_group = parser.add_mutually_exclusive_group()
     log_group.add_argument("-q", "--quiet", action="store_true", help="安靜模式")
@@ -1,4 +1,12 @@
-from baha_blacklist import main, utils
+from baha_blacklist import utils
 
 args = utils.parse_arguments()
+# 解析參數後才載入主程式, -h 和參數錯誤不需要載入 curl_cffi 和 lxml
+if args.accounts:
+    from baha_blacklist import batch
+
+    raise SystemExit(batch.run_batch(args))
+
+from baha_blacklist import main
+
 raise SystemExit(main.main(args))
@@ -0,0 +1,79 @@
+import os
+from contextlib import ExitStack
+from typing import Any
+
+import pytest
+
+from baha_blacklist.config import Config
+from baha_blacklist.gamer_api import GamerAPIExtended
+
+from .mock_server import MockBahamut
+
+# 設定 BAHA_BENCHMARK=1 才會執行大規模的效能測試
+RUN_FULL_BENCHMARK = os.environ.get("BAHA_BENCHMARK") == "1"
+
+_benchmark_results: list[dict[str, object]] = []
+
+# 連到模擬伺服器時使用的設定: 速率限制器幾乎不限速、退避和重試不等待, 不使用用戶資訊快取和已保存的
+# session, 測試量測的是程式本身加上本地網路的行為
+OFFLINE_CONFIG: dict[str, Any] = {
+    "account": "test",
+    "min_sleep": 0.0,
+    "max_sleep": 0.0,
+    "rate_limit": 1e9,
+    "backoff_cooldown": 0.0,
+    "retry_base_delay": 0.0,
+    "user_info_ttl": 0,
+    "session_cache": False,
+}
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """建立離線測試用的 Config, data_dir 為 tmp_path, 以關鍵字參數覆寫設定值"""
+
+    def factory(**overrides: Any) -> Config:
+        return Config(**{**OFFLINE_CONFIG, "data_dir": str(tmp_path), **overrides})
+
+    return factory
+
+
+@pytest.fixture
+def make_api(make_config):
+    def factory(**overrides: Any) -> GamerAPIExtended:
+        return GamerAPIExtended(make_config(**overrides))
+
+    return factory
+
+
+@pytest.fixture
+def bahamut():
+    """啟動模擬伺服器並讓所有 curl_cffi Session 連到它, 參數同 MockBahamut, 測試結束時關閉"""
+    with ExitStack() as stack:
+
+        def start(**options: Any) -> MockBahamut:
+            mock = stack.enter_context(MockBahamut(**options))
+            stack.enter_context(mock.patch_sessions())
+            return mock
+
+        yield start
+
+
+@pytest.fixture
+def benchmark_report():
+    """收集效能測試結果, 在測試結束時輸出表格"""
+    return _benchmark_results.append
+
+
+def pytest_terminal_summary(terminalreporter) -> None:  # type: ignore[no-untyped-def]
+    if not _benchmark_results:
+        return
+    terminalreporter.section("benchmark")
+    terminalreporter.write_line(
+        f"{'operation':<10}{'users':>8}{'seconds':>10}{'users/sec':>12}{'requests/user':>15}"
+    )
+    for r in _benchmark_results:
+        terminalreporter.write_line(
+            f"{r['operation']:<10}{r['users']:>8}{r['seconds']:>10.3f}"
+            f"{r['users_per_sec']:>12.1f}{r['requests_per_user']:>15.2f}"
+        )
@@ -0,0 +1,209 @@
+"""模擬巴哈姆特黑名單相關 API 的本地伺服器, 用於離線測試和效能測試
+
+GamerAPI 的網址是寫死的正式網址, 使用 rewrite_url 把 https://home.gamer.com.tw/xxx 轉成
+http://127.0.0.1:port/home/xxx, 再以 patch_sessions 套用到所有 curl_cffi Session。
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from unittest.mock import patch
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from curl_cffi.requests import AsyncSession, Session
+
+HOSTS = ("www", "home", "api", "user")
+
+
+class MockBahamut:
+    """模擬 friendList.php、friend_add.php、friend_del.php、block_list.php 和 CSRF 端點
+
+    Args:
+        blacklist_size: 初始黑名單人數
+        latency: 每個請求的延遲秒數
+        error_rate: 回應 503 的機率
+        inactive_ratio: 用戶資訊中不活躍用戶 (上站次數 0, 兩年前登入) 的比例
+        page_size: friendList.php 每頁的用戶數量, 0 代表不分頁
+
+    logged_in 設為 False 時設定頁面會重定向到登入頁面, 模擬登入狀態失效。
+    """
+
+    def __init__(
+        self,
+        blacklist_size: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        inactive_ratio: float = 0.5,
+        seed: int = 0,
+        page_size: int = 0,
+    ) -> None:
+        self.blacklist: dict[str, None] = {f"user{i:06d}": None for i in range(blacklist_size)}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.inactive_ratio = inactive_ratio
+        self.page_size = page_size
+        self.temp_token = "temp-token"
+        self.global_token = "global-token-000"
+        self.logged_in = True
+        self.hits: Counter[str] = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> "MockBahamut":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.hits.values())
+
+    def reset_counters(self) -> None:
+        self.hits.clear()
+        self.max_in_flight = 0
+
+    def rewrite_url(self, url: str) -> str:
+        for host in HOSTS:
+            prefix = f"https://{host}.gamer.com.tw/"
+            if url.startswith(prefix):
+                return f"{self.base_url}/{host}/{url[len(prefix) :]}"
+        return url
+
+    @contextmanager
+    def patch_sessions(self):  # type: ignore[no-untyped-def]
+        """讓所有 curl_cffi Session 的請求改送到本地伺服器"""
+        sync_request = Session.request
+        async_request = AsyncSession.request
+        server = self
+
+        def request(self: Session, method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+            return sync_request(self, method, server.rewrite_url(url), *args, **kwargs)
+
+        async def arequest(
+            self: AsyncSession, method: str, url: str, *args: Any, **kwargs: Any
+        ) -> Any:
+            return await async_request(self, method, server.rewrite_url(url), *args, **kwargs)
+
+        with (
+            patch.object(Session, "request", request),
+            patch.object(AsyncSession, "request", arequest),
+        ):
+            yield self
+
+    def user_info(self, uid: str) -> dict[str, Any]:
+        inactive = (zlib.crc32(uid.encode()) % 1000) / 1000 < self.inactive_ratio
+        visits = 0 if inactive else 500
+        last_login = datetime.now() - timedelta(days=730 if inactive else 1)
+        items = [
+            {"name": "上站次數", "value": str(visits)},
+            {"name": "上站日期", "value": last_login.strftime("%Y-%m-%d")},
+        ]
+        return {"data": {"blocks": [{"type": "user_info", "data": {"items": items}}]}}
+
+    def friend_list_html(self, query: dict[str, str]) -> str:
+        uids = list(self.blacklist)
+        next_link = ""
+        if self.page_size:
+            page = int(query.get("page", "1"))
+            if page * self.page_size < len(uids):
+                next_query = f"user={query.get('user', '')}&t={query.get('t', '5')}&page={page + 1}"
+                next_link = f'<a rel="next" href="friendList.php?{next_query}">下一頁</a>'
+            uids = uids[(page - 1) * self.page_size : page * self.page_size]
+        rows = "".join(f'<div class="user_id" data-origin="{uid}">{uid}</div>\n' for uid in uids)
+        return f"<html><body><div class='friend_list'>\n{rows}</div>{next_link}</body></html>"
+
+    def _handle(
+        self, method: str, path: str, query: dict[str, str], form: dict[str, str]
+    ) -> tuple[int, str]:
+        endpoint = unquote(path).strip("/ ").rsplit("/", 1)[-1]
+        with self._lock:
+            self.hits[endpoint] += 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            return 503, "Service Unavailable"
+
+        if endpoint == "friendList.php":
+            return 200, self.friend_list_html(query)
+        if endpoint == "friend_add.php":
+            with self._lock:
+                self.blacklist[form["uid"]] = None
+            return 200, json.dumps({"data": {"ok": "加入黑名單成功"}})
+        if endpoint == "friend_del.php":
+            if form.get("token") != self.temp_token:
+                return 200, "token error"
+            with self._lock:
+                self.blacklist.pop(form["fid"], None)
+            return 200, "D-ONE"
+        if endpoint == "block_list.php":
+            return 200, json.dumps(self.user_info(query["userid"]), ensure_ascii=False)
+        if endpoint == "getCSRFToken.php":
+            return 200, self.temp_token
+        if endpoint == "get_csrf_token.php":
+            return 200, self.global_token
+        if path.startswith("/home/setting"):
+            if not self.logged_in:
+                return 302, ""
+            return 200, "<html>setting</html>"
+        if endpoint == "login.php":
+            return 200, "<html>login</html>"
+        return 404, "Not Found"
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _respond(self, method: str) -> None:
+                parts = urlsplit(self.path)
+                query = {k: v[0].strip() for k, v in parse_qs(parts.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                form = {k: v[0] for k, v in parse_qs(body).items()}
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                if server.latency:
+                    time.sleep(server.latency)
+                status, text = server._handle(method, parts.path, query, form)
+                with server._lock:
+                    server.in_flight -= 1
+                payload = text.encode("utf-8")
+                self.send_response(status)
+                if status == 302:
+                    self.send_header("Location", "/user/login.php")
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self) -> None:
+                self._respond("GET")
+
+            def do_POST(self) -> None:
+                self._respond("POST")
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        return Handler
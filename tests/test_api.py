@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 
 from baha_blacklist.config import Config
 from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.results import Status
 
 load_dotenv()
 
@@ -27,8 +28,6 @@ def mock_api(mock_config) -> GamerAPIExtended:
 
 def test_api(mock_api, mock_config):
     # 常數設定
-    remove_success_msg = "D-ONE"
-    add_success_msg = "成功"
     uids_env = os.environ.get("UIDS", "")
     uids = uids_env.split(",")
 
@@ -42,10 +41,10 @@ def test_api(mock_api, mock_config):
     # 測試移除
     results = mock_api.remove_users(uids)
     for uid in uids:
-        assert remove_success_msg in results[uid]
+        assert results.get(uid) is Status.REMOVED
 
     # 測試新增
     skipped_users = []
     results = mock_api.add_users(uids, skipped_users)
     for uid in uids:
-        assert add_success_msg in results[uid]
+        assert results.get(uid) is Status.ADDED
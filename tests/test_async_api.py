@@ -0,0 +1,40 @@
+import pytest
+
+from baha_blacklist.async_api import run_async
+from baha_blacklist.results import Status
+
+OPERATIONS = {
+    "add": lambda api, uids, existing: api.add_users(uids, skipped_users=existing),
+    "remove": lambda api, uids, existing: api.remove_users(uids[:6]),
+    "smart_remove": lambda api, uids, existing: api.smart_remove_users(existing, 10, 365),
+}
+
+
+@pytest.mark.parametrize("op", list(OPERATIONS))
+def test_async_matches_sync(op, bahamut, make_api):
+    mock = bahamut(blacklist_size=12)
+    initial = dict(mock.blacklist)
+    existing = list(initial)
+    uids = existing[:3] + [f"new{i}" for i in range(5)]
+    operation = OPERATIONS[op]
+
+    outcomes = []
+    for use_async in (False, True):
+        mock.blacklist = dict(initial)
+        mock.reset_counters()
+        api = make_api(concurrency=3)
+        if use_async:
+            results = run_async(api, lambda a: operation(a, uids, existing))
+        else:
+            results = operation(api, uids, existing)
+        assert results.succeeded == len(results)
+        outcomes.append((dict(results.items()), set(mock.blacklist), dict(mock.hits)))
+
+    # 非同步引擎的結果、伺服器上的黑名單和各端點的請求數都和同步版本相同
+    assert outcomes[0] == outcomes[1]
+    statuses = outcomes[0][0]
+    if op == "add":
+        assert [statuses[uid] for uid in uids[:3]] == [Status.PRESENT] * 3
+        assert statuses["new0"] is Status.ADDED
+    else:
+        assert Status.REMOVED in statuses.values()
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from baha_blacklist import batch
+from baha_blacklist.batch import account_configs, load_accounts
+from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.sources import SourceFetcher, SourceIndex
+from baha_blacklist.utils import parse_arguments
+
+from .conftest import OFFLINE_CONFIG
+
+
+class InlineExecutor(ThreadPoolExecutor):
+    """在同一個程序中依序執行帳號, 讓模擬伺服器的 patch 對帳號的流程生效"""
+
+    def __init__(self, max_workers: int, mp_context: object = None) -> None:
+        super().__init__(1)
+
+
+def test_load_accounts(tmp_path):
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps(["alice", {"account": "bob", "min_day": 30}]), encoding="utf-8")
+    assert load_accounts(str(path)) == [{"account": "alice"}, {"account": "bob", "min_day": 30}]
+
+    path.write_text(json.dumps(["alice", "alice"]), encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_accounts(str(path))
+
+    path.write_text(json.dumps([{"password": "x"}]), encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_accounts(str(path))
+
+
+def test_account_configs_precedence_and_isolation():
+    accounts = [{"account": "alice"}, {"account": "bob", "min_day": 30, "data_dir": "/tmp/bob"}]
+    json_config = {"min_day": 360, "min_visit": 10, "data_dir": "./cache"}
+    cli_config = {"min_visit": 20, "concurrency": None, "mode": ["update"]}
+
+    alice, bob = account_configs(accounts, json_config, cli_config)
+    assert (alice.min_day, alice.min_visit) == (360, 20)
+    assert (bob.min_day, bob.min_visit) == (30, 20)
+    assert alice.data_dir.endswith("alice")
+    assert bob.data_dir == "/tmp/bob"
+    assert alice.blacklist_dest == "./blacklist_alice.txt"
+    assert bob.blacklist_dest == "./blacklist_bob.txt"
+
+    # CLI 指定的路徑也會加上帳號名稱, 帳號設定中的路徑則原樣使用
+    cli_config = {"blacklist_dest": "out.txt", "data_dir": "/tmp/shared"}
+    accounts = [{"account": "alice"}, {"account": "bob", "blacklist_dest": "bob.txt"}]
+    alice, bob = account_configs(accounts, json_config, cli_config)
+    assert alice.blacklist_dest == "out_alice.txt"
+    assert alice.data_dir == os.path.join("/tmp/shared", "alice")
+    assert bob.blacklist_dest == "bob.txt"
+
+
+@pytest.mark.parametrize("failing", [set(), {"bob"}])
+def test_login_failure_skips_source_commit(failing, tmp_path, bahamut, monkeypatch):
+    source = tmp_path / "source.txt"
+    source.write_text("new0\nnew1\n", encoding="utf-8")
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({**OFFLINE_CONFIG, "data_dir": str(tmp_path), "blacklist_src": str(source)}),
+        encoding="utf-8",
+    )
+    accounts = tmp_path / "accounts.json"
+    accounts.write_text(json.dumps(["alice", "bob"]), encoding="utf-8")
+    monkeypatch.setattr(
+        sys, "argv", ["run.py", "--accounts", str(accounts), "--mode", "update", "-q"]
+    )
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", InlineExecutor)
+    monkeypatch.setattr(GamerAPIExtended, "login", lambda self: self.config.account not in failing)
+
+    mock = bahamut()
+    root_handlers = logging.root.handlers[:]
+    root_level = logging.root.level
+    try:
+        code = batch.run_batch(parse_arguments(), str(config_path))
+    finally:
+        batch.stop_logging()
+        logging.root.handlers[:] = root_handlers
+        logging.root.setLevel(root_level)
+
+    assert code == (1 if failing else 0)
+    assert {"new0", "new1"} <= set(mock.blacklist)
+    # 有帳號失敗時不保存來源快取, 下次執行時來源仍視為已變更
+    index = SourceIndex(str(tmp_path / "sources.sqlite3"))
+    assert (str(source) in index.indexed_sources()) is not failing
+    index.close()
+    result = SourceFetcher(None, str(tmp_path / "sources")).fetch(str(source))  # type: ignore[arg-type]
+    assert result.changed is bool(failing)
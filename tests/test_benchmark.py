@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from .conftest import RUN_FULL_BENCHMARK
+from .mock_server import MockBahamut
+
+SIZES = [
+    100,
+    pytest.param(1500, marks=pytest.mark.skipif(not RUN_FULL_BENCHMARK, reason="BAHA_BENCHMARK=1")),
+    pytest.param(
+        50000, marks=pytest.mark.skipif(not RUN_FULL_BENCHMARK, reason="BAHA_BENCHMARK=1")
+    ),
+]
+
+
+def record(report, mock: MockBahamut, operation: str, users: int, seconds: float) -> None:
+    report({
+        "operation": operation,
+        "users": users,
+        "seconds": seconds,
+        "users_per_sec": users / seconds,
+        "requests_per_user": mock.total_requests / users,
+    })
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_export(size, bahamut, make_api, benchmark_report):
+    mock = bahamut(blacklist_size=size)
+    api = make_api()
+    start = time.perf_counter()
+    users = api.export_users()
+    elapsed = time.perf_counter() - start
+
+    assert len(users) == size
+    record(benchmark_report, mock, "export", size, elapsed)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_update(size, bahamut, make_api, benchmark_report):
+    uids = [f"new{i:06d}" for i in range(size)]
+    mock = bahamut()
+    api = make_api()
+    start = time.perf_counter()
+    results = api.add_users(uids)
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == size
+    assert len(mock.blacklist) == size
+    record(benchmark_report, mock, "update", size, elapsed)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_clean(size, bahamut, make_api, benchmark_report):
+    mock = bahamut(blacklist_size=size, inactive_ratio=0.5)
+    uids = list(mock.blacklist)
+    api = make_api()
+    start = time.perf_counter()
+    results = api.smart_remove_users(uids, min_visits=10, min_days=365)
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == size
+    assert 0 < len(mock.blacklist) < size
+    record(benchmark_report, mock, "clean", size, elapsed)
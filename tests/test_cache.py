@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+from baha_blacklist.cache import UserInfoCache
+from baha_blacklist.models import UserInfo
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = UserInfoCache(str(tmp_path / "user_info.sqlite3"), ttl=100, max_entries=3, clock=clock)
+    yield cache
+    cache.close()
+
+
+def make_info(uid: str, visit_count: int = 10) -> UserInfo:
+    return UserInfo(uid=uid, visit_count=visit_count, last_login=datetime(2024, 1, 2))
+
+
+def test_get_and_ttl(cache, clock):
+    cache.put(make_info("a"))
+    cache.put(make_info("b"), ttl=10)
+    assert cache.get("a") == make_info("a")
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "b"}
+
+    clock.now += 50
+    assert cache.get("b") is None
+    assert set(cache.get_many(["a", "b", "c"])) == {"a"}
+
+    clock.now += 100
+    assert cache.get("a") is None
+
+
+def test_put_keeps_newest_entries(cache, clock):
+    for uid in "abcde":
+        clock.now += 1
+        cache.put(make_info(uid))
+    # 寫入時就移除超出容量的最舊資料
+    assert len(cache) == 3
+    assert sorted(cache.get_many("abcde")) == ["c", "d", "e"]
+
+    clock.now += 1
+    cache.put_many([make_info("f"), make_info("g")])
+    assert sorted(cache.get_many("abcdefg")) == ["e", "f", "g"]
+
+
+def test_evict_removes_expired_entries(cache, clock):
+    cache.put(make_info("a"), ttl=10)
+    cache.put(make_info("b"))
+    clock.now += 50
+    assert cache.evict() == 1
+    assert len(cache) == 1 and cache.get("b") is not None
+
+
+def test_persistence(tmp_path, clock):
+    path = str(tmp_path / "user_info.sqlite3")
+    cache = UserInfoCache(path, ttl=100, max_entries=10, clock=clock)
+    cache.put(make_info("a", visit_count=42))
+    cache.close()
+
+    reopened = UserInfoCache(path, ttl=100, max_entries=10, clock=clock)
+    assert reopened.get("a").visit_count == 42
+    reopened.close()
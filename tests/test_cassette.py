@@ -0,0 +1,55 @@
+import gzip
+from argparse import Namespace
+
+from baha_blacklist.config import Config
+from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.main import real_main
+
+
+def run(config: Config) -> GamerAPIExtended:
+    args = Namespace(
+        mode=["update", "export", "clean"],
+        plan=False,
+        resume=False,
+        watch=False,
+        force_update=False,
+        force_clean=True,
+    )
+    api = GamerAPIExtended(config)
+    api.login = lambda: True  # type: ignore[method-assign]
+    assert real_main(args, config, api) == 0
+    return api
+
+
+def test_record_then_replay_offline(tmp_path, bahamut, make_config):
+    cassette = str(tmp_path / "run.jsonl.gz")
+    (tmp_path / "source.txt").write_text("\n".join(f"new{i}" for i in range(10)))
+
+    def config_for(name: str, **overrides) -> Config:
+        return make_config(
+            min_visit=10,
+            min_day=365,
+            blacklist_cap=30,
+            blacklist_src=str(tmp_path / "source.txt"),
+            blacklist_dest=str(tmp_path / f"{name}.txt"),
+            data_dir=str(tmp_path / name),
+            **overrides,
+        )
+
+    mock = bahamut(blacklist_size=25, page_size=10)
+    recorded = run(config_for("record", record_path=cassette))
+    final_blacklist = list(mock.blacklist)
+
+    with gzip.open(cassette, "rt", encoding="utf-8") as f:
+        content = f.read()
+    assert mock.temp_token not in content
+    assert mock.global_token not in content
+    assert "<redacted>" in content
+
+    # 所有回應都來自錄製檔, 不會送出任何請求
+    mock.reset_counters()
+    replayed = run(config_for("replay", replay_path=cassette))
+    assert mock.total_requests == 0
+    assert replayed.metrics.request_counts() == recorded.metrics.request_counts()
+    assert sorted(replayed.snapshots.users) == sorted(final_blacklist)
+    assert (tmp_path / "replay.txt").read_text() == (tmp_path / "record.txt").read_text()
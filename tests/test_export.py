@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from baha_blacklist.utils import write_users
+
+
+@pytest.mark.parametrize("page_size", [0, 7])
+def test_iter_users_follows_pagination(page_size, bahamut, make_api):
+    mock = bahamut(blacklist_size=30, page_size=page_size)
+    users = list(make_api().iter_users())
+    assert users == list(mock.blacklist)
+    assert mock.hits["friendList.php"] == (5 if page_size else 1)
+
+
+def test_iter_users_yields_before_download_finishes(bahamut, make_api):
+    bahamut(blacklist_size=20_000)
+    users = make_api().iter_users()
+    assert next(users) == "user000000"
+    users.close()
+
+
+def test_write_users_keeps_old_file_on_failure(tmp_path):
+    dest = str(tmp_path / "blacklist.txt")
+    assert write_users(dest, iter(["a", "b"])) == 2
+
+    def broken():
+        yield "c"
+        raise RuntimeError("斷線")
+
+    with pytest.raises(RuntimeError):
+        write_users(dest, broken())
+    with open(dest, encoding="utf-8") as f:
+        assert f.read() == "a\nb\n"
+    assert not os.path.exists(f"{dest}.tmp")
@@ -0,0 +1,47 @@
+import os
+
+from baha_blacklist.journal import Journal
+
+
+def test_pending_after_interruption(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path)
+    batch_id = journal.begin("smart_remove", ["a", "b", "c", "d"], min_visits=5, min_days=30)
+    journal.record(batch_id, "a")
+    journal.record(batch_id, "b", ok=False)
+    journal.record(batch_id, "c")
+    # 模擬中斷時寫到一半的最後一行
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "done", "batch": ')
+
+    (batch,) = Journal(path).pending()
+    assert batch.op == "smart_remove"
+    assert batch.params == {"min_visits": 5, "min_days": 30}
+    assert batch.remaining == ["b", "d"]
+
+
+def test_resume_supersedes_and_truncates(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path)
+    batch_id = journal.begin("add", ["a", "b"], category="bad")
+    journal.record(batch_id, "a")
+
+    journal = Journal(path)
+    (batch,) = journal.pending()
+    journal.resume(batch)
+    new_id = journal.begin("add", batch.remaining, category="bad")
+    assert Journal(path).pending()[0].batch_id == new_id
+
+    journal.record(new_id, "b")
+    journal.end(new_id)
+    assert not os.path.exists(path)
+    assert Journal(path).pending() == []
+
+
+def test_journal_is_per_account(make_api):
+    api_a = make_api(account="a")
+    api_a.journal.begin("add", ["x", "y"], category="bad")
+
+    # 同一個 data_dir 的其他帳號不會接續 a 的批次
+    assert make_api(account="b").journal.pending() == []
+    assert len(make_api(account="a").journal.pending()) == 1
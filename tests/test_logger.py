@@ -0,0 +1,54 @@
+import atexit
+import json
+import logging
+import threading
+
+from baha_blacklist.logger import CustomFormatter, setup_logging, stop_logging
+
+
+class Expensive:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.thread = ""
+
+    def __str__(self) -> str:
+        self.calls += 1
+        self.thread = threading.current_thread().name
+        return "expensive"
+
+
+def test_queue_logging_formats_lazily(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr("baha_blacklist.logger._atexit_registered", False)
+    json_path = tmp_path / "log.jsonl"
+    root_handlers = logging.root.handlers[:]
+    root_level = logging.root.level
+    try:
+        setup_logging(logging.INFO)
+        setup_logging(logging.INFO, json_path=str(json_path))
+        logger = logging.getLogger("baha_blacklist")
+        value = Expensive()
+        logger.debug("不會輸出 %s", value)
+        logger.info("用戶 %s 移除成功: %s", "alice", value)
+        stop_logging()
+    finally:
+        logging.root.handlers[:] = root_handlers
+        logging.root.setLevel(root_level)
+
+    assert registered.count(stop_logging) == 1
+    # 低於等級的記錄不會格式化, 輸出的記錄只在背景執行緒格式化一次
+    assert value.calls == 1
+    assert value.thread != threading.current_thread().name
+    (line,) = json_path.read_text(encoding="utf-8").splitlines()
+    entry = json.loads(line)
+    assert entry["level"] == "info"
+    assert entry["message"] == "用戶 alice 移除成功: expensive"
+
+
+def test_custom_formatter_reuses_prefix():
+    formatter = CustomFormatter(use_color=False)
+    record = logging.LogRecord("baha_blacklist", logging.INFO, __file__, 1, "a %s", ("b",), None)
+    first = formatter.format(record)
+    assert first.endswith("[info] - a b")
+    assert formatter.format(record) == first
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+from baha_blacklist.lookup import UserInfoLookup
+from baha_blacklist.models import UserInfo
+
+
+class SlowFetch:
+    def __init__(self, delay: float = 0.05, fail: frozenset[str] = frozenset()) -> None:
+        self.delay = delay
+        self.fail = fail
+        self.calls: list[str] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, uid: str) -> UserInfo | None:
+        with self._lock:
+            self.calls.append(uid)
+        time.sleep(self.delay)
+        return None if uid in self.fail else UserInfo(uid, 100, datetime(2025, 1, 1))
+
+    async def afetch(self, uid: str) -> UserInfo | None:
+        self.calls.append(uid)
+        await asyncio.sleep(self.delay)
+        return None if uid in self.fail else UserInfo(uid, 100, datetime(2025, 1, 1))
+
+
+def test_concurrent_gets_share_one_fetch():
+    fetch = SlowFetch()
+    lookup = UserInfoLookup(fetch)
+    results: list[UserInfo | None] = []
+    threads = [threading.Thread(target=lambda: results.append(lookup.get("a"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == ["a"]
+    assert len(results) == 5 and all(r is not None and r.uid == "a" for r in results)
+    assert lookup.coalesced + lookup.memo_hits == 4
+    assert lookup.get("a") is not None and fetch.calls == ["a"]
+
+
+def test_get_many_deduplicates_and_skips_failures():
+    fetch = SlowFetch(delay=0.01, fail=frozenset({"bad"}))
+    # 單一執行緒讓讀取順序固定, 才能確認 LRU 移除的是哪個用戶
+    lookup = UserInfoLookup(fetch, max_entries=2, max_workers=1)
+    found = lookup.get_many(["a", "b", "a", "bad", "c"])
+
+    assert list(found) == ["a", "b", "bad", "c"]
+    assert found["bad"] is None
+    assert sorted(fetch.calls) == ["a", "b", "bad", "c"]
+    # 失敗的結果不會被記住, LRU 只保留最後使用的 2 個用戶
+    assert len(lookup) == 2 and lookup.peek("a") is None
+    lookup.get_many(["bad", "c"])
+    assert fetch.calls.count("bad") == 2 and fetch.calls.count("c") == 1
+
+
+def test_aget_coalesces_within_event_loop():
+    fetch = SlowFetch()
+    lookup = UserInfoLookup(fetch)
+
+    async def main() -> list[UserInfo | None]:
+        return await asyncio.gather(*(lookup.aget(uid, fetch.afetch) for uid in "aaab"))
+
+    results = asyncio.run(main())
+    assert sorted(fetch.calls) == ["a", "b"]
+    assert [r.uid for r in results if r is not None] == ["a", "a", "a", "b"]
+    assert lookup.coalesced == 2
+    assert asyncio.run(lookup.aget("a", fetch.afetch)) is not None
+    assert len(fetch.calls) == 2
+
+
+def test_planning_and_clean_fetch_each_user_once(bahamut, make_api):
+    mock = bahamut(blacklist_size=30)
+    api = make_api(blacklist_cap=28)
+    uids = list(mock.blacklist)
+    assert api.user_info_cache is None
+    evicted = api.plan_eviction(uids, 5)
+    assert len(evicted) == 7
+    # 排序樣本為需要移出人數的 3 倍
+    assert mock.hits["block_list.php"] == 21
+
+    api.smart_remove_users(uids, 10, 365)
+
+    # 規劃時讀取過的用戶在清理時直接使用記憶體中的資訊
+    assert mock.hits["block_list.php"] == 30
+    assert api.user_infos.fetches == 30
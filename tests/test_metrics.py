@@ -0,0 +1,50 @@
+import json
+
+from baha_blacklist.metrics import Metrics, endpoint_name
+
+
+def test_endpoint_name():
+    assert endpoint_name("https://home.gamer.com.tw/ajax/friend_add.php") == "friend_add"
+    assert endpoint_name("https://www.gamer.com.tw/ajax/get_csrf_token.php ") == "csrf_global"
+    assert endpoint_name("https://home.gamer.com.tw/friendList.php?user=a&t=5 ") == "friend_list"
+    assert endpoint_name("https://api.gamer.com.tw/home/v1/block_list.php?userid=a") == "block_list"
+
+
+def test_session_records_metrics(tmp_path, bahamut, make_api):
+    mock = bahamut(blacklist_size=5)
+    api = make_api()
+    uids = api.export_users()
+    api.smart_remove_users(uids, min_visits=10, min_days=365)
+    removed = mock.hits["friend_del.php"]
+
+    summary = api.metrics.summary()
+    endpoints = summary["endpoints"]
+    assert endpoints["friend_list"]["requests"] == 1
+    assert endpoints["friend_list"]["bytes_received"] > 0
+    assert endpoints["block_list"]["requests"] == 5
+    assert endpoints["block_list"]["latency"]["buckets"]["+Inf"] == 5
+    assert endpoints["friend_del"]["requests"] == removed
+    assert endpoints["friend_del"]["bytes_sent"] > 0
+    assert endpoints["csrf_temp"]["requests"] == (1 if removed else 0)
+    assert summary["operations"]["export"]["count"] == 1
+
+    api.write_metrics()
+    with open(tmp_path / "metrics.json", encoding="utf-8") as f:
+        assert json.load(f)["endpoints"]["block_list"]["status_200"] == 5
+
+
+def test_prometheus_output(tmp_path):
+    metrics = Metrics()
+    metrics.record_request("https://home.gamer.com.tw/ajax/friend_del.php", 0.2, 503, 10, 20)
+    metrics.record_retry("https://home.gamer.com.tw/ajax/friend_del.php")
+    metrics.record_sleep("retry", 1.5)
+    metrics.write(str(tmp_path / "metrics.prom"))
+
+    text = (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    assert 'baha_request_errors_total{endpoint="friend_del"} 1' in text
+    assert 'baha_retries_total{endpoint="friend_del"} 1' in text
+    assert 'baha_request_duration_seconds_bucket{endpoint="friend_del",le="0.25"} 1' in text
+    assert 'baha_sleep_seconds_total{reason="retry"} 1.5' in text
+    # 同一個指標的樣本必須緊接在它的 TYPE 之後
+    families = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+    assert len(families) == len(set(families))
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from baha_blacklist.async_api import AsyncScheduler, run_async
+from baha_blacklist.results import Status
+
+
+def test_scheduler_pipeline_backpressure():
+    fetched: list[int] = []
+    consumed: list[int] = []
+
+    async def fetch(item: int) -> int:
+        fetched.append(item)
+        return item * 10
+
+    async def consume(item: int, value: int) -> None:
+        # 佇列容量為 2, 讀取端最多只能領先處理端 佇列容量 + 兩段的 worker 數
+        assert len(fetched) - len(consumed) <= 2 + 2 * 2
+        await asyncio.sleep(0.001)
+        consumed.append(value)
+
+    asyncio.run(AsyncScheduler(2).pipeline(fetch, consume, range(20), depth=2))
+    assert sorted(consumed) == [i * 10 for i in range(20)]
+
+
+def test_scheduler_pipeline_propagates_errors():
+    async def fetch(item: int) -> int:
+        return item
+
+    async def consume(item: int, value: int) -> None:
+        if item == 3:
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(AsyncScheduler(2).pipeline(fetch, consume, range(10), depth=2))
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_smart_remove_users_pipeline(use_async, bahamut, make_api):
+    mock = bahamut(blacklist_size=40, latency=0.01)
+    api = make_api(concurrency=2, prefetch_size=4)
+    uids = list(mock.blacklist)
+    inactive = {
+        uid
+        for uid in uids
+        if mock.user_info(uid)["data"]["blocks"][0]["data"]["items"][0]["value"] == "0"
+    }
+
+    if use_async:
+        results = run_async(api, lambda a: a.smart_remove_users(uids, 10, 365))
+    else:
+        results = api.smart_remove_users(uids, min_visits=10, min_days=365)
+
+    assert set(results) == set(uids)
+    assert set(results.with_status(Status.REMOVED)) == inactive
+    assert results.count(Status.KEPT) == len(uids) - len(inactive)
+    assert results.succeeded == len(uids)
+    assert api.metrics.summary()["outcomes"]["smart_remove"] == results.summary()
+    assert set(mock.blacklist) == set(uids) - inactive
+    assert mock.hits["block_list.php"] == len(uids)
+    assert mock.hits["friend_del.php"] == len(inactive)
+    # 讀取和移除重疊進行
+    assert mock.max_in_flight >= 2
+    assert not api.journal.pending()
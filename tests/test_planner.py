@@ -0,0 +1,194 @@
+import time
+from argparse import Namespace
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.main import plan_run, run_modes
+from baha_blacklist.metrics import endpoint_name
+from baha_blacklist.models import UserInfo
+from baha_blacklist.planner import RuntimeEstimator, plan_update, rank_for_eviction
+
+NOW = datetime(2024, 6, 1)
+
+
+def make_info(uid: str, visit_count: int, days_ago: int) -> UserInfo:
+    return UserInfo(uid=uid, visit_count=visit_count, last_login=NOW - timedelta(days=days_ago))
+
+
+def test_plan_update_delta():
+    existing = ["a", "b", "c"]
+    plan = plan_update(existing, ["b", " d ", "", "e"], ["d", "a", "f"])
+    assert plan.to_add == ["d", "e", "f"]
+    assert plan.remove_candidates == ["c"]
+    assert plan.already_present == 2
+    assert plan.duplicates == 1
+
+
+def test_plan_update_large_sources():
+    existing = [str(i) for i in range(0, 150_000, 2)]
+    source = [str(i) for i in range(100_000)]
+    start = time.perf_counter()
+    plan = plan_update(existing, source, source)
+    elapsed = time.perf_counter() - start
+
+    assert len(plan.to_add) == 50_000
+    assert plan.duplicates == 100_000
+    assert len(plan.remove_candidates) == 25_000
+    assert elapsed < 1.0
+
+
+def test_rank_for_eviction_orders_by_activity_score():
+    infos = [
+        make_info("active", 100, 1),
+        make_info("old_but_busy", 100, 300),
+        make_info("quiet", 1, 5),
+        make_info("gone", 0, 700),
+        make_info("recent_active", 100, 0),
+    ]
+    ranked = rank_for_eviction(infos, 3, min_visits=10, min_days=200, now=NOW)
+    assert [u.uid for u in ranked] == ["gone", "quiet", "old_but_busy"]
+
+
+def test_plan_eviction_ranks_a_spread_sample(bahamut, make_api):
+    mock = bahamut(blacklist_size=60, inactive_ratio=0.3)
+    api = make_api(blacklist_cap=60, min_visit=10, min_day=365, user_info_ttl=7)
+    existing = list(mock.blacklist)
+    assert api.plan_eviction(existing, 0) == []
+
+    # 快取中只有 2 個活躍用戶, 從其餘用戶平均取樣補足 3 倍的人數再排序
+    assert api.user_info_cache is not None
+    api.user_info_cache.put_many(UserInfo(uid, 100, datetime.now()) for uid in existing[:2])
+    victims = api.plan_eviction(existing, 4)
+    assert len(victims) == 4
+    assert mock.hits["block_list.php"] == 4 * 3 - 2
+    inactive = {
+        uid
+        for uid in existing
+        if mock.user_info(uid)["data"]["blocks"][0]["data"]["items"][0]["value"] == "0"
+    }
+    assert set(victims) <= inactive
+    # 樣本分布在整個清單, 不是只取清單開頭的用戶
+    assert max(existing.index(uid) for uid in victims) >= 30
+
+    # 快取的用戶已經足夠時不讀取
+    mock.reset_counters()
+    assert len(api.plan_eviction(existing, 4)) == 4
+    assert mock.total_requests == 0
+
+
+def test_plan_eviction_only_takes_unsourced_users(bahamut, make_api):
+    mock = bahamut(blacklist_size=60, inactive_ratio=0.3)
+    api = make_api(blacklist_cap=60, min_visit=10, min_day=365)
+    existing = list(mock.blacklist)
+
+    # 不在來源中的用戶足夠時只從中挑選, 也只讀取這些用戶的資訊
+    unsourced = existing[40:]
+    victims = api.plan_eviction(existing, 4, unsourced)
+    assert len(victims) == 4
+    assert set(victims) <= set(unsourced)
+    assert mock.hits["block_list.php"] == 12
+
+    # 不足時只移出這些用戶, 不讀取資訊也不移出來源中的用戶
+    mock.reset_counters()
+    assert api.plan_eviction(existing, 4, existing[-2:]) == existing[-2:]
+    assert mock.total_requests == 0
+    assert api.plan_eviction(existing, 4, []) == []
+
+
+@pytest.mark.parametrize(("unsourced", "added"), [(0, 0), (3, 3)])
+def test_update_never_evicts_source_users_past_cap(
+    tmp_path, bahamut, make_config, unsourced, added
+):
+    config = make_config(blacklist_cap=10, blacklist_src=str(tmp_path / "source.txt"))
+    args = Namespace(mode=["update"], plan=False, resume=False, watch=False, force_update=False)
+    mock = bahamut(blacklist_size=10)
+    existing = list(mock.blacklist)
+    # 新增人數超過上限, 可以移出的只有不在來源中的用戶
+    new = [f"new{i}" for i in range(12)]
+    (tmp_path / "source.txt").write_text("\n".join(existing[unsourced:] + new))
+    api = GamerAPIExtended(config)
+    api.login = lambda: True  # type: ignore[method-assign]
+    run_modes(args, config, api)
+
+    assert mock.hits["friend_del.php"] == unsourced
+    assert mock.hits["friend_add.php"] == added
+    assert "block_list.php" not in mock.hits
+    assert set(existing[unsourced:]) <= set(mock.blacklist)
+    assert len(mock.blacklist) == 10
+
+
+def test_runtime_estimator_ramps_up_rate():
+    # 速率 1 -> 2 -> 3 -> 4 (上限), 延遲 0.1 秒不影響間隔
+    estimator = RuntimeEstimator(rate=1.0, max_rate=4.0, increase=1.0, latency={"a": 0.1})
+    assert estimator.estimate({"a": 5}) == 1 + 1 / 2 + 1 / 3 + 1 / 4 + 1 / 4
+    assert estimator.rate == 4.0
+    # 沒有歷史資料的端點使用已知端點的平均延遲
+    assert estimator.estimate({"b": 4}, advance=False) == 4 * 0.25
+    # 延遲比請求間隔長時由延遲決定, concurrency 分攤延遲
+    slow = RuntimeEstimator(rate=4.0, max_rate=4.0, increase=0.0, latency={"a": 2.0})
+    assert slow.estimate({"a": 4}) == 8.0
+    assert slow.estimate({"a": 4}, concurrency=4) == 2.0
+    # 只有併發送出的端點分攤延遲
+    assert slow.estimate({"a": 4, "b": 4}, concurrency=4, concurrent={"a"}) == 2.0 + 8.0
+
+
+@pytest.mark.parametrize(
+    ("warm_cache", "update_lookups", "clean_lookups"), [(True, 0, 10), (False, 35, 5)]
+)
+def test_plan_run_matches_actual_requests(
+    tmp_path, bahamut, make_config, warm_cache, update_lookups, clean_lookups
+):
+    config = make_config(
+        blacklist_cap=30,
+        min_visit=10,
+        min_day=365,
+        blacklist_src=str(tmp_path / "source.txt"),
+        blacklist_dest=str(tmp_path / "blacklist.txt"),
+        user_info_ttl=7,
+    )
+    args = Namespace(
+        mode=["update", "export", "clean"],
+        plan=True,
+        resume=False,
+        watch=False,
+        force_update=False,
+        force_clean=True,
+    )
+    mock = bahamut(blacklist_size=40)
+    existing = list(mock.blacklist)
+    (tmp_path / "source.txt").write_text("\n".join([f"new{i}" for i in range(10)] + existing[:5]))
+    api = GamerAPIExtended(config)
+    assert api.user_info_cache is not None
+    if warm_cache:
+        api.user_info_cache.put_many(
+            api.parse_user_info(uid, mock.user_info(uid)) for uid in existing[:30]
+        )
+    phases = {phase.name: phase for phase in plan_run(args, config, api)}
+
+    # 計畫模式只讀取黑名單
+    assert set(mock.hits) == {"friendList.php"}
+    assert len(mock.blacklist) == 40
+
+    mock.reset_counters()
+    args.plan = False
+    api = GamerAPIExtended(config)
+    api.login = lambda: True  # type: ignore[method-assign]
+    run_modes(args, config, api)
+    actual = Counter({endpoint_name(f"/{name}"): count for name, count in mock.hits.items()})
+
+    planned = sum((phase.requests for phase in phases.values()), Counter())
+    possible = sum((phase.possible for phase in phases.values()), Counter())
+    assert phases["update"].requests["friend_add"] == 10
+    # 快取不足時更新會讀取不在來源中的 35 個用戶作為樣本, 清理時只讀取其餘 5 個用戶
+    assert phases["update"].requests["block_list"] == update_lookups
+    assert phases["clean"].requests["block_list"] == clean_lookups
+    for endpoint in ("friend_list", "friend_add", "block_list", "csrf_global"):
+        assert actual[endpoint] == planned[endpoint]
+    assert (
+        planned["friend_del"]
+        <= actual["friend_del"]
+        <= planned["friend_del"] + possible["friend_del"]
+    )
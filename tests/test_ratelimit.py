@@ -0,0 +1,105 @@
+import logging
+
+import pytest
+
+from baha_blacklist.config import Config
+from baha_blacklist.ratelimit import MAX_RATE, AdaptiveRateLimiter
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_token_bucket_spacing(clock):
+    limiter = AdaptiveRateLimiter(rate=2.0, min_rate=0.5, max_rate=4.0, clock=clock)
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(0.5)
+    assert limiter.reserve() == pytest.approx(1.0)
+
+    # 閒置後 token 會補回, 但不超過 burst
+    clock.now = 10.0
+    assert limiter.reserve() == 0.0
+    assert limiter.reserve() == pytest.approx(0.5)
+
+
+def test_aimd_adjustment(clock):
+    limiter = AdaptiveRateLimiter(
+        rate=1.0, min_rate=0.25, max_rate=2.0, increase=0.5, cooldown=4.0, clock=clock
+    )
+    limiter.observe(200)
+    limiter.observe(200)
+    limiter.observe(200)
+    assert limiter.rate == 2.0
+
+    limiter.observe(429)
+    assert limiter.rate == 1.0
+    assert limiter.backoff_level == 1
+    # 退避期間排隊的請求要等 cooldown 結束
+    assert limiter.reserve() >= 4.0
+
+    limiter.observe(200, failed=True)
+    assert limiter.rate == 0.5
+    assert limiter.backoff_level == 2
+
+    limiter.observe(503)
+    limiter.observe(503)
+    assert limiter.rate == 0.25
+
+    limiter.observe(200)
+    assert limiter.backoff_level == 0
+    assert limiter.rate == 0.75
+
+
+def test_from_config_bounds():
+    config = Config(min_sleep=0.5, max_sleep=4.0, rate_limit=10.0)
+    limiter = AdaptiveRateLimiter.from_config(config)
+    assert limiter.max_rate == 2.0
+    assert limiter.min_rate == 0.25
+    assert limiter.rate == 2.0
+
+
+def test_zero_min_sleep_still_backs_off(clock):
+    limiter = AdaptiveRateLimiter.from_config(Config(min_sleep=0, rate_limit=1e9))
+    limiter.clock = clock
+    assert limiter.max_rate == limiter.rate == MAX_RATE
+    assert limiter.increase < float("inf")
+
+    limiter.on_success()
+    assert limiter.rate == MAX_RATE
+
+    # 沒有 min_sleep 的上限時仍會降速並暫停
+    limiter.on_throttle("HTTP 429")
+    assert limiter.rate == MAX_RATE / 2
+    assert limiter.backoff_until == clock.now + 5.0
+    assert limiter.reserve() >= 5.0
+
+
+def test_log_reports_state_at_event_time(clock):
+    records: list[logging.LogRecord] = []
+    handler = logging.Handler()
+    handler.emit = records.append  # type: ignore[method-assign]
+    logger = logging.getLogger("baha_blacklist")
+    logger.addHandler(handler)
+    try:
+        limiter = AdaptiveRateLimiter(
+            rate=1.0, min_rate=0.25, max_rate=4.0, increase=0.5, cooldown=4.0, clock=clock
+        )
+        limiter.on_throttle("HTTP 503")
+        for _ in range(5):
+            limiter.on_success()
+    finally:
+        logger.removeHandler(handler)
+
+    # 記錄在事件發生後才格式化, 內容仍是退避當下的狀態
+    warning = next(record for record in records if record.levelno == logging.WARNING)
+    assert "退避層級 1" in warning.getMessage()
+    assert "目前速率 0.50" in warning.getMessage()
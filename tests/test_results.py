@@ -0,0 +1,33 @@
+from baha_blacklist.results import BatchResult, Outcome, Status
+
+
+def test_batch_result_counts_and_details():
+    results = BatchResult()
+    results.add("a", Status.ADDED)
+    results.add_outcome("b", Outcome(Status.REJECTED, "已在黑名單中"))
+    results.add("c", Status.ERROR, "timeout")
+    results.add("d", Status.ADDED)
+
+    assert list(results) == ["a", "b", "c", "d"]
+    assert "c" in results and "z" not in results
+    assert results.get("b") is Status.REJECTED
+    assert results.get("z") is None
+    assert results.detail("b") == "已在黑名單中"
+    assert results.detail("a") is None
+    assert results.count(Status.ADDED) == 2
+    assert results.succeeded == 2
+    assert results.with_status(Status.REJECTED, Status.ERROR) == ["b", "c"]
+    assert results.summary() == {"added": 2, "rejected": 1, "error": 1}
+    assert str(results) == "成功: 2/4 (新增 2, 失敗 1, 錯誤 1)"
+    assert dict(results.items())["d"] is Status.ADDED
+
+
+def test_later_result_overrides_earlier_lookup():
+    results = BatchResult()
+    results.add("a", Status.ERROR, "timeout")
+    assert results.get("a") is Status.ERROR
+    results.add("a", Status.REMOVED)
+    assert results.get("a") is Status.REMOVED
+    assert results.detail("a") is None
+    assert len(results) == 2
+    assert str(BatchResult()) == "成功: 0/0 (無)"
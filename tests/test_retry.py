@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from baha_blacklist.journal import Journal
+from baha_blacklist.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=3.0, rng=random.Random(1))
+    delays = [policy.backoff(attempt) for attempt in (1, 2, 3, 4)]
+    assert all(0 <= d <= c for d, c in zip(delays, (1, 2, 3, 3), strict=True))
+    assert policy.backoff(1, retry_after=10) == 3.0
+    assert policy.stats["retries"] == 5
+
+    assert policy.should_retry(1, 503)
+    assert not policy.should_retry(1, 404)
+    assert not policy.should_retry(5, None)
+    assert policy.stats["gave_up"] == 1
+
+
+def test_circuit_breaker_transitions():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10, max_trips=2, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.wait_time() == 10
+
+    clock.now = 10
+    assert breaker.wait_time() == 0
+    assert breaker.state == "half_open"
+    # 試探中的請求尚未完成, 其他請求需要等待
+    assert breaker.wait_time() > 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.wait_time() == 20
+
+    clock.now = 30
+    assert breaker.wait_time() == 0
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 0
+    assert breaker.transitions["open"] == 2
+
+
+def test_session_retries_transient_errors(bahamut, make_api):
+    mock = bahamut(blacklist_size=30, error_rate=0.3, seed=3)
+    api = make_api(retry_attempts=10, breaker_threshold=100)
+    infos = [api.get_user_info(uid) for uid in mock.blacklist]
+
+    # 讀取失敗時的預設值上站次數為 min_visit + 1, 模擬伺服器只會回傳 0 或 500
+    assert all(info.visit_count in (0, 500) for info in infos)
+    assert api.retry_policy.stats["retries"] == mock.total_requests - len(infos)
+    assert api.retry_policy.stats["retries"] > 0
+    assert api.retry_policy.stats["gave_up"] == 0
+
+
+def test_breaker_stops_bulk_operation_during_outage(bahamut, make_api):
+    mock = bahamut(blacklist_size=10, error_rate=1.0)
+    api = make_api(retry_attempts=2, breaker_threshold=3, breaker_timeout=0.001)
+    with pytest.raises(CircuitOpenError):
+        api.smart_remove_users(list(mock.blacklist), min_visits=10, min_days=365)
+
+    assert api.circuit_breaker.exhausted
+    # 斷路器開啟後不會為每個用戶繼續送出請求
+    assert mock.total_requests < 10 * 2
+    assert Journal(api.journal.path).pending()
@@ -0,0 +1,127 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from baha_blacklist.async_api import run_async
+from baha_blacklist.config import Config
+from baha_blacklist.main import resume_batches
+from baha_blacklist.models import UserInfo
+from baha_blacklist.planner import rank_for_eviction
+from baha_blacklist.results import Status
+from baha_blacklist.scoring import (
+    KeepTopPolicy,
+    RemovalPolicy,
+    ThresholdPolicy,
+    UserTable,
+    activity_scores,
+    parse_policy,
+)
+
+NOW = datetime(2025, 1, 1, 12)
+
+
+def make_users(count: int, seed: int = 0) -> list[UserInfo]:
+    rng = random.Random(seed)
+    return [
+        UserInfo(
+            f"u{i}", rng.randrange(0, 200), datetime(2024, 12, 31) - timedelta(rng.randrange(800))
+        )
+        for i in range(count)
+    ]
+
+
+def test_threshold_matches_per_user_rule():
+    users = make_users(500)
+    policy = ThresholdPolicy(min_visits=10, min_days=365)
+    expected = [u.uid for u in users if u.visit_count < 10 or (NOW - u.last_login).days > 365]
+    assert policy.evaluate(users, NOW) == expected
+    assert UserTable.from_infos(users[:1], NOW).idle_days[0] == (NOW - users[0].last_login).days
+
+
+def test_relative_policies():
+    users = make_users(200)
+    assert len(parse_policy("percentile:25", 10, 365).evaluate(users, NOW)) == 50
+    assert parse_policy("percentile:0", 10, 365).evaluate(users, NOW) == []
+
+    policy = parse_policy("keep_top:150", 10, 365)
+    assert isinstance(policy, KeepTopPolicy) and not policy.per_user
+    removed = set(policy.evaluate(users, NOW))
+    assert len(removed) == 50
+    # 被移除的用戶活躍分數都不高於保留的用戶
+    table = UserTable.from_infos(users, NOW)
+    scores = dict(zip(table.uids, activity_scores(table, 10, 365), strict=True))
+    assert max(scores[uid] for uid in removed) <= min(
+        score for uid, score in scores.items() if uid not in removed
+    )
+    assert parse_policy("keep_top:500", 10, 365).evaluate(users, NOW) == []
+    # 黑名單超過上限時的移出和 keep_top 使用相同的排序
+    evicted = rank_for_eviction(users, 50, 10, 365, now=NOW)
+    assert {u.uid for u in evicted} == removed
+    with pytest.raises(TypeError):
+        RemovalPolicy(10, 365)  # type: ignore[abstract]
+
+    # 剛好在門檻上的分數為 0
+    edge = UserInfo("edge", 10, datetime.now() - timedelta(days=365))
+    assert not parse_policy("score", 10, 365).removes(edge)
+    assert parse_policy("score:0.5", 10, 365).removes(edge)
+
+
+@pytest.mark.parametrize(
+    "spec", ["", "threshold:1", "percentile:120", "keep_top:-1", "top:5", "score:x"]
+)
+def test_invalid_policy(spec):
+    with pytest.raises(ValueError):
+        parse_policy(spec, 10, 365)
+    with pytest.raises(ValueError):
+        Config(account="a", clean_policy=spec).validate()
+
+
+def test_bulk_evaluation_is_fast():
+    users = make_users(50000)
+    start = time.perf_counter()
+    for spec in ("threshold", "score", "percentile:10", "keep_top:1000"):
+        parse_policy(spec, 10, 365).evaluate(users, NOW)
+    assert time.perf_counter() - start < 2.0
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_keep_top_fetches_then_removes(use_async, bahamut, make_api):
+    mock = bahamut(blacklist_size=30)
+    api = make_api(user_info_ttl=7)
+    uids = list(mock.blacklist)
+    assert api.user_info_cache is not None
+    api.user_info_cache.put_many(api.parse_user_info(uid, mock.user_info(uid)) for uid in uids[:10])
+    if use_async:
+        results = run_async(
+            api, lambda a: a.smart_remove_users(uids, 10, 365, policy="keep_top:20")
+        )
+    else:
+        results = api.smart_remove_users(uids, 10, 365, policy="keep_top:20")
+
+    assert results.count(Status.REMOVED) == 10
+    assert results.count(Status.KEPT) == 20
+    assert mock.hits["block_list.php"] == 20
+    assert len(mock.blacklist) == 20
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_resume_replays_population_decision(use_async, bahamut, make_api):
+    mock = bahamut(blacklist_size=30)
+    api = make_api(use_async=use_async, user_info_ttl=7)
+    uids = list(mock.blacklist)
+    removal = parse_policy("keep_top:20", 10, 365)
+    _, victims = api.triage_removals(uids, removal)
+    params = api.removal_params(uids, removal, victims, min_visits=10, min_days=365)
+    batch_id = api.journal.begin("smart_remove", uids, policy="keep_top:20", **params)
+    for uid in uids[:10]:
+        api.journal.record(batch_id, uid)
+
+    # 以剩下的 20 人重新評估 keep_top:20 不會移除任何人, 接續時應沿用開始時的決定
+    api = make_api(use_async=use_async, user_info_ttl=7)
+    resume_batches(api.config, api)
+    remaining = set(uids[10:])
+    assert victims & remaining
+    assert set(mock.blacklist) == set(uids) - (victims & remaining)
+    assert api.journal.pending() == []
@@ -0,0 +1,84 @@
+import os
+import stat
+
+from curl_cffi.requests import Session
+
+from baha_blacklist.session import SessionStore
+
+
+def test_session_store_round_trip(tmp_path):
+    store = SessionStore(str(tmp_path / "state" / "session_a.json"))
+    session = Session()
+    session.cookies.set("BAHARUNE", "secret-cookie", domain=".gamer.com.tw", path="/")
+    session.cookies.set("ckBahamutCsrfToken", "csrf-cookie", domain=".gamer.com.tw", path="/")
+    store.save(session, "csrf-123")
+    # 檔案包含登入憑證, 只有擁有者可讀寫
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+    assert not os.path.exists(f"{store.path}.tmp")
+
+    restored = Session()
+    assert store.load(restored) == "csrf-123"
+    cookies = {c.name: (c.value, c.domain, c.path) for c in restored.cookies.jar}
+    assert cookies == {
+        "BAHARUNE": ("secret-cookie", ".gamer.com.tw", "/"),
+        "ckBahamutCsrfToken": ("csrf-cookie", ".gamer.com.tw", "/"),
+    }
+
+    store.clear()
+    assert not os.path.exists(store.path)
+    store.clear()
+
+
+def make_login_api(make_api, mock):
+    """建立只有一個登入方式的 API, 登入時讓模擬伺服器接受之後的請求"""
+    api = make_api(session_cache=True)
+    full_logins: list[bool] = []
+
+    def full_login() -> bool:
+        # 記錄完整登入開始時保存的登入狀態是否已被清除
+        full_logins.append(os.path.exists(api.session_store.path))
+        mock.logged_in = True
+        api.csrf_token = "fresh-csrf"
+        return api.login_success()
+
+    api.login_methods = [full_login]
+    return api, full_logins
+
+
+def test_saved_session_skips_full_login(bahamut, make_api):
+    mock = bahamut()
+    api, full_logins = make_login_api(make_api, mock)
+    assert api.login()
+    assert full_logins == [False]
+    assert stat.S_IMODE(os.stat(api.session_store.path).st_mode) == 0o600
+
+    mock.reset_counters()
+    api, full_logins = make_login_api(make_api, mock)
+    assert api.login()
+    assert full_logins == []
+    assert api.csrf_token == "fresh-csrf"
+    assert api.session.headers["x-bahamut-csrf-token"] == "fresh-csrf"
+    # 只用一次請求確認保存的登入狀態
+    assert mock.total_requests == 1
+
+
+def test_stale_or_unreadable_session_falls_back(bahamut, make_api):
+    mock = bahamut()
+    api, _ = make_login_api(make_api, mock)
+    assert api.login()
+
+    # 伺服器不再接受保存的 cookies: 清除保存的狀態後重新完整登入
+    mock.logged_in = False
+    api, full_logins = make_login_api(make_api, mock)
+    assert api.login()
+    assert full_logins == [False]
+    assert mock.hits["setting"] == 3
+    assert os.path.exists(api.session_store.path)
+
+    # 保存的檔案損毀時同樣清除後改用完整登入
+    with open(api.session_store.path, "w", encoding="utf-8") as f:
+        f.write("{broken")
+    api, full_logins = make_login_api(make_api, mock)
+    assert api.login()
+    assert full_logins == [False]
+    assert api.session_store.load(api.new_session()) == "fresh-csrf"
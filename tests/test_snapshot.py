@@ -0,0 +1,89 @@
+import os
+from argparse import Namespace
+
+from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.main import export_to_file, load_existing_users
+from baha_blacklist.snapshot import SnapshotStore
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_record_and_apply_deltas(tmp_path):
+    path = str(tmp_path / "snapshot.jsonl")
+    clock = FakeClock()
+    store = SnapshotStore(path, clock=clock)
+    assert store.recent(3600) is None
+    assert not store.record(["a", "b", "c"])
+
+    clock.now += 60
+    delta = store.record(["b", "c", "d"])
+    assert (delta.added, delta.removed) == (["d"], ["a"])
+    store.apply(added=["e"], removed=["b", "zzz"])
+    # 模擬中斷時寫到一半的最後一行
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "delta", "ts": ')
+
+    clock.now += 100
+    reloaded = SnapshotStore(path, clock=clock)
+    assert reloaded.users == ["c", "d", "e"]
+    # 自行新增、移除用戶不會更新同步時間
+    assert reloaded.age() == 100
+    assert reloaded.recent(60) is None
+    assert reloaded.recent(3600) == ["c", "d", "e"]
+
+
+def test_compacts_when_deltas_outgrow_base(tmp_path):
+    path = str(tmp_path / "snapshot.jsonl")
+    store = SnapshotStore(path)
+    store.record([f"u{i}" for i in range(200)])
+    for i in range(150):
+        store.apply(removed=[f"u{i}"])
+
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    assert len(lines) < 150
+    assert SnapshotStore(path).users == store.users
+    assert len(store) == 50
+
+
+def test_compacts_repeated_unchanged_exports(tmp_path):
+    path = str(tmp_path / "snapshot.jsonl")
+    clock = FakeClock()
+    store = SnapshotStore(path, clock=clock)
+    for _ in range(300):
+        clock.now += 1
+        store.record(["a", "b", "c"])
+
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) <= 101
+    assert SnapshotStore(path, clock=clock).age() == 0
+
+
+def test_export_skips_unchanged_file(tmp_path, bahamut, make_config):
+    config = make_config(blacklist_dest=str(tmp_path / "blacklist.txt"), snapshot_max_age=3600)
+    args = Namespace(mode=["export"])
+    mock = bahamut(blacklist_size=20)
+    api = GamerAPIExtended(config)
+    assert export_to_file(args, config, api) == list(mock.blacklist)
+    mtime = os.stat(config.blacklist_dest).st_mtime_ns
+
+    api = GamerAPIExtended(config)
+    export_to_file(args, config, api)
+    assert os.stat(config.blacklist_dest).st_mtime_ns == mtime
+
+    mock.blacklist.pop("user000003")
+    api = GamerAPIExtended(config)
+    assert "user000003" not in export_to_file(args, config, api)
+    with open(config.blacklist_dest, encoding="utf-8") as f:
+        assert "user000003" not in f.read()
+
+    # 快照在 snapshot_max_age 內同步過, 不需要再讀取 friendList.php
+    mock.reset_counters()
+    assert load_existing_users(config, GamerAPIExtended(config)) == list(mock.blacklist)
+    assert mock.total_requests == 0
@@ -0,0 +1,131 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from curl_cffi.requests import Session
+
+from baha_blacklist.config import Config, ConfigLoader
+from baha_blacklist.sources import SourceAggregator, SourceFetcher, SourceIndex
+
+
+class BlacklistHandler(BaseHTTPRequestHandler):
+    body = b"alice\nbob\n"
+    etag = '"v1"'
+    requests: list[dict[str, str]] = []
+
+    def do_GET(self) -> None:
+        type(self).requests.append({k.lower(): v for k, v in self.headers.items()})
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    BlacklistHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), BlacklistHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/blacklist.txt"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_conditional_fetch(server, tmp_path):
+    fetcher = SourceFetcher(Session(), str(tmp_path))
+
+    first = fetcher.fetch(server)
+    assert first.changed
+    assert first.uids == ["alice", "bob"]
+
+    # 尚未 commit, 不應送出條件式請求
+    assert fetcher.fetch(server).changed
+    assert "if-none-match" not in BlacklistHandler.requests[-1]
+
+    fetcher.commit(first)
+    second = fetcher.fetch(server)
+    assert BlacklistHandler.requests[-1]["if-none-match"] == '"v1"'
+    assert not second.changed
+    assert second.uids == ["alice", "bob"]
+
+
+def test_remote_change_detected(server, tmp_path, monkeypatch):
+    fetcher = SourceFetcher(Session(), str(tmp_path))
+    fetcher.commit(fetcher.fetch(server))
+
+    monkeypatch.setattr(BlacklistHandler, "body", b"alice\nbob\ncarol\n")
+    monkeypatch.setattr(BlacklistHandler, "etag", '"v2"')
+    result = fetcher.fetch(server)
+    assert result.changed
+    assert result.uids == ["alice", "bob", "carol"]
+
+
+def test_local_file(tmp_path):
+    source = tmp_path / "blacklist.txt"
+    source.write_text("alice\n", encoding="utf-8")
+    fetcher = SourceFetcher(Session(), str(tmp_path / "cache"))
+
+    result = fetcher.fetch(str(source))
+    assert result.changed
+    fetcher.commit(result)
+    assert not fetcher.fetch(str(source)).changed
+
+    source.write_text("alice\nbob\n", encoding="utf-8")
+    assert fetcher.fetch(str(source)).changed
+
+
+def test_source_index(tmp_path):
+    index = SourceIndex(str(tmp_path / "sources.sqlite3"))
+    index.replace("a.txt", ["alice", " bob ", "", "alice"])
+    index.replace("b.txt", ["bob", "carol"])
+    assert len(index) == 3
+    assert index.new_uids(["dave", "alice", "erin"]) == ["dave", "erin"]
+
+    # 取代來源內容後, 只存在於舊內容中的用戶不再算是已索引
+    index.replace("a.txt", ["alice"])
+    index.replace("b.txt", ["carol"])
+    assert len(index) == 2
+    assert index.new_uids(["bob", "carol"]) == ["bob"]
+    index.close()
+
+    reopened = SourceIndex(str(tmp_path / "sources.sqlite3"))
+    assert reopened.new_uids(["alice", "carol", "dave"]) == ["dave"]
+    assert reopened.indexed_sources() == {"a.txt", "b.txt"}
+    reopened.close()
+
+
+def test_aggregator_merges_sources(server, tmp_path):
+    local = tmp_path / "local.txt"
+    local.write_text("bob\ncarol\n", encoding="utf-8")
+    missing = "http://127.0.0.1:1/missing.txt"
+    index = SourceIndex(str(tmp_path / "sources.sqlite3"))
+    aggregator = SourceAggregator(SourceFetcher(Session(), str(tmp_path / "cache")), index)
+
+    results = aggregator.fetch_all([server, str(local), missing, server])
+    assert [r.source for r in results] == [server, str(local)]
+    aggregator.commit(results)
+    assert len(index) == 3
+    assert index.new_uids(["alice", "bob", "carol", "dave"]) == ["dave"]
+
+    results = aggregator.fetch_all([server, str(local)])
+    assert not any(r.changed for r in results)
+    index.close()
+
+
+def test_extra_sources_extend_configured_sources():
+    loader = ConfigLoader(Config())
+    config = loader.merge_configs(
+        ("json_config", {"blacklist_srcs": ["a.txt", "b.txt"]}),
+        ("cli_config", {"blacklist_srcs": ["b.txt", "c.txt"]}),
+    )
+    assert config.blacklist_srcs == ["a.txt", "b.txt", "c.txt"]
+    assert loader.merge_configs(("cli_config", {"blacklist_srcs": None})).blacklist_srcs == []
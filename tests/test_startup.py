@@ -0,0 +1,60 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parents[1]
+# 只有實際連線或解析黑名單時才需要的套件
+HEAVY_MODULES = ("curl_cffi", "lxml", "asyncio")
+# 載入 baha_blacklist.main 的累計時間上限 (微秒), 目前約 35ms, 保留給較慢 CI 的餘裕
+MAIN_IMPORT_BUDGET_US = 250_000
+
+
+def import_times(*args: str) -> dict[str, int]:
+    """以 python -X importtime 執行並回傳每個模組的累計載入時間 (微秒)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def heavy(times: dict[str, int]) -> list[str]:
+    return sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+
+
+def test_help_skips_heavy_imports():
+    assert heavy(import_times("run.py", "-h")) == []
+
+
+def test_main_module_is_lightweight():
+    times = import_times("-c", "import baha_blacklist.main")
+    assert heavy(times) == []
+    assert times["baha_blacklist.main"] < MAIN_IMPORT_BUDGET_US
+
+
+# curl_cffi 本身會載入 asyncio, 所以 gamer_api 只能確認不會載入非同步引擎
+@pytest.mark.parametrize(
+    ("module", "absent"),
+    [
+        ("baha_blacklist.gamer_api", "lxml"),
+        ("baha_blacklist.gamer_api", "baha_blacklist.async_api"),
+        ("baha_blacklist.planner", "asyncio"),
+        ("baha_blacklist.tokens", "asyncio"),
+        ("baha_blacklist.lookup", "asyncio"),
+    ],
+)
+def test_lazy_dependencies(module, absent):
+    times = import_times("-c", f"import {module}")
+    assert not any(name == absent or name.startswith(f"{absent}.") for name in times)
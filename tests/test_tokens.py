@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from baha_blacklist.async_api import run_async
+from baha_blacklist.results import Status
+from baha_blacklist.tokens import TokenManager, is_token_error
+
+
+class SlowFetch:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        time.sleep(0.05)
+        return f"token-{self.calls}"
+
+    async def afetch(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return f"token-{self.calls}"
+
+
+@pytest.mark.parametrize(
+    ("status", "text", "expected"),
+    [
+        (419, "", True),
+        (200, "token error", True),
+        (403, "CSRF token mismatch", True),
+        (200, '{"error": {"message": "Token \\u5df2\\u904e\\u671f"}}', True),
+        (403, "Forbidden", False),
+        (401, "您沒有權限執行此操作", False),
+        (200, '{"data": {"token": "abc"}}', False),
+        (200, "加入黑名單失敗", False),
+    ],
+)
+def test_is_token_error(status, text, expected):
+    assert is_token_error(status, text) is expected
+
+
+def test_token_reused_until_invalidated():
+    fetch = SlowFetch()
+    manager = TokenManager("test", fetch)
+    assert manager.get() == manager.get() == "token-1"
+
+    # 其他請求已經換過 Token 時不清除新的 Token
+    manager.invalidate("stale")
+    assert manager.get() == "token-1"
+    manager.invalidate("token-1")
+    assert manager.token is None
+    assert manager.get() == "token-2"
+    assert manager.fetch_count == fetch.calls == 2
+
+
+def test_concurrent_get_fetches_once():
+    fetch = SlowFetch()
+    manager = TokenManager("test", fetch)
+    tokens: list[str] = []
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tokens == ["token-1"] * 5
+
+    async def main() -> list[str]:
+        manager.invalidate()
+        return await asyncio.gather(*(manager.aget(fetch.afetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["token-2"] * 5
+    assert fetch.calls == 2
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_remove_refreshes_expired_token_once(use_async, bahamut, make_api):
+    mock = bahamut(blacklist_size=6)
+    api = make_api()
+    uids = list(mock.blacklist)
+
+    def remove(batch: list[str]):
+        if use_async:
+            return run_async(api, lambda a: a.remove_users(batch))
+        return api.remove_users(batch)
+
+    assert remove(uids[:3]).count(Status.REMOVED) == 3
+    assert mock.hits["getCSRFToken.php"] == 1
+
+    # 伺服器換發 Token 後, 第一個請求失敗時重新取得一次 Token 再重試
+    mock.temp_token = "rotated-token"
+    assert remove(uids[3:]).count(Status.REMOVED) == 3
+    assert mock.hits["getCSRFToken.php"] == 2
+    # 非同步時同時送出的請求都會各自重試一次, 但只重新取得一次 Token
+    retried = mock.hits["friend_del.php"] - 6
+    assert 1 <= retried <= (3 if use_async else 1)
+    assert not mock.blacklist
@@ -0,0 +1,107 @@
+import threading
+from argparse import Namespace
+
+import pytest
+
+from baha_blacklist.config import Config
+from baha_blacklist.gamer_api import GamerAPIExtended
+from baha_blacklist.main import run_modes, watch_sources
+
+
+@pytest.fixture
+def config(tmp_path, make_config) -> Config:
+    return make_config(
+        blacklist_src=str(tmp_path / "source.txt"),
+        blacklist_dest=str(tmp_path / "blacklist.txt"),
+        snapshot_max_age=3600,
+        watch_interval=0.01,
+    )
+
+
+def test_watch_applies_only_source_deltas(tmp_path, config, bahamut):
+    source = tmp_path / "source.txt"
+    source.write_text("new0\nnew1\n", encoding="utf-8")
+    args = Namespace(
+        mode=["update", "export"], plan=False, resume=False, watch=False, force_update=False
+    )
+    mock = bahamut(blacklist_size=5)
+    api = GamerAPIExtended(config)
+    api.login = lambda: True  # type: ignore[method-assign]
+    assert run_modes(args, config, api) == 0
+    assert {"new0", "new1"} <= set(mock.blacklist)
+
+    # 來源沒有變更時不送出任何請求
+    mock.reset_counters()
+    assert watch_sources(args, config, api, max_cycles=3) == 0
+    assert mock.total_requests == 0
+
+    source.write_text("new0\nnew1\nnew2\nnew3\n", encoding="utf-8")
+    mock.reset_counters()
+    assert watch_sources(args, config, api, max_cycles=2) == 0
+    # 只確認一次登入狀態並新增差異, 快照仍有效所以不重新讀取黑名單
+    assert mock.hits["friend_add.php"] == 2
+    assert mock.hits["setting"] == 1
+    assert "friendList.php" not in mock.hits
+    assert {"new2", "new3"} <= set(mock.blacklist)
+    assert {"new2", "new3"} <= set(api.snapshots.users)
+
+
+def test_watch_stops_on_event(config):
+    stop = threading.Event()
+    stop.set()
+    args = Namespace(mode=["update"], force_update=False)
+    api = GamerAPIExtended(config)
+    assert watch_sources(args, config, api, stop=stop) == 0
+
+
+def test_watch_recovers_after_breaker_exhausted(tmp_path, bahamut, make_config):
+    config = make_config(
+        blacklist_src=str(tmp_path / "source.txt"),
+        watch_interval=0.01,
+        retry_attempts=1,
+        breaker_threshold=1,
+        breaker_timeout=0.001,
+    )
+    (tmp_path / "source.txt").write_text("\n".join(f"new{i}" for i in range(20)), encoding="utf-8")
+    args = Namespace(mode=["update"], force_update=False)
+    mock = bahamut(blacklist_size=5, error_rate=1.0)
+    api = GamerAPIExtended(config)
+    api.circuit_breaker.max_trips = 2
+
+    # 網站故障到斷路器放棄, 這次檢查失敗但不會停止監看
+    assert watch_sources(args, config, api, max_cycles=1) == 0
+    assert api.circuit_breaker.exhausted
+    assert "new0" not in mock.blacklist
+
+    mock.error_rate = 0.0
+    assert watch_sources(args, config, api, max_cycles=1) == 0
+    assert not api.circuit_breaker.exhausted
+    assert {"new0", "new1"} <= set(mock.blacklist)
+
+
+def test_failed_adds_are_retried_on_unchanged_source(tmp_path, config, bahamut):
+    (tmp_path / "source.txt").write_text("new0\nnew1\n", encoding="utf-8")
+    args = Namespace(mode=["update"], plan=False, resume=False, watch=False, force_update=False)
+    mock = bahamut(blacklist_size=5)
+    api = GamerAPIExtended(config)
+    api.login = lambda: True  # type: ignore[method-assign]
+    add_user = api.add_user
+
+    def flaky_add_user(uid: str, category: str = "bad"):  # type: ignore[no-untyped-def]
+        if uid == "new1":
+            raise ConnectionError("connection reset")
+        return add_user(uid, category)
+
+    api.add_user = flaky_add_user  # type: ignore[method-assign]
+    # 有用戶新增失敗時不 commit 來源, 結束代碼不為 0
+    assert run_modes(args, config, api) == 1
+    assert "new1" not in mock.blacklist
+
+    # 來源沒有變更, 但上次沒有 commit, 仍會重試失敗的用戶
+    api.add_user = add_user  # type: ignore[method-assign]
+    assert run_modes(args, config, api) == 0
+    assert "new1" in mock.blacklist
+
+    mock.reset_counters()
+    assert run_modes(args, config, api) == 0
+    assert "friend_add.php" not in mock.hits